@@ -6,20 +6,29 @@ Contact: marketplace@terrascope.be
 
 """
 
+import argparse
 import json
+import sys
 from pathlib import Path
 from typing import Union, Sequence
 
-import openeo
 from openeo.api.process import Parameter
 from openeo.processes import ProcessBuilder, apply_neighborhood
 from openeo.rest.udp import build_process_dict
 
-from fusets.openeo import load_mogpr_udf
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.mogpr import DEFAULT_MODE, MODES, load_mogpr_udf  # noqa: E402
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.tiling import DEFAULT_CHUNK_SIZE  # noqa: E402
 
-from helper_functions import load_s1_collection, load_s2_collection
+from helper_functions import (
+    S1_COLLECTIONS,
+    S2_COLLECTIONS,
+    load_s1_collection,
+    load_s2_collection,
+)
 
-connection = openeo.connect("openeofed.dataspace.copernicus.eu")
+connection = connect_offline("openeofed.dataspace.copernicus.eu")
 
 
 def get_mogpr_s1_s2(
@@ -27,6 +36,9 @@ def get_mogpr_s1_s2(
     date: Union[Sequence[str], Parameter] = None,
     s1_collection: Union[str, Parameter] = None,
     s2_collection: Union[str, Parameter] = None,
+    chunk_size: Union[int, Parameter] = DEFAULT_CHUNK_SIZE,
+    chunk_overlap: Union[int, Parameter] = 0,
+    mode: Union[str, Parameter] = DEFAULT_MODE,
 ) -> ProcessBuilder:
     """
     Create a process graph for fusing Sentinel-1 and Sentinel-2 time series data using MOGPR.
@@ -34,6 +46,9 @@ def get_mogpr_s1_s2(
     :param date: Temporal extent for data loading.
     :param s1_collection: Sentinel-1 data collection to use.
     :param s2_collection: Sentinel-2 data collection to use.
+    :param chunk_size: Size in pixels of the chunks that are processed in parallel.
+    :param chunk_overlap: Overlap in pixels between neighbouring chunks.
+    :param mode: "exact" for the FuseTS regression, "sparse" for the sparse regression with inducing points.
     :return: ProcessBuilder representing the MOGPR fusion process graph.
     """
     s1_input_cube = load_s1_collection(connection, s1_collection, polygon, date)
@@ -45,6 +60,7 @@ def get_mogpr_s1_s2(
     return apply_neighborhood(
         merged_cube,
         lambda data: data.run_udf(
+            # The FuseTS dependencies are only set up by the exact mode of the UDF
             udf=(
                 Path(__file__).parent.parent.parent / "utils" / "set_dependency_path.py"
             ).read_text()
@@ -52,17 +68,29 @@ def get_mogpr_s1_s2(
             + load_mogpr_udf(),
             runtime="Python",
             version="3.8",
-            context=dict(),
+            context={"mode": mode},
         ),
         size=[
-            {"dimension": "x", "value": 32, "unit": "px"},
-            {"dimension": "y", "value": 32, "unit": "px"},
+            {"dimension": "x", "value": chunk_size, "unit": "px"},
+            {"dimension": "y", "value": chunk_size, "unit": "px"},
+        ],
+        overlap=[
+            {"dimension": "x", "value": chunk_overlap, "unit": "px"},
+            {"dimension": "y", "value": chunk_overlap, "unit": "px"},
         ],
-        overlap=[],
     )
 
 
-def generate() -> dict:
+def generate(s1_collection: str = None, s2_collection: str = None) -> dict:
+    """
+    Generate the MOGPR S1-S2 UDP. By default, the S1 and S2 collections are UDP parameters. When both collections
+    are given, a specialized UDP is generated that only contains the process graph of that combination.
+    :param s1_collection: Fixed S1 collection of a specialized UDP
+    :param s2_collection: Fixed S2 collection of a specialized UDP
+    :return: UDP definition
+    """
+    specialized = s1_collection is not None and s2_collection is not None
+
     # define parameters
     polygon = Parameter.spatial_extent(
         name="spatial_extent",
@@ -72,38 +100,93 @@ def generate() -> dict:
         name="temporal_extent",
         description="Temporal extent specified as two-element array with start and end date/date-time. \nThis is date range for which to apply the data fusion",
     )
-    s1_collection = Parameter.string(
+    s1_parameter = Parameter.string(
         name="s1_collection",
         description="S1 data collection to use for fusing the data.",
         default="RVI",
         values=["RVI", "GRD"],
     )
-    s2_collection = Parameter.string(
+    s2_parameter = Parameter.string(
         name="s2_collection",
         description="S2 data collection to use for fusing the data.",
         default="NDVI",
         values=["NDVI", "FAPAR", "LAI", "FCOVER", "EVI", "CCC", "CWC"],
     )
+    chunk_size = Parameter.integer(
+        name="chunk_size",
+        description="Size in pixels of the square chunks that are processed in parallel. Larger chunks reduce the overhead per chunk, but need more memory per worker.",
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    chunk_overlap = Parameter.integer(
+        name="chunk_overlap",
+        description="Overlap in pixels between neighbouring chunks.",
+        default=0,
+    )
+    mode = Parameter.string(
+        name="mode",
+        description="Regression mode. `exact` fits a Gaussian process with its own hyperparameters for every pixel. `sparse` approximates it with inducing points every 15 days and hyperparameters shared by the pixels of a chunk, which is much faster for long time series.",
+        default=DEFAULT_MODE,
+        values=MODES,
+    )
 
     # build the process graph for MOGPR S1-S2 fusion
     mogpr = get_mogpr_s1_s2(
         polygon=polygon,
         date=date,
-        s1_collection=s1_collection,
-        s2_collection=s2_collection,
+        s1_collection=s1_collection if specialized else s1_parameter,
+        s2_collection=s2_collection if specialized else s2_parameter,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        mode=mode,
     )
 
+    if specialized:
+        return build_process_dict(
+            process_graph=mogpr,
+            process_id=get_process_id(s1_collection, s2_collection),
+            summary=f"Integrate S1 {s1_collection} and S2 {s2_collection} timeseries using multi-output gaussian process regression",
+            description=(Path(__file__).parent / "readme.md").read_text(),
+            parameters=[polygon, date, chunk_size, chunk_overlap, mode],
+        )
     return build_process_dict(
         process_graph=mogpr,
         process_id="mogpr_s1s2",
         summary="Integrate S1 and S2 timeseries using multi-output gaussian process regression",
         description=(Path(__file__).parent / "readme.md").read_text(),
-        parameters=[polygon, date, s1_collection, s2_collection],
+        parameters=[
+            polygon,
+            date,
+            s1_parameter,
+            s2_parameter,
+            chunk_size,
+            chunk_overlap,
+            mode,
+        ],
     )
 
 
+def get_process_id(s1_collection: str, s2_collection: str) -> str:
+    return f"mogpr_s1s2_{s1_collection}_{s2_collection}".lower()
+
+
 if __name__ == "__main__":
-    # save the generated process to a file
-    with open("mogpr_s1s2.json", "w") as f:
-        json.dump(generate(), f, indent=2)
-        print("UDP 'mogpr_s1s2.json' generated.")
+    parser = argparse.ArgumentParser(description="Generate the MOGPR S1-S2 UDP")
+    parser.add_argument(
+        "--specialize",
+        action="store_true",
+        help="Generate a specialized UDP for every combination of S1 and S2 collection",
+    )
+    args = parser.parse_args()
+
+    if args.specialize:
+        for s1 in S1_COLLECTIONS:
+            for s2 in S2_COLLECTIONS:
+                process_id = get_process_id(s1, s2)
+                with open(f"{process_id}.json", "w") as f:
+                    json.dump(generate(s1.upper(), s2.upper()), f, indent=2)
+                    print(f"UDP '{process_id}.json' generated.")
+    else:
+        # save the generated process to a file
+        with open("mogpr_s1s2.json", "w") as f:
+            json.dump(generate(), f, indent=2)
+            print("UDP 'mogpr_s1s2.json' generated.")
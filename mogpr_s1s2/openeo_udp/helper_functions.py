@@ -1,9 +1,49 @@
 """
 Helper functions to load the different input data cubes for the FUSETS MoGPR algorithm.
+
+The supported collections are kept in a registry that maps each collection label to a function building its
+datacube. The functions are only called for the collections that can be selected, and the inputs they share
+(the S1 GRD bands and the masked S2 bands of a set of bands) are created once, so every sub-graph occurs only once in
+the UDP.
 """
 
+import functools
+
 from openeo.processes import process, if_, eq
 
+from utils.sentinel2 import load_masked_s2
+
+
+class _SharedInputs:
+    """
+    Lazily created input datacubes that are shared between the collections of the registry.
+    """
+
+    def __init__(self, connection, polygon, date):
+        self.connection = connection
+        self.polygon = polygon
+        self.date = date
+        self._s2_bands = {}
+
+    @functools.cached_property
+    def s1_grd(self):
+        return _load_s1_grd_bands(
+            self.connection, self.polygon, self.date, ["VV", "VH"]
+        )
+
+    def s2_bands(self, *bands):
+        """
+        Cloud masked S2 datacube of the given bands, so a collection only loads the bands it needs.
+        """
+        if bands not in self._s2_bands:
+            self._s2_bands[bands] = load_masked_s2(
+                self.connection,
+                spatial_extent=self.polygon,
+                temporal_extent=self.date,
+                bands=list(bands),
+            )
+        return self._s2_bands[bands]
+
 
 def _load_s1_grd_bands(connection, polygon, date, bands):
     """
@@ -21,16 +61,12 @@ def _load_s1_grd_bands(connection, polygon, date, bands):
     return s1_grd
 
 
-def _load_rvi(connection, polygon, date):
+def _compute_rvi(base_s1):
     """
     Create an RVI datacube based on the S1 VV and VH bands.
-    :param connection: openEO connection
-    :param polygon: Area of interest
-    :param date: Time of interest
+    :param base_s1: S1 datacube containing the VV and VH bands
     :return:
     """
-    base_s1 = _load_s1_grd_bands(connection, polygon, date, ["VV", "VH"])
-
     VH = base_s1.band("VH")
     VV = base_s1.band("VV")
     rvi = (VH + VH) / (VV + VH)
@@ -42,25 +78,12 @@ def _load_rvi(connection, polygon, date):
 #######################################################################################################################
 
 
-def _load_ndvi(connection, polygon, date):
+def _compute_ndvi(masked_s2):
     """
     Create an NDVI datacube based on the SENTINEL2_L2A data collection.
-    :param connection: openEO connection
-    :param polygon: Area of interest
-    :param date:
+    :param masked_s2: Cloud masked S2 datacube containing the B04 and B08 bands
     :return:
     """
-    base_s2 = connection.load_collection(
-        "SENTINEL2_L2A",
-        spatial_extent=polygon,
-        temporal_extent=date,
-        bands=["B04", "B08"],
-    )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A", spatial_extent=polygon, temporal_extent=date, bands=["SCL"]
-    )
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    masked_s2 = base_s2.mask(mask)
     ndvi = masked_s2.ndvi(red="B04", nir="B08")
     return ndvi
 
@@ -85,27 +108,17 @@ def _load_biopar(polygon, date, biopar):
     return base_biopar
 
 
-def _load_evi(connection, polygon, date):
+def _load_biopar_collection(inputs, biopar):
+    return _load_biopar(inputs.polygon, inputs.date, biopar)
+
+
+def _compute_evi(masked_s2):
     """
     Create an EVI datacube. More information is available at https://en.wikipedia.org/wiki/Enhanced_vegetation_index
-    :param connection: openEO connection
-    :param polygon: Area of interest
-    :param date: Time of interest
+    :param masked_s2: Cloud masked S2 datacube containing the B02, B04 and B08 bands
     :return:
     """
-    base_s2 = connection.load_collection(
-        collection_id="SENTINEL2_L2A",
-        spatial_extent=polygon,
-        temporal_extent=date,
-        bands=["B02", "B04", "B08"],
-    )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A", spatial_extent=polygon, temporal_extent=date, bands=["SCL"]
-    )
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    masked_s2 = base_s2.mask(mask)
-
-    B02 = masked_s2.band("B04")
+    B02 = masked_s2.band("B02")
     B04 = masked_s2.band("B04")
     B08 = masked_s2.band("B08")
 
@@ -113,6 +126,27 @@ def _load_evi(connection, polygon, date):
     return evi.add_dimension(name="bands", label="EVI", type="bands")
 
 
+#######################################################################################################################
+# Collection registry
+#######################################################################################################################
+
+S1_COLLECTIONS = {
+    "grd": lambda inputs: inputs.s1_grd,
+    "rvi": lambda inputs: _compute_rvi(inputs.s1_grd),
+}
+
+BIOPAR_COLLECTIONS = ["fapar", "lai", "fcover", "ccc", "cwc"]
+
+S2_COLLECTIONS = {
+    "ndvi": lambda inputs: _compute_ndvi(inputs.s2_bands("B04", "B08")),
+    "evi": lambda inputs: _compute_evi(inputs.s2_bands("B02", "B04", "B08")),
+    **{
+        label: functools.partial(_load_biopar_collection, biopar=label.upper())
+        for label in BIOPAR_COLLECTIONS
+    },
+}
+
+
 #######################################################################################################################
 # OpenEO UDP implementation
 #######################################################################################################################
@@ -131,87 +165,72 @@ def _build_collection_graph(collection, label, callable, reject):
     return if_(eq(collection, label, case_sensitive=False), callable, reject)
 
 
+def _build_dispatch(collection, options, default=None):
+    """
+    Chain the options into an if-else structure selecting the value that matches the collection parameter.
+
+    :param collection: openEO collection parameter
+    :param options: Mapping of collection label to the value selected for that label
+    :param default: Value when the collection matches none of the labels
+    :return:
+    """
+    collections = default
+    for label, value in options.items():
+        collections = _build_collection_graph(
+            collection=collection, label=label, callable=value, reject=collections
+        )
+    return collections
+
+
 def load_s1_collection(connection, collection, polygon, date):
     """
-    Create a S1 input data cube based on the collection selected by the user. This achieved by building an
-    if-else structure through the different openEO processes, making sure that the correct datacube is selected
-    when executing the UDP.
+    Create a S1 input data cube based on the collection selected by the user. When the collection is a UDP
+    parameter, this achieved by building an if-else structure through the different openEO processes, making sure
+    that the correct datacube is selected when executing the UDP. When the collection is a fixed label, only the
+    datacube of that collection is built.
 
     :param connection: openEO connection
-    :param collection: One of the supported collection (S1_COLLECTIONS)
+    :param collection: One of the supported collection (S1_COLLECTIONS), or a parameter selecting one of them
     :param polygon: Area of interest
     :param date:  Time of interest
     :return:
     """
-    collections = None
-    for option in [
-        {
-            "label": "grd",
-            "function": _load_s1_grd_bands(
-                connection=connection, polygon=polygon, date=date, bands=["VV", "VH"]
-            ),
-        },
-        {
-            "label": "rvi",
-            "function": _load_rvi(connection=connection, polygon=polygon, date=date),
-        },
-    ]:
-        collections = _build_collection_graph(
-            collection=collection,
-            label=option["label"],
-            callable=option["function"],
-            reject=collections,
-        )
-    return collections
+    inputs = _SharedInputs(connection, polygon, date)
+    if isinstance(collection, str):
+        return S1_COLLECTIONS[collection.lower()](inputs)
+    return _build_dispatch(
+        collection,
+        {label: build(inputs) for label, build in S1_COLLECTIONS.items()},
+    )
 
 
 def load_s2_collection(connection, collection, polygon, date):
     """
-    Create a S2 input data cube based on the collection selected by the user. This achieved by building an
-    if-else structure through the different openEO processes, making sure that the correct datacube is selected
-    when executing the UDP.
+    Create a S2 input data cube based on the collection selected by the user. When the collection is a UDP
+    parameter, this achieved by building an if-else structure through the different openEO processes, making sure
+    that the correct datacube is selected when executing the UDP, and null when the collection is not supported. All
+    BIOPAR collections select a single call of the BIOPAR service, of which the type is selected by the collection
+    parameter. When the collection is a fixed label, only the datacube of that collection is built.
 
     :param connection: openEO connection
-    :param collection: One of the supported collection (S2_COLLECTIONS)
+    :param collection: One of the supported collection (S2_COLLECTIONS), or a parameter selecting one of them
     :param polygon: Area of interest
     :param date:  Time of interest
     :return:
     """
-    collections = None
-    for option in [
-        {
-            "label": "ndvi",
-            "function": _load_ndvi(connection=connection, polygon=polygon, date=date),
-        },
-        {
-            "label": "fapar",
-            "function": _load_biopar(polygon=polygon, date=date, biopar="FAPAR"),
-        },
-        {
-            "label": "lai",
-            "function": _load_biopar(polygon=polygon, date=date, biopar="LAI"),
-        },
-        {
-            "label": "fcover",
-            "function": _load_biopar(polygon=polygon, date=date, biopar="FCOVER"),
-        },
-        {
-            "label": "evi",
-            "function": _load_evi(connection=connection, polygon=polygon, date=date),
-        },
-        {
-            "label": "ccc",
-            "function": _load_biopar(polygon=polygon, date=date, biopar="CCC"),
-        },
+    inputs = _SharedInputs(connection, polygon, date)
+    if isinstance(collection, str):
+        return S2_COLLECTIONS[collection.lower()](inputs)
+
+    biopar_type = _build_dispatch(
+        collection, {label: label.upper() for label in BIOPAR_COLLECTIONS}
+    )
+    biopar = _load_biopar(polygon, date, biopar_type)
+    return _build_dispatch(
+        collection,
         {
-            "label": "cwc",
-            "function": _load_biopar(polygon=polygon, date=date, biopar="CWC"),
+            label: biopar if label in BIOPAR_COLLECTIONS else build(inputs)
+            for label, build in S2_COLLECTIONS.items()
         },
-    ]:
-        collections = _build_collection_graph(
-            collection=collection,
-            label=option["label"],
-            callable=option["function"],
-            reject=collections,
-        )
-    return collections
+        default=None,
+    )
@@ -7,19 +7,24 @@ Contact: marketplace@terrascope.be
 """
 
 import json
+import sys
 from pathlib import Path
 
-import openeo
 from openeo.api.process import Parameter
 from openeo.processes import apply_neighborhood
 from openeo.rest.udp import build_process_dict
 
 from fusets.openeo import load_mogpr_udf
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+from utils.tiling import DEFAULT_CHUNK_SIZE  # noqa: E402
+
 
 def generate() -> dict:
     print("Generating UDP for MOGPR...")
-    connection = openeo.connect("openeofed.dataspace.copernicus.eu")
+    connection = connect_offline("openeofed.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -29,27 +34,27 @@ def generate() -> dict:
         name="temporal_extent",
         description="Temporal extent specified as two-element array with start and end date/date-time.",
     )
+    chunk_size = Parameter.integer(
+        name="chunk_size",
+        description="Size in pixels of the square chunks that are processed in parallel. Larger chunks reduce the overhead per chunk, but need more memory per worker.",
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    chunk_overlap = Parameter.integer(
+        name="chunk_overlap",
+        description="Overlap in pixels between neighbouring chunks.",
+        default=0,
+    )
 
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
+        temporal_extent=temporal_extent,
         bands=[
             "B04",
             "B08",
         ],
     )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
-    )
-    print("Applying cloud masking and calculating NDVI...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating NDVI...")
     base_ndvi = cube.ndvi(red="B04", nir="B08")
 
@@ -60,17 +65,20 @@ def generate() -> dict:
             udf=(
                 Path(__file__).parent.parent.parent / "utils" / "set_dependency_path.py"
             ).read_text()
-            + "\n"
+            + "\nsetup_fusets_dependencies()\n\n"
             + load_mogpr_udf(),
             runtime="Python",
             version="3.8",
             context=dict(),
         ),
         size=[
-            {"dimension": "x", "value": 32, "unit": "px"},
-            {"dimension": "y", "value": 32, "unit": "px"},
+            {"dimension": "x", "value": chunk_size, "unit": "px"},
+            {"dimension": "y", "value": chunk_size, "unit": "px"},
+        ],
+        overlap=[
+            {"dimension": "x", "value": chunk_overlap, "unit": "px"},
+            {"dimension": "y", "value": chunk_overlap, "unit": "px"},
         ],
-        overlap=[],
     )
 
     mogpr_ndvi = mogpr.aggregate_spatial(spatial_extent, reducer="mean")
@@ -83,6 +91,8 @@ def generate() -> dict:
         parameters=[
             spatial_extent,
             temporal_extent,
+            chunk_size,
+            chunk_overlap,
         ],
     )
 
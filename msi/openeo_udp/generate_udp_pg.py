@@ -7,16 +7,32 @@ Contact: marketplace@terrascope.be
 
 # import necessary modules
 import json
+import sys
 from pathlib import Path
 
-import openeo
 from openeo.api.process import Parameter
 from openeo.rest.udp import build_process_dict
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.output_profiles import (  # noqa: E402
+    apply_output_profile,
+    get_output_profile_parameter,
+)
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+from utils.time_series import (  # noqa: E402
+    get_geometries_parameter,
+    get_reducer_parameter,
+    raster_or_time_series,
+)
+
+# MSI is mostly between 0 and 3, but exceeds the int16 range of a scale of 10000 over water
+MSI_SCALE = 1000
+
 
 def generate() -> dict:
     print("Generating UDP for MSI...")
-    connection = openeo.connect("openeofed.dataspace.copernicus.eu")
+    connection = connect_offline("openeofed.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -26,24 +42,17 @@ def generate() -> dict:
         name="temporal_extent",
         description="Temporal extent specified as two-element array with start and end date/date-time.",
     )
+    output_profile = get_output_profile_parameter(scale=MSI_SCALE)
+    geometries = get_geometries_parameter()
+    reducer = get_reducer_parameter()
 
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
-        bands=["B08", "B11"],
-    )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
         temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
+        bands=["B08", "B11"],
     )
-    print("Applying cloud masking and calculating MSI...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating MSI...")
     # calculate MSI
     b08 = cube.band(0)
@@ -52,12 +61,20 @@ def generate() -> dict:
     print("MSI calculation complete.")
 
     return build_process_dict(
-        process_graph=msi,
+        process_graph=raster_or_time_series(
+            apply_output_profile(msi, output_profile, scale=MSI_SCALE),
+            msi,
+            geometries,
+            reducer,
+        ),
         process_id="msi",
         description=(Path(__file__).parent / "readme.md").read_text(),
         parameters=[
             spatial_extent,
             temporal_extent,
+            output_profile,
+            geometries,
+            reducer,
         ],
     )
 
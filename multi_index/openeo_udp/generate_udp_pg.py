@@ -0,0 +1,89 @@
+"""
+Implementation of a combined service computing several spectral indices from Sentinel-2 L2A in a single job.
+The Principal Investigator for this algorithm is the Terrascope Team of VITO Remote Sensing.
+Contact: marketplace@terrascope.be
+
+"""
+
+# import necessary modules
+import json
+import sys
+from pathlib import Path
+
+from openeo.api.process import Parameter
+from openeo.processes import apply_dimension, array_create
+from openeo.rest.udp import build_process_dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+from utils.spectral_indices import (  # noqa: E402
+    INDICES,
+    build_index,
+    get_required_bands,
+)
+
+
+def generate() -> dict:
+    print("Generating UDP for multiple indices...")
+    connection = connect_offline("openeofed.dataspace.copernicus.eu")
+    print("Defining parameters...")
+    spatial_extent = Parameter.spatial_extent(
+        name="spatial_extent",
+        description="Limits the data to process to the specified bounding box or polygons.\\n\\nFor raster data, the process loads the pixel into the data cube if the point at the pixel center intersects with the bounding box or any of the polygons (as defined in the Simple Features standard by the OGC).\\nFor vector data, the process loads the geometry into the data cube if the geometry is fully within the bounding box or any of the polygons (as defined in the Simple Features standard by the OGC). Empty geometries may only be in the data cube if no spatial extent has been provided.\\n\\nEmpty geometries are ignored.\\nSet this parameter to null to set no limit for the spatial extent.",
+    )
+    temporal_extent = Parameter.temporal_interval(
+        name="temporal_extent",
+        description="Temporal extent specified as two-element array with start and end date/date-time.",
+    )
+    indices = Parameter(
+        name="indices",
+        description="Spectral indices to compute. The result contains a band per index, in the given order.",
+        schema={
+            "type": "array",
+            "minItems": 1,
+            "uniqueItems": True,
+            "items": {"type": "string", "enum": list(INDICES)},
+        },
+        default=["NDVI", "EVI", "NBR", "NDWI"],
+    )
+
+    print("Loading data...")
+    # Load the bands of all supported indices, so the cube is read and masked only once
+    cube = load_masked_s2(
+        connection,
+        spatial_extent=spatial_extent,
+        temporal_extent=temporal_extent,
+        bands=get_required_bands(INDICES),
+    )
+    print("Calculating indices...")
+    # Every index is computed natively from the masked bands, and the requested ones are selected by name:
+    # filter_bands returns the bands in the order of `indices`
+    result = apply_dimension(
+        cube,
+        process=lambda data: array_create(
+            [build_index(data, index) for index in INDICES]
+        ),
+        dimension="bands",
+    )
+    result = result.rename_labels(dimension="bands", target=list(INDICES))
+    result = result.filter_bands(bands=indices)
+    print("Index calculation complete.")
+
+    return build_process_dict(
+        process_graph=result,
+        process_id="multi_index",
+        summary="Calculate multiple spectral indices from Sentinel-2 L2A in a single job",
+        description=(Path(__file__).parent / "readme.md").read_text(),
+        parameters=[
+            spatial_extent,
+            temporal_extent,
+            indices,
+        ],
+    )
+
+
+if __name__ == "__main__":
+    with open("multi_index.json", "w") as f:
+        json.dump(generate(), f, indent=2)
+    print("UDP 'multi_index.json' generated.")
@@ -8,16 +8,29 @@ Contact: marketplace@terrascope.be
 
 # import necessary modules
 import json
+import sys
 from pathlib import Path
 
-import openeo
 from openeo.api.process import Parameter
 from openeo.rest.udp import build_process_dict
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.output_profiles import (  # noqa: E402
+    apply_output_profile,
+    get_output_profile_parameter,
+)
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+from utils.time_series import (  # noqa: E402
+    get_geometries_parameter,
+    get_reducer_parameter,
+    raster_or_time_series,
+)
+
 
 def generate() -> dict:
     print("Generating UDP for NDII...")
-    connection = openeo.connect("openeofed.dataspace.copernicus.eu")
+    connection = connect_offline("openeofed.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -27,24 +40,17 @@ def generate() -> dict:
         name="temporal_extent",
         description="Temporal extent specified as two-element array with start and end date/date-time.",
     )
+    output_profile = get_output_profile_parameter()
+    geometries = get_geometries_parameter()
+    reducer = get_reducer_parameter()
 
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
-        bands=["B8A", "B11"],
-    )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
         temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
+        bands=["B8A", "B11"],
     )
-    print("Applying cloud masking and calculating NDII...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating NDII...")
     # calculate ndii
     b8a = cube.band(0)
@@ -54,12 +60,17 @@ def generate() -> dict:
     print("NDII calculation complete.")
 
     return build_process_dict(
-        process_graph=ndii,
+        process_graph=raster_or_time_series(
+            apply_output_profile(ndii, output_profile), ndii, geometries, reducer
+        ),
         process_id="ndii",
         description=(Path(__file__).parent / "readme.md").read_text(),
         parameters=[
             spatial_extent,
             temporal_extent,
+            output_profile,
+            geometries,
+            reducer,
         ],
     )
 
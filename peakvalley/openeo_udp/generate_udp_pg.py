@@ -1,20 +1,24 @@
 """ "
 This script generates the OpenEO UDP for the PeakValley algorithm.
-Implemented by https://open-eo.github.io/FuseTS/
+Based on the implementation of https://open-eo.github.io/FuseTS/
 Contact: marketplace@terrascope.be
 """
 
 import json
+import sys
 from pathlib import Path
 from typing import Union
 
-import openeo
-from fusets.openeo.peakvalley_udf import load_peakvalley_udf
 from openeo import DataCube
 from openeo.api.process import Parameter
 from openeo.processes import ProcessBuilder, apply_dimension
 from openeo.rest.udp import build_process_dict
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.peakvalley import load_peakvalley_udf  # noqa: E402
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+
 
 def create_context_param(label: str, param: Union[Parameter, any]):
     if isinstance(param, Parameter):
@@ -37,11 +41,7 @@ def get_peakvalley(
     return apply_dimension(
         input_cube,
         process=lambda x: x.run_udf(
-            udf=(
-                Path(__file__).parent.parent.parent / "utils" / "set_dependency_path.py"
-            ).read_text()
-            + "\n"
-            + load_peakvalley_udf(),
+            udf=load_peakvalley_udf(),
             runtime="Python",
             version="3.8",
             context=context,
@@ -52,7 +52,7 @@ def get_peakvalley(
 
 def generate() -> dict:
     print("Generating UDP for PeakValley...")
-    connection = openeo.connect("openeofed.dataspace.copernicus.eu")
+    connection = connect_offline("openeofed.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -79,25 +79,15 @@ def generate() -> dict:
     )
 
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
+        temporal_extent=temporal_extent,
         bands=[
             "B04",
             "B08",
         ],
     )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
-    )
-    print("Applying cloud masking and calculating NDVI...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating NDVI...")
     base_ndvi = cube.ndvi(red="B04", nir="B08")
 
@@ -1,23 +1,26 @@
 """ "
 This script generates the OpenEO UDP for the Phenology algorithm.
-Implemented by https://open-eo.github.io/FuseTS/
+Based on the implementation of https://open-eo.github.io/FuseTS/
 Contact: marketplace@terrascope.be
 """
 
 from pathlib import Path
 import json
+import sys
 
-import openeo
-from fusets.openeo.phenology_udf import load_phenology_udf
-from fusets.openeo.services.publish_phenology import phenology_bands
 from openeo.api.process import Parameter
 from openeo.processes import apply_dimension
 from openeo.rest.udp import build_process_dict
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.phenology import PHENOLOGY_BANDS, load_phenology_udf  # noqa: E402
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+
 
 def generate() -> dict:
     print("Generating UDP for Phenology...")
-    connection = openeo.connect("openeo.dataspace.copernicus.eu")
+    connection = connect_offline("openeo.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -28,36 +31,22 @@ def generate() -> dict:
         description="Temporal extent specified as two-element array with start and end date/date-time.",
     )
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
+        temporal_extent=temporal_extent,
         bands=[
             "B04",
             "B08",
         ],
     )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
-    )
-    print("Applying cloud masking and calculating NDVI...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating NDVI...")
     base_ndvi = cube.ndvi(red="B04", nir="B08")
 
     phenology = apply_dimension(
         data=base_ndvi,
         process=lambda x: x.run_udf(
-            udf=(
-                Path(__file__).parent.parent.parent / "utils" / "set_dependency_path.py"
-            ).read_text()
-            + "\n"
-            + load_phenology_udf(),
+            udf=load_phenology_udf(),
             runtime="Python",
             version="3.8",
         ),
@@ -65,8 +54,8 @@ def generate() -> dict:
         target_dimension="phenology",
     )
 
-    phenology = phenology.add_dimension("var", phenology_bands[0], "bands")
-    phenology = phenology.rename_labels(dimension="var", target=phenology_bands)
+    phenology = phenology.add_dimension("var", PHENOLOGY_BANDS[0], "bands")
+    phenology = phenology.rename_labels(dimension="var", target=PHENOLOGY_BANDS)
 
     return build_process_dict(
         process_graph=phenology,
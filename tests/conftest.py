@@ -0,0 +1,84 @@
+import datetime
+import http.server
+import os
+import threading
+
+import pytest
+
+# The UDF modules set up their dependencies on import, which is not needed in the test environment
+os.environ.setdefault("OPENEO_UDF_DEPENDENCIES_PROVIDED", "1")
+
+from utils.offline_connection import OfflineRequestHandler  # noqa: E402
+from utils.scenario_grid import START_DATE, get_extent, write_fixture  # noqa: E402
+
+# Area of interest of 300 m by 300 m and time span of the fixtures
+EXTENT = get_extent(9e4)
+DAYS = 60
+TEMPORAL_EXTENT = [
+    START_DATE.isoformat(),
+    (START_DATE + datetime.timedelta(days=DAYS)).isoformat(),
+]
+
+
+@pytest.fixture
+def mock_backend(monkeypatch):
+    """
+    Start the mock backend of `utils.offline_connection` on a free port, as `--serve` does.
+    :return: Function taking the fixtures folder and failure rate, and returning the URL of the backend
+    """
+    servers = []
+
+    def start(fixtures_dir=None, failure_rate=0.0):
+        monkeypatch.setattr(OfflineRequestHandler, "fixtures_dir", fixtures_dir)
+        monkeypatch.setattr(OfflineRequestHandler, "failure_rate", failure_rate)
+        monkeypatch.setattr(OfflineRequestHandler, "jobs", {})
+        monkeypatch.setattr(OfflineRequestHandler, "log_message", lambda *args: None)
+        server = http.server.ThreadingHTTPServer(
+            ("localhost", 0), OfflineRequestHandler
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://localhost:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope="session")
+def fixtures_dir(tmp_path_factory):
+    """
+    Synthetic Sentinel-2 fixtures of EXTENT over DAYS days, for the mock backend.
+    """
+    path = tmp_path_factory.mktemp("fixtures")
+    write_fixture("SENTINEL2_L2A", EXTENT, DAYS, path / "SENTINEL2_L2A")
+    return path
+
+
+@pytest.fixture
+def parcels():
+    """
+    FeatureCollection of small square parcels on a regular grid within EXTENT.
+    """
+    (west, south), _, (east, north) = EXTENT["coordinates"][0][:3]
+    size = (east - west) / 10
+    features = []
+    for row in range(3):
+        for column in range(4):
+            x = west + (2 * column + 1) * (east - west) / 8 - size / 2
+            y = south + (2 * row + 1) * (north - south) / 6 - size / 2
+            ring = [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": {},
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                }
+            )
+    return {"type": "FeatureCollection", "features": features}
+
+
+@pytest.fixture
+def temporal_extent():
+    return list(TEMPORAL_EXTENT)
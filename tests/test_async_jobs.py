@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+
+import openeo
+import pytest
+import requests
+from openeo.rest.job import ResultAsset
+
+from utils import async_jobs
+from utils.async_jobs import create_session, get_udp_job, run_jobs, wait_for_job
+from utils.offline_connection import OfflineRequestHandler
+
+
+class FakeJob:
+    """
+    Batch job of which the status follows a fixed sequence, an exception in the sequence is raised by `status`.
+    """
+
+    def __init__(self, statuses):
+        self.statuses = iter(statuses)
+
+    def status(self):
+        status = next(self.statuses)
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record the intervals between the status requests instead of sleeping.
+    """
+    intervals = []
+
+    async def sleep(seconds):
+        intervals.append(seconds)
+
+    monkeypatch.setattr(async_jobs.asyncio, "sleep", sleep)
+    monkeypatch.setattr(async_jobs.random, "uniform", lambda a, b: 1.0)
+    return intervals
+
+
+class ConcurrencyCounter:
+    """
+    Wraps a function and records the maximum number of concurrent calls.
+    """
+
+    def __init__(self, function, delay=0.0):
+        self.function = function
+        self.delay = delay
+        self.current = self.maximum = 0
+        self.lock = threading.Lock()
+
+    @property
+    def method(self):
+        return lambda instance, *args, **kwargs: self(instance, *args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            self.current += 1
+            self.maximum = max(self.maximum, self.current)
+        try:
+            time.sleep(self.delay)
+            return self.function(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.current -= 1
+
+
+def test_wait_for_job_backs_off_while_status_is_unchanged(sleeps):
+    job = FakeJob(["queued"] * 4 + ["running"] * 2 + ["finished"])
+
+    status = asyncio.run(wait_for_job(job, min_interval=1, max_interval=3, backoff=2))
+
+    assert status == "finished"
+    assert sleeps == [1, 2, 3, 3, 1, 2]
+
+
+def test_wait_for_job_tolerates_soft_errors(sleeps):
+    error = requests.ConnectionError("connection reset")
+    job = FakeJob(["running", error, error, "running", "error"])
+    assert asyncio.run(wait_for_job(job, min_interval=1, soft_errors=2)) == "error"
+
+    job = FakeJob(["running", error, error, error])
+    with pytest.raises(requests.ConnectionError):
+        asyncio.run(wait_for_job(job, min_interval=1, soft_errors=2))
+
+
+def test_run_jobs_bounds_running_jobs_and_downloads(
+    mock_backend, fixtures_dir, parcels, temporal_extent, tmp_path, monkeypatch
+):
+    running = ConcurrencyCounter(OfflineRequestHandler.run_job)
+    monkeypatch.setattr(OfflineRequestHandler, "run_job", running.method)
+    downloads = ConcurrencyCounter(ResultAsset.download, delay=0.2)
+    monkeypatch.setattr(ResultAsset, "download", downloads.method)
+    connection = openeo.connect(
+        mock_backend(fixtures_dir), session=create_session(4), auto_validate=False
+    )
+    jobs = [
+        get_udp_job(
+            f"evi_{i}",
+            "evi",
+            {
+                "spatial_extent": feature["geometry"],
+                "temporal_extent": temporal_extent,
+            },
+        )
+        for i, feature in enumerate(parcels["features"][:6])
+    ]
+
+    records = asyncio.run(
+        run_jobs(
+            connection,
+            jobs,
+            tmp_path,
+            max_running=2,
+            max_downloads=2,
+            min_interval=0.05,
+            max_interval=0.2,
+        )
+    )
+
+    assert [record["status"] for record in records] == ["ok"] * 6
+    assert all((tmp_path / job.name / "result.nc").exists() for job in jobs)
+    assert all(record["output_bytes"] > 0 for record in records)
+    assert running.maximum <= 2
+    assert downloads.maximum == 2
+
+
+def test_run_jobs_records_failed_jobs(
+    mock_backend, fixtures_dir, temporal_extent, tmp_path
+):
+    connection = openeo.connect(
+        mock_backend(fixtures_dir, failure_rate=1.0), auto_validate=False
+    )
+    job = get_udp_job("evi", "evi", {"temporal_extent": temporal_extent})
+
+    [record] = asyncio.run(run_jobs(connection, [job], tmp_path, min_interval=0.05))
+
+    assert record["status"] == "failed"
+    assert record["job_id"] in OfflineRequestHandler.jobs
+    assert "Simulated failure" in record["error"]
@@ -0,0 +1,155 @@
+import itertools
+import math
+import threading
+
+import numpy as np
+import openeo
+import pytest
+import xarray as xr
+
+from utils import offline_connection
+from utils.batch_runner import (
+    Bin,
+    get_arguments,
+    get_bbox,
+    merge_results,
+    run_batch,
+    run_job,
+    split_into_bins,
+)
+from utils.offline_connection import OfflineRequestHandler
+from utils.sentinel2 import SCL_DILATION_RADIUS
+
+
+@pytest.fixture
+def alternating_failures(monkeypatch):
+    """
+    Let every other processing request of the mock backend fail, starting with the first.
+    """
+    draws = itertools.cycle([0.0, 1.0])
+    lock = threading.Lock()
+
+    def random():
+        with lock:
+            return next(draws)
+
+    monkeypatch.setattr(offline_connection.random, "random", random)
+
+
+def test_split_into_bins(parcels, temporal_extent):
+    bins = split_into_bins(parcels, temporal_extent, max_features=5)
+
+    assert len(bins) > 1
+    assert all(len(bin.features) <= 5 for bin in bins)
+    assert sorted(i for bin in bins for i in bin.features) == list(range(12))
+    for bin in bins:
+        west, south, east, north = bin.bbox
+        for i in bin.features:
+            x0, y0, x1, y1 = get_bbox([parcels["features"][i]["geometry"]])
+            assert west <= x0 and x1 <= east and south <= y0 and y1 <= north
+
+
+def test_run_batch_retries_failed_jobs(
+    mock_backend, fixtures_dir, parcels, temporal_extent, tmp_path, alternating_failures
+):
+    connection = openeo.connect(
+        mock_backend(fixtures_dir, failure_rate=0.5), auto_validate=False
+    )
+
+    results, failures = run_batch(
+        connection,
+        "evi",
+        parcels,
+        temporal_extent,
+        tmp_path / "bins",
+        max_features=5,
+        retries=3,
+        poll_interval=0.1,
+        backoff=0,
+    )
+
+    assert failures == {}
+    assert sorted(i for bin in results for i in bin.features) == list(range(12))
+    assert all(path.exists() for path in results.values())
+    # Every bin failed at least once before it succeeded
+    statuses = [job["status"] for job in OfflineRequestHandler.jobs.values()]
+    assert statuses.count("finished") == len(results)
+    assert statuses.count("error") >= len(results)
+
+
+def test_run_batch_reports_failures(
+    mock_backend, fixtures_dir, parcels, temporal_extent, tmp_path
+):
+    connection = openeo.connect(
+        mock_backend(fixtures_dir, failure_rate=1.0), auto_validate=False
+    )
+
+    results, failures = run_batch(
+        connection,
+        "evi",
+        parcels,
+        temporal_extent,
+        tmp_path,
+        max_features=5,
+        retries=1,
+        mode="sync",
+        backoff=0,
+    )
+
+    assert results == {}
+    assert sum(len(bin.features) for bin in failures) == 12
+
+
+def test_merge_results(mock_backend, fixtures_dir, parcels, temporal_extent, tmp_path):
+    connection = openeo.connect(mock_backend(fixtures_dir), auto_validate=False)
+    results, _ = run_batch(
+        connection,
+        "evi",
+        parcels,
+        temporal_extent,
+        tmp_path / "bins",
+        max_features=5,
+        mode="sync",
+    )
+    merge_results(results, tmp_path / "merged.nc")
+
+    features = tuple(range(12))
+    single = Bin("all", features, get_bbox(f["geometry"] for f in parcels["features"]))
+    run_job(
+        connection,
+        "evi",
+        get_arguments("evi", single, parcels, temporal_extent),
+        tmp_path / "single.nc",
+        mode="sync",
+    )
+    with xr.open_dataset(tmp_path / "merged.nc") as merged:
+        merged = merged["data"].load()
+    assert list(merged["geometry"].values) == list(features)
+    for bin, path in results.items():
+        with xr.open_dataset(path) as dataset:
+            np.testing.assert_array_equal(
+                merged.sel(geometry=list(bin.features)).values,
+                dataset["data"].transpose(*merged.dims).values,
+            )
+    # The extent of every bin covers the dilated cloud mask of its parcels, so the bins agree with the single job
+    with xr.open_dataset(tmp_path / "single.nc") as dataset:
+        expected = dataset["data"].transpose(*merged.dims).values
+    np.testing.assert_array_equal(merged.values, expected)
+
+
+def test_get_arguments_pads_the_extent_by_the_cloud_mask(parcels, temporal_extent):
+    bin = split_into_bins(parcels, temporal_extent, max_features=5)[0]
+
+    arguments = get_arguments("evi", bin, parcels, temporal_extent)
+
+    extent = arguments["spatial_extent"]
+    west, south, east, north = bin.bbox
+    metres_per_degree = 111320 * math.cos(math.radians((south + north) / 2))
+    padding = [
+        (west - extent["west"]) * metres_per_degree,
+        (extent["east"] - east) * metres_per_degree,
+        (south - extent["south"]) * 110540,
+        (extent["north"] - north) * 110540,
+    ]
+    assert padding == pytest.approx([SCL_DILATION_RADIUS] * 4)
+    assert len(arguments["geometries"]["features"]) == len(bin.features)
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from utils import local_executor
+from utils.benchmark import run_scenario
+from utils.output_profiles import SAVE_RESULT_PRESETS
+from utils.scenario_grid import build_scenario
+
+
+@pytest.fixture
+def scenario(tmp_path, parcels, temporal_extent):
+    """
+    Function writing an evi scenario over the parcels, saved with a preset of `utils.output_profiles`.
+    """
+
+    def write(preset: str):
+        process_graph = build_scenario(
+            "evi", {"spatial_extent": parcels, "temporal_extent": temporal_extent}
+        )
+        process_graph["process_graph"]["saveresult1"]["arguments"].update(
+            SAVE_RESULT_PRESETS[preset]
+        )
+        path = tmp_path / f"evi_{preset}.json"
+        path.write_text(json.dumps(process_graph))
+        return path
+
+    return write
+
+
+def test_run_scenario_measures_the_encoded_output(scenario, fixtures_dir):
+    result = run_scenario(scenario("netcdf"), "local", fixtures_dir)
+
+    assert result["wall_time"] > 0
+    assert result["peak_rss_mib"] > 0
+    assert result["output_bytes"] > 0
+    assert result["error"] == ""
+
+
+def test_run_scenario_survives_a_failed_encoding(scenario, fixtures_dir, monkeypatch):
+    def save(result, path):
+        raise ModuleNotFoundError("No module named 'rioxarray'")
+
+    monkeypatch.setattr(local_executor, "save", save)
+
+    result = run_scenario(scenario("cog"), "local", fixtures_dir)
+
+    assert result["wall_time"] > 0
+    assert result["peak_rss_mib"] > 0
+    assert result["output_bytes"] is None
+    assert "rioxarray" in result["error"]
@@ -0,0 +1,284 @@
+import numpy as np
+import pytest
+import xarray as xr
+from scipy import ndimage
+
+from utils import local_executor
+from utils.local_executor import LocalExecutor, ProcessGraphError
+
+DATES = np.array(
+    ["2023-06-01", "2023-06-03", "2023-06-06", "2023-06-08"], dtype="datetime64[ns]"
+)
+
+
+@pytest.fixture
+def executor(tmp_path):
+    """
+    Executor with a fixture of 4 dates of 10 by 12 pixels, with the latitudes in decreasing order like a raster.
+    """
+    rng = np.random.default_rng(0)
+    coords = {"t": DATES, "y": np.arange(9.5, 0, -1), "x": np.arange(0.5, 12)}
+    xr.Dataset(
+        {
+            band: (("t", "y", "x"), rng.random((4, 10, 12)))
+            for band in ["B04", "B08", "SCL"]
+        },
+        coords=coords,
+    ).to_netcdf(tmp_path / "TEST.nc")
+    return LocalExecutor(tmp_path)
+
+
+def node(process_id: str, result: bool = False, **arguments) -> dict:
+    return {"process_id": process_id, "arguments": arguments, "result": result}
+
+
+def callback(process_id: str, **arguments) -> dict:
+    return {"process_graph": {"node": node(process_id, result=True, **arguments)}}
+
+
+def run(executor: LocalExecutor, *nodes: dict):
+    """
+    Execute a chain of nodes, of which every node can refer to the previous one as {"from_node": "previous"}.
+    """
+    process_graph = {}
+    for index, value in enumerate(nodes):
+        value = dict(value, result=index == len(nodes) - 1)
+        if index:
+            value["arguments"] = {
+                k: {"from_node": f"n{index - 1}"}
+                if v == {"from_node": "previous"}
+                else v
+                for k, v in value["arguments"].items()
+            }
+        process_graph[f"n{index}"] = value
+    return executor.execute({"process_graph": process_graph})
+
+
+def load(executor: LocalExecutor, **arguments) -> xr.DataArray:
+    return run(executor, node("load_collection", id="TEST", **arguments))
+
+
+def test_load_collection_spatial_extent(executor):
+    extent = {"west": 2, "south": 3, "east": 5, "north": 6}
+
+    cube = load(executor, spatial_extent=extent)
+
+    assert cube.dims == ("t", "bands", "y", "x")
+    np.testing.assert_array_equal(cube["x"], [2.5, 3.5, 4.5])
+    np.testing.assert_array_equal(cube["y"], [5.5, 4.5, 3.5])
+
+    # The bounding box of a polygon selects the same pixels
+    ring = [[2, 3], [5, 3], [5, 6], [2, 6], [2, 3]]
+    polygon = load(executor, spatial_extent={"type": "Polygon", "coordinates": [ring]})
+    xr.testing.assert_equal(polygon, cube)
+
+
+def test_load_collection_temporal_extent(executor):
+    def dates(temporal_extent):
+        cube = load(executor, temporal_extent=temporal_extent)
+        return [str(t)[:10] for t in cube["t"].values]
+
+    # The end of the extent is exclusive
+    assert dates(["2023-06-01", "2023-06-06"]) == ["2023-06-01", "2023-06-03"]
+    # An extent of a single day selects that day
+    assert dates(["2023-06-03", "2023-06-03"]) == ["2023-06-03"]
+    assert dates([None, "2023-06-03"]) == ["2023-06-01"]
+    assert dates(["2023-06-04", None]) == ["2023-06-06", "2023-06-08"]
+
+
+def test_load_collection_bands(executor):
+    cube = load(executor, bands=["B08", "B04"])
+
+    assert list(cube["bands"].values) == ["B08", "B04"]
+
+
+@pytest.mark.parametrize("overlap", [1, 2])
+def test_apply_neighborhood_stitches_the_tiles(executor, monkeypatch, overlap):
+    def mean_filter(executor, args):
+        data = args["data"]
+        return data.copy(data=ndimage.uniform_filter(data.values, (1, 1, 3, 3)))
+
+    monkeypatch.setitem(local_executor.PROCESSES, "mean_filter", mean_filter)
+    cube = load(executor)
+
+    def tiled(overlap):
+        return run(
+            executor,
+            node("load_collection", id="TEST"),
+            node(
+                "apply_neighborhood",
+                data={"from_node": "previous"},
+                process=callback("mean_filter", data={"from_parameter": "data"}),
+                # Tiles of 4 by 4 pixels, of which the last row and column are smaller
+                size=[
+                    {"dimension": "x", "value": 4, "unit": "px"},
+                    {"dimension": "y", "value": 4, "unit": "px"},
+                ],
+                overlap=[
+                    {"dimension": "x", "value": overlap, "unit": "px"},
+                    {"dimension": "y", "value": overlap, "unit": "px"},
+                ],
+            ),
+        )
+
+    result = tiled(overlap)
+
+    assert result.dims == cube.dims
+    xr.testing.assert_equal(result["x"], cube["x"])
+    xr.testing.assert_equal(result["y"], cube["y"])
+    np.testing.assert_allclose(
+        result.values, ndimage.uniform_filter(cube.values, (1, 1, 3, 3))
+    )
+    # Without overlap, the pixels at the edges of the tiles differ
+    assert not np.allclose(tiled(0).values, result.values)
+
+
+def test_merge_cubes_resolves_overlapping_bands(executor):
+    process_graph = {
+        "cube1": node("load_collection", id="TEST", bands=["B04", "B08"]),
+        "cube2": node("load_collection", id="TEST", bands=["B08", "SCL"]),
+        "merge": node(
+            "merge_cubes",
+            result=True,
+            cube1={"from_node": "cube1"},
+            cube2={"from_node": "cube2"},
+            overlap_resolver=callback(
+                "add", x={"from_parameter": "x"}, y={"from_parameter": "y"}
+            ),
+        ),
+    }
+
+    merged = executor.execute({"process_graph": process_graph})
+
+    cube = load(executor)
+    assert list(merged["bands"].values) == ["B04", "B08", "SCL"]
+    xr.testing.assert_allclose(merged.sel(bands="B04"), cube.sel(bands="B04"))
+    xr.testing.assert_allclose(merged.sel(bands="B08"), 2 * cube.sel(bands="B08"))
+    xr.testing.assert_allclose(merged.sel(bands="SCL"), cube.sel(bands="SCL"))
+
+    del process_graph["merge"]["arguments"]["overlap_resolver"]
+    with pytest.raises(ProcessGraphError, match="overlap resolver"):
+        executor.execute({"process_graph": process_graph})
+
+
+def test_aggregate_spatial_excludes_holes(executor):
+    outer = [[1, 1], [9, 1], [9, 9], [1, 9], [1, 1]]
+    hole = [[3, 3], [6, 3], [6, 6], [3, 6], [3, 3]]
+    square = [[10, 0], [12, 0], [12, 2], [10, 2], [10, 0]]
+    geometries = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": c}}
+            for c in [[outer, hole], [outer], [square]]
+        ],
+    }
+
+    result = run(
+        executor,
+        node("load_collection", id="TEST", bands=["B04"]),
+        node(
+            "aggregate_spatial",
+            data={"from_node": "previous"},
+            geometries=geometries,
+            reducer=callback("mean", data={"from_parameter": "data"}),
+        ),
+    )
+
+    assert result.dims == ("geometry", "t", "bands")
+    cube = load(executor, bands=["B04"])
+    inside = (cube["x"] > 1) & (cube["x"] < 9) & (cube["y"] > 1) & (cube["y"] < 9)
+    in_hole = (cube["x"] > 3) & (cube["x"] < 6) & (cube["y"] > 3) & (cube["y"] < 6)
+    expected = cube.where(inside & ~in_hole).mean(["y", "x"])
+    np.testing.assert_allclose(result.isel(geometry=0), expected)
+    np.testing.assert_allclose(
+        result.isel(geometry=1), cube.where(inside).mean(["y", "x"])
+    )
+    # 8 by 8 pixels, without the 3 by 3 pixels of the hole
+    counts = run(
+        executor,
+        node("load_collection", id="TEST", bands=["B04"]),
+        node(
+            "apply",
+            data={"from_node": "previous"},
+            process=callback("is_valid", x={"from_parameter": "x"}),
+        ),
+        node(
+            "aggregate_spatial",
+            data={"from_node": "previous"},
+            geometries=geometries,
+            reducer=callback("sum", data={"from_parameter": "data"}),
+        ),
+    )
+    np.testing.assert_array_equal(counts.isel(geometry=0), 64 - 9)
+    np.testing.assert_array_equal(counts.isel(geometry=2), 4)
+
+
+def test_if_on_values_and_data_cubes(executor):
+    assert run(executor, node("if", value=True, accept=1, reject=2)) == 1
+    assert run(executor, node("if", value=False, accept=1)) is None
+
+    # Only the selected branch is evaluated
+    process_graph = {
+        "missing": node("load_collection", id="MISSING"),
+        "if": node(
+            "if", result=True, value=True, accept=1, reject={"from_node": "missing"}
+        ),
+    }
+    assert executor.execute({"process_graph": process_graph}) == 1
+
+    result = run(
+        executor,
+        node("load_collection", id="TEST", bands=["B04"]),
+        node(
+            "apply",
+            data={"from_node": "previous"},
+            process={
+                "process_graph": {
+                    "gt": node("gt", x={"from_parameter": "x"}, y=0.5),
+                    "if": node(
+                        "if",
+                        result=True,
+                        value={"from_node": "gt"},
+                        accept={"from_parameter": "x"},
+                        reject=0,
+                    ),
+                }
+            },
+        ),
+    )
+    cube = load(executor, bands=["B04"])
+    xr.testing.assert_allclose(result, cube.where(cube > 0.5, 0))
+
+
+def test_not_and_is_valid(executor):
+    assert run(executor, node("not", x=True)) is False
+    assert run(executor, node("not", x=False)) is True
+    assert run(executor, node("not", x=None)) is None
+    assert run(executor, node("is_valid", x=np.nan)) is False
+    assert run(executor, node("is_valid", x=None)) is False
+    assert run(executor, node("is_valid", x=0)) is True
+
+    cube = load(executor, bands=["B04"])
+    cube = cube.where(cube > 0.2)
+    invalid = run(
+        executor,
+        node("load_collection", id="TEST", bands=["B04"]),
+        node(
+            "apply",
+            data={"from_node": "previous"},
+            process={
+                "process_graph": {
+                    "gt": node("gt", x={"from_parameter": "x"}, y=0.2),
+                    "mask": node(
+                        "if",
+                        value={"from_node": "gt"},
+                        accept={"from_parameter": "x"},
+                    ),
+                    "valid": node("is_valid", x={"from_node": "mask"}),
+                    "not": node("not", result=True, x={"from_node": "valid"}),
+                }
+            },
+        ),
+    )
+    assert invalid.dtype == bool
+    xr.testing.assert_equal(invalid, cube.isnull())
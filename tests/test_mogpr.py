@@ -0,0 +1,135 @@
+import datetime
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from utils import mogpr
+from utils.mogpr import (
+    Hyperparameters,
+    _SparseModel,
+    get_output_days,
+    matern32,
+    normalize,
+    sparse_mogpr,
+)
+from utils.mogpr_benchmark import exact_mogpr, get_synthetic_block, rmse
+
+HYPERPARAMETERS = Hyperparameters(
+    40.0, np.array([[0.8, 0.5], [0.5, 0.6]]), np.array([0.05, 0.2])
+)
+
+
+@pytest.fixture(scope="module")
+def block():
+    return get_synthetic_block(size=4, years=1)
+
+
+def exact_log_likelihood(normalized, observed, days, hyperparameters):
+    """
+    Log marginal likelihood of the normalized observations of every pixel under the exact Gaussian process.
+    """
+    lengthscale, coregionalization, noise = hyperparameters
+    kff = np.kron(coregionalization, matern32(days, days, lengthscale))
+    total = 0.0
+    for values, mask in zip(normalized, observed):
+        mask = mask.reshape(-1)
+        y = values.reshape(-1)[mask]
+        covariance = kff[np.ix_(mask, mask)] + np.diag(
+            np.repeat(noise, len(days))[mask]
+        )
+        _, logdet = np.linalg.slogdet(covariance)
+        fit = y @ np.linalg.solve(covariance, y)
+        total -= 0.5 * (fit + logdet + len(y) * np.log(2 * np.pi))
+    return total
+
+
+def test_sparse_model_is_exact_with_an_inducing_point_per_date(block):
+    values, days, _ = block
+    days = days[:40]
+    values = values[:5, :, :40]
+    normalized, mean, std = normalize(values)
+    observed = ~np.isnan(values)
+    model = _SparseModel(HYPERPARAMETERS, days, days)
+
+    np.testing.assert_allclose(
+        model.bound(normalized, observed),
+        exact_log_likelihood(normalized, observed, days, HYPERPARAMETERS),
+        rtol=1e-4,
+    )
+    predicted = model.predict(normalized, observed, get_output_days(days))
+    np.testing.assert_allclose(
+        predicted * std + mean,
+        exact_mogpr(values, days, HYPERPARAMETERS),
+        atol=1e-4,
+    )
+
+
+def test_sparse_mogpr_matches_exact_regression(block):
+    values, days, truth = block
+
+    sparse, output_days, hyperparameters = sparse_mogpr(values, days)
+
+    np.testing.assert_array_equal(output_days, get_output_days(days))
+    exact = exact_mogpr(values, days, hyperparameters)
+    assert rmse(sparse[:, 0], exact[:, 0]) < 0.005
+    assert rmse(sparse[:, 0], truth) < 1.05 * rmse(exact[:, 0], truth)
+    assert rmse(sparse[:, 0], truth) < 0.03
+
+
+def test_fit_maximizes_the_bound(block):
+    values, days, _ = block
+
+    _, _, fitted = sparse_mogpr(values, days)
+
+    normalized, _, _ = normalize(values)
+    observed = ~np.isnan(values)
+    inducing_days = mogpr.get_inducing_days(days)
+
+    def bound(hyperparameters):
+        return _SparseModel(hyperparameters, days, inducing_days).bound(
+            normalized, observed
+        )
+
+    lengthscale, coregionalization, noise = fitted
+    assert bound(fitted) > bound(HYPERPARAMETERS)
+    for factor in (0.5, 2):
+        assert bound(fitted) > bound(
+            Hyperparameters(lengthscale * factor, coregionalization, noise)
+        )
+        assert bound(fitted) > bound(
+            Hyperparameters(lengthscale, coregionalization, noise * factor)
+        )
+
+
+def test_sparse_mogpr_batches(block, monkeypatch):
+    values, days, _ = block
+    expected, _, _ = sparse_mogpr(values, days, HYPERPARAMETERS)
+
+    # A batch of a single pixel
+    monkeypatch.setattr(mogpr, "BATCH_BYTES", 1)
+    result, _, _ = sparse_mogpr(values, days, HYPERPARAMETERS)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-10)
+
+
+def test_mogpr_data_cube(block):
+    values, days, _ = block
+    # Pixels without observations of the master output result in NaN
+    values = values.copy()
+    values[3, 0] = np.nan
+    dates = [datetime.datetime.fromordinal(int(day)) for day in days]
+    array = xr.DataArray(
+        values.reshape(4, 4, 2, -1).transpose(3, 2, 0, 1).astype(np.float32),
+        dims=("t", "bands", "y", "x"),
+        coords={"t": dates, "bands": ["NDVI", "RVI"]},
+    )
+
+    result = mogpr.mogpr(array)
+
+    assert result.dims == array.dims and result.dtype == np.float32
+    assert list(result["bands"].values) == ["NDVI", "RVI"]
+    assert np.all(np.diff(result["t"].values) == np.timedelta64(5, "D"))
+    assert result["t"].values[0] == np.datetime64(dates[0])
+    assert np.isnan(result.isel(y=0, x=3)).all()
+    assert np.isfinite(result.isel(y=0, x=2)).all()
@@ -0,0 +1,50 @@
+import json
+
+import openeo
+import pytest
+import requests
+
+from utils.build_catalog import REPOSITORY_ROOT, load_generator, unload_generator
+from utils.offline_connection import connect_offline, resolve_document
+from utils.pg_optimizer import optimize_process
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    def send(*args, **kwargs):
+        raise AssertionError("The offline connection must not access the network")
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", send)
+
+
+@pytest.mark.parametrize("algorithm", ["evi", "ndwi", "whittaker"])
+def test_generate_offline_matches_catalog(algorithm, no_network):
+    generator_path = REPOSITORY_ROOT / algorithm / "openeo_udp" / "generate_udp_pg.py"
+    try:
+        udp = load_generator(algorithm, generator_path).generate()
+    finally:
+        unload_generator(generator_path)
+
+    udp, _, _ = optimize_process(udp)
+    expected = json.loads((generator_path.parent / f"{algorithm}.json").read_text())
+    assert json.loads(json.dumps(udp)) == expected
+
+
+def test_unknown_documents_are_not_found():
+    status, document = resolve_document("collections/UNKNOWN")
+    assert status == 404
+    assert document["code"] == "CollectionNotFound"
+    assert resolve_document("jobs")[0] == 404
+
+
+def test_offline_connection_describes_collections(no_network):
+    connection = connect_offline()
+    metadata = connection.collection_metadata("SENTINEL2_L2A")
+    assert {"B02", "B04", "B08", "SCL"} <= set(metadata.band_names)
+
+
+def test_served_documents(mock_backend):
+    connection = openeo.connect(mock_backend(), auto_validate=False)
+    assert connection.capabilities().api_version()
+    assert "SENTINEL2_L2A" in connection.list_collection_ids()
+    assert connection.list_file_formats()["output"]
@@ -0,0 +1,27 @@
+import numpy as np
+import xarray as xr
+
+from utils.local_executor import LocalExecutor
+from utils.offline_connection import connect_offline
+from utils.output_profiles import INT16_MAX, INT16_NODATA, apply_output_profile
+
+
+def test_int16_profile(tmp_path):
+    values = np.array([[[0.5, -5.0], [np.nan, 5.0]]])
+    xr.Dataset(
+        {"B04": (("t", "y", "x"), values)},
+        coords={"t": np.array(["2023-06-01"], dtype="datetime64[ns]")},
+    ).to_netcdf(tmp_path / "SENTINEL2_L2A.nc")
+    cube = connect_offline().load_collection("SENTINEL2_L2A", bands=["B04"])
+
+    result = LocalExecutor(tmp_path).execute(
+        {"process_graph": apply_output_profile(cube, "int16").flat_graph()}
+    )
+
+    assert result.dtype == np.int16
+    # No-data stays no-data, and the valid values are clipped so they never equal the no-data value
+    np.testing.assert_array_equal(
+        result.values.ravel(), [5000, -INT16_MAX, INT16_NODATA, INT16_MAX]
+    )
+    float32 = apply_output_profile(cube, "float32")
+    assert float32.flat_graph() == cube.flat_graph()
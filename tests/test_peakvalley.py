@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from utils.peakvalley import (
+    BETWEEN,
+    NO_EVENT,
+    PEAK,
+    VALLEY,
+    get_candidates,
+    peakvalley,
+)
+
+
+@pytest.fixture
+def block():
+    """
+    NDVI of a year every 5 days, with mowing events of varying depth, noise and clouds.
+    """
+    rng = np.random.default_rng(1)
+    times = np.arange("2021-01-01", "2022-01-01", 5, dtype="datetime64[D]")
+    days = np.arange(len(times)) * 5
+    pixels = 200
+    values = 0.3 + 0.5 * np.exp(-(((days - 180) / 70) ** 2)) * np.ones((pixels, 1))
+    for pixel in range(pixels):
+        for _ in range(rng.integers(0, 4)):
+            start = rng.integers(5, len(days) - 10)
+            depth = rng.uniform(0.05, 0.4)
+            values[pixel, start : start + 6] -= depth * np.array(
+                [0.3, 1, 0.8, 0.5, 0.3, 0.1]
+            )
+    values += rng.normal(0, 0.02, values.shape)
+    values[rng.random(values.shape) < 0.2] = np.nan
+    return xr.DataArray(
+        values.reshape(10, 20, -1),
+        dims=("y", "x", "t"),
+        coords={"t": times.astype("datetime64[ns]")},
+    )
+
+
+@pytest.mark.parametrize(
+    "drop_thr, rec_r, slope_thr", [(0.15, 1.0, -0.007), (0.1, 0.5, -0.02)]
+)
+def test_peakvalley_matches_fusets(block, drop_thr, rec_r, slope_thr):
+    fusets_peakvalley = pytest.importorskip("fusets.peakvalley").peakvalley
+
+    result = peakvalley(block, drop_thr, rec_r, slope_thr)
+
+    reference = fusets_peakvalley(block, drop_thr, rec_r, slope_thr)
+    expected = np.select(
+        [reference == 1, reference == 0, reference == -1],
+        [PEAK, BETWEEN, VALLEY],
+        NO_EVENT,
+    )
+    assert result.dims == block.dims and result.dtype == np.uint8
+    np.testing.assert_array_equal(result.values, expected)
+    # The block has pixels with and without events
+    assert 0 < np.any(expected == PEAK, axis=-1).mean() < 1
+
+
+def test_candidates_contain_all_events(block):
+    values = block.transpose("t", ...).values.reshape(block.sizes["t"], -1)
+
+    candidates = get_candidates(values, 0.15, 0.15)
+
+    events = peakvalley(block).transpose("t", ...).values.reshape(values.shape)
+    assert not np.any(events[:, ~candidates])
+    assert candidates.mean() < 1
@@ -0,0 +1,165 @@
+import pytest
+
+from utils.pg_optimizer import count_nodes, optimize_graph, optimize_process
+
+
+def node(process_id: str, result: bool = False, namespace=None, **arguments) -> dict:
+    value = {"process_id": process_id, "arguments": arguments}
+    if namespace:
+        value["namespace"] = namespace
+    if result:
+        value["result"] = True
+    return value
+
+
+def load(node_id: str = "load") -> dict:
+    return {node_id: node("load_collection", id="SENTINEL2_L2A", bands=["B04", "B08"])}
+
+
+def test_duplicate_sub_graphs_are_merged():
+    process_graph = {
+        **load("load1"),
+        **load("load2"),
+        "red1": node("filter_bands", data={"from_node": "load1"}, bands=["B04"]),
+        "red2": node("filter_bands", data={"from_node": "load2"}, bands=["B04"]),
+        "nir": node("filter_bands", data={"from_node": "load2"}, bands=["B08"]),
+        "merge": node(
+            "merge_cubes",
+            result=True,
+            cube1={"from_node": "red2"},
+            cube2={"from_node": "nir"},
+        ),
+    }
+
+    optimized = optimize_graph(process_graph)
+
+    # The first node of every group of identical nodes is kept, and references are redirected to it
+    assert list(optimized) == ["load1", "red1", "nir", "merge"]
+    assert optimized["nir"]["arguments"]["data"] == {"from_node": "load1"}
+    assert optimized["merge"]["arguments"]["cube1"] == {"from_node": "red1"}
+    assert optimized["merge"]["result"] is True
+    assert sum(n.get("result", False) for n in optimized.values()) == 1
+
+
+def test_duplicate_of_the_result_node_is_merged():
+    process_graph = {
+        "a": node("absolute", x=1),
+        "b": node("absolute", result=True, x=1),
+    }
+
+    assert optimize_graph(process_graph) == {"a": node("absolute", result=True, x=1)}
+
+
+def test_nodes_of_different_namespaces_are_kept():
+    process_graph = {
+        "a": node("biopar", namespace="https://a.example/biopar.json", type="FAPAR"),
+        "b": node("biopar", namespace="https://b.example/biopar.json", type="FAPAR"),
+        "c": node("biopar", type="FAPAR"),
+        "merge": node(
+            "array_create",
+            result=True,
+            data=[{"from_node": "a"}, {"from_node": "b"}, {"from_node": "c"}],
+        ),
+    }
+
+    assert optimize_graph(process_graph) == process_graph
+
+
+def test_callbacks_are_optimized():
+    def reducer(extra_node: bool) -> dict:
+        process_graph = {
+            "b04": node("array_element", data={"from_parameter": "data"}, label="B04"),
+            "b04_again": node(
+                "array_element", data={"from_parameter": "data"}, label="B04"
+            ),
+            "sum": node(
+                "add",
+                result=True,
+                x={"from_node": "b04"},
+                y={"from_node": "b04_again"},
+            ),
+        }
+        if extra_node:
+            process_graph["unused"] = node("absolute", x={"from_parameter": "data"})
+        return {"process_graph": process_graph}
+
+    process_graph = {
+        **load(),
+        "reduce": node(
+            "reduce_dimension",
+            result=True,
+            data={"from_node": "load"},
+            dimension="bands",
+            reducer=reducer(extra_node=True),
+        ),
+    }
+
+    optimized, before, after = optimize_process({"process_graph": process_graph})
+
+    callback = optimized["process_graph"]["reduce"]["arguments"]["reducer"]
+    assert callback["process_graph"] == {
+        "b04": node("array_element", data={"from_parameter": "data"}, label="B04"),
+        "sum": node("add", result=True, x={"from_node": "b04"}, y={"from_node": "b04"}),
+    }
+    assert (before, after) == (6, 4)
+    assert count_nodes(optimized["process_graph"]) == after
+    # Callbacks that are identical after optimization merge their nodes
+    process_graph["reduce2"] = node(
+        "reduce_dimension",
+        data={"from_node": "load"},
+        dimension="bands",
+        reducer=reducer(extra_node=False),
+    )
+    process_graph["merge"] = node(
+        "merge_cubes",
+        cube1={"from_node": "reduce"},
+        cube2={"from_node": "reduce2"},
+    )
+    process_graph["reduce"].pop("result")
+    process_graph["merge"]["result"] = True
+    assert list(optimize_graph(process_graph)) == ["load", "reduce", "merge"]
+
+
+def test_unreachable_nodes_are_removed():
+    process_graph = {
+        **load(),
+        "unused": node("filter_bands", data={"from_node": "load"}, bands=["B04"]),
+        "unused_too": node("absolute", x={"from_node": "unused"}),
+        "save": node(
+            "save_result", result=True, data={"from_node": "load"}, format="GTiff"
+        ),
+    }
+
+    assert list(optimize_graph(process_graph)) == ["load", "save"]
+
+
+def test_cycle_raises():
+    process_graph = {
+        "a": node("absolute", x={"from_node": "b"}),
+        "b": node("absolute", x={"from_node": "a"}),
+        "c": node("absolute", result=True, x={"from_node": "b"}),
+    }
+
+    with pytest.raises(ValueError, match="Cycle"):
+        optimize_graph(process_graph)
+
+
+def test_dangling_reference_raises():
+    process_graph = {
+        **load(),
+        "save": node("save_result", result=True, data={"from_node": "missing"}),
+    }
+
+    with pytest.raises(ValueError, match="unknown node 'missing'"):
+        optimize_graph(process_graph)
+
+
+@pytest.mark.parametrize("results", [0, 2])
+def test_single_result_node_is_required(results):
+    process_graph = {
+        "a": node("absolute", result=results > 0, x=1),
+        "b": node("absolute", result=results > 1, x=2),
+    }
+
+    with pytest.raises(ValueError, match="single result node"):
+        optimize_graph(process_graph)
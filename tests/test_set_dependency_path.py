@@ -0,0 +1,339 @@
+import _bisect as bisect_extension
+import hashlib
+import http.server
+import importlib.machinery
+import io
+import os
+import sys
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+import requests
+
+from utils import set_dependency_path
+
+CONTENT = bytes(range(256)) * 4096
+
+
+def make_zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, data in members.items():
+            zip_file.writestr(name, data)
+    return buffer.getvalue()
+
+
+DEPENDENCIES = make_zip(
+    {"package/__init__.py": "", "package/module.py": "VALUE = 42\n"}
+)
+# A native extension module of the standard library, which can be imported under another package
+EXTENSION = getattr(bisect_extension, "__file__", "")
+FILES = {"/dependencies.zip": CONTENT, "/package.zip": DEPENDENCIES}
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves FILES with support for Range requests and an ETag. The first response is cut off after `drop_after`
+    bytes, as if the connection was lost.
+    """
+
+    drop_after = None
+    etag = '"1"'
+    ranges = []
+    heads = []
+
+    def do_HEAD(self):
+        self.heads.append(self.path)
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(FILES[self.path])))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        content = FILES[self.path]
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+        self.ranges.append(self.headers.get("Range"))
+        body = content[start:]
+
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.etag)
+        if start:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        self.end_headers()
+        if self.drop_after is not None and len(self.ranges) == 1:
+            self.wfile.write(body[: self.drop_after])
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server():
+    FileHandler.ranges = []
+    FileHandler.heads = []
+    server = http.server.ThreadingHTTPServer(("localhost", 0), FileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://localhost:{server.server_address[1]}/dependencies.zip"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(set_dependency_path.time, "sleep", lambda seconds: None)
+
+
+def test_download_resumes_with_range_request(file_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(FileHandler, "drop_after", 100_000)
+    monkeypatch.setattr(set_dependency_path, "DOWNLOAD_CHUNK_SIZE", 16 * 1024)
+    path = tmp_path / "dependencies.zip"
+
+    digest = set_dependency_path.download_file(
+        file_server, path, hashlib.sha256(CONTENT).hexdigest()
+    )
+
+    assert path.read_bytes() == CONTENT
+    assert digest == hashlib.sha256(CONTENT).hexdigest()
+    assert FileHandler.ranges[0] is None
+    assert FileHandler.ranges[1].startswith("bytes=")
+    assert int(FileHandler.ranges[1][6:-1]) > 0
+
+
+def test_download_rejects_corrupted_file(file_server, tmp_path):
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        set_dependency_path.download_file(
+            file_server, tmp_path / "dependencies.zip", "0" * 64
+        )
+
+
+def test_download_does_not_retry_client_errors(file_server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        set_dependency_path.download_file(
+            file_server.replace("dependencies", "missing"), tmp_path / "missing.zip"
+        )
+    assert FileHandler.ranges == []
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Empty dependency cache, with the pins, sys.path and imports of the test undone afterwards.
+    """
+    path = tmp_path / "cache"
+    path.mkdir()
+    monkeypatch.setattr(set_dependency_path, "CACHE_DIR", str(path))
+    monkeypatch.setattr(set_dependency_path, "_pinned_entries", {})
+    monkeypatch.delenv("OPENEO_UDF_DEPENDENCIES_PROVIDED", raising=False)
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    set_dependency_path.setup_dependencies.cache_clear()
+    yield path
+    set_dependency_path.setup_dependencies.cache_clear()
+    for lock_file in set_dependency_path._pinned_entries.values():
+        lock_file.close()
+    for name in [m for m in sys.modules if m == "package" or m.startswith("package.")]:
+        del sys.modules[name]
+
+
+def make_entry(cache_dir, name: str, size: int, age: float) -> str:
+    """
+    Cache entry with a file of the given size, last used the given number of seconds ago.
+    """
+    entry_dir = cache_dir / name
+    entry_dir.mkdir()
+    (entry_dir / "data").write_bytes(b"0" * size)
+    (cache_dir / f"{name}.size").write_text(str(size))
+    os.utime(entry_dir, (time.time() - age, time.time() - age))
+    return str(entry_dir)
+
+
+def test_resolve_cache_key_revalidates_stale_references(file_server, cache_dir):
+    url = file_server.replace("dependencies", "package")
+
+    key = set_dependency_path.resolve_cache_key(url, str(cache_dir))
+    # A fresh reference is trusted without asking the server
+    assert set_dependency_path.resolve_cache_key(url, str(cache_dir)) == key
+    assert FileHandler.heads == ["/package.zip"]
+
+    (ref_path,) = cache_dir.glob("*.ref")
+    stale = time.time() - set_dependency_path.CACHE_REVALIDATE_SECONDS - 1
+    os.utime(ref_path, (stale, stale))
+    assert set_dependency_path.resolve_cache_key(url, str(cache_dir)) == key
+    assert len(FileHandler.heads) == 2
+
+    # A new version of the file gets a new key
+    os.utime(ref_path, (stale, stale))
+    FileHandler.etag = '"2"'
+    try:
+        new_key = set_dependency_path.resolve_cache_key(url, str(cache_dir))
+    finally:
+        FileHandler.etag = '"1"'
+    assert new_key != key
+    assert ref_path.read_text() == new_key
+
+
+def test_resolve_cache_key_falls_back_to_the_last_known_version(cache_dir):
+    url = "http://localhost:1/package.zip"
+    ref_path = cache_dir / f"{set_dependency_path._url_hash(url)}.ref"
+    ref_path.write_text("known")
+    os.utime(ref_path, (0, 0))
+
+    assert set_dependency_path.resolve_cache_key(url, str(cache_dir)) == "known"
+
+
+def test_populate_cache_entry_publishes_complete_entries(file_server, cache_dir):
+    url = file_server.replace("dependencies", "package")
+    entry_dir = cache_dir / "entry"
+
+    set_dependency_path.populate_cache_entry(url, str(entry_dir), str(cache_dir))
+
+    assert (entry_dir / "package" / "module.py").read_text() == "VALUE = 42\n"
+    size = int((cache_dir / "entry.size").read_text())
+    assert size == set_dependency_path.get_folder_size(entry_dir)
+    assert not list(cache_dir.glob(".tmp-*"))
+
+
+def test_populate_cache_entry_leaves_nothing_behind_on_failure(file_server, cache_dir):
+    url = file_server.replace("dependencies", "package")
+    entry_dir = cache_dir / "entry"
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        set_dependency_path.populate_cache_entry(
+            url, str(entry_dir), str(cache_dir), "0" * 64
+        )
+
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_setup_dependencies_downloads_once(file_server, cache_dir):
+    url = file_server.replace("dependencies", "package")
+    sha256 = hashlib.sha256(DEPENDENCIES).hexdigest()
+
+    set_dependency_path.setup_dependencies(url, sha256)
+    set_dependency_path.setup_dependencies.cache_clear()
+    set_dependency_path.setup_dependencies(url, sha256)
+
+    assert FileHandler.ranges == [None]
+    assert str(cache_dir / sha256) in sys.path
+    assert str(cache_dir / sha256) in set_dependency_path._pinned_entries
+    from package.module import VALUE
+
+    assert VALUE == 42
+
+
+def test_evict_least_recently_used_entries_first(cache_dir):
+    oldest = make_entry(cache_dir, "oldest", 1000, age=300)
+    older = make_entry(cache_dir, "older", 1000, age=200)
+    newest = make_entry(cache_dir, "newest", 1000, age=100)
+
+    set_dependency_path.evict_cache_entries(str(cache_dir), 2000)
+
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(oldest + ".size")
+    assert os.path.exists(older) and os.path.exists(newest)
+
+    # Using an entry makes it the most recently used one
+    set_dependency_path.pin_cache_entry(older)
+    set_dependency_path._pinned_entries.pop(older).close()
+    set_dependency_path.evict_cache_entries(str(cache_dir), 1000)
+
+    assert os.path.exists(older) and not os.path.exists(newest)
+
+
+def test_evict_keeps_pinned_entries(cache_dir):
+    pinned = make_entry(cache_dir, "pinned", 1000, age=300)
+    unpinned = make_entry(cache_dir, "unpinned", 1000, age=200)
+    # The pin holds a shared lock on its own open file, which the exclusive lock of the eviction cannot take,
+    # as for a pin of another process
+    set_dependency_path.pin_cache_entry(pinned)
+    # Pinning refreshes the access time, make it the least recently used entry again
+    os.utime(pinned, (time.time() - 300, time.time() - 300))
+
+    set_dependency_path.evict_cache_entries(str(cache_dir), 0)
+
+    assert os.path.exists(pinned)
+    assert not os.path.exists(unpinned)
+
+
+def test_evict_counts_extracted_extension_modules(cache_dir):
+    entry = make_entry(cache_dir, "entry-zip", 1000, age=200)
+    make_entry(cache_dir, "other", 1000, age=100)
+    extension_dir = os.path.join(entry, set_dependency_path.EXTENSION_DIR_NAME)
+    os.mkdir(extension_dir)
+    with open(os.path.join(extension_dir, "module.so"), "wb") as file:
+        file.write(b"0" * 1000)
+    os.utime(entry, (time.time() - 200, time.time() - 200))
+
+    # 3000 bytes with the extension module, which no longer fit
+    set_dependency_path.evict_cache_entries(str(cache_dir), 2500)
+
+    assert not os.path.exists(entry)
+
+
+@pytest.mark.skipif(
+    not EXTENSION.endswith(tuple(importlib.machinery.EXTENSION_SUFFIXES)),
+    reason="_bisect is not an extension module of this interpreter",
+)
+def test_setup_dependencies_zipimport(file_server, cache_dir, monkeypatch):
+    suffix = importlib.machinery.EXTENSION_SUFFIXES[0]
+    dependencies = make_zip(
+        {
+            "package/__init__.py": "",
+            "package/module.py": "VALUE = 42\n",
+            f"package/_bisect{suffix}": Path(EXTENSION).read_bytes(),
+            f"package/unused{suffix}": b"not imported",
+            "package.libs/libbundled.so": b"library",
+        }
+    )
+    monkeypatch.setitem(FILES, "/zipimport.zip", dependencies)
+    url = file_server.replace("dependencies", "zipimport")
+    sha256 = hashlib.sha256(dependencies).hexdigest()
+    entry_dir = cache_dir / f"{sha256}-zip"
+    extension_dir = entry_dir / set_dependency_path.EXTENSION_DIR_NAME
+
+    set_dependency_path.setup_dependencies(url, sha256, mode="zipimport")
+
+    # The zip file is mounted as is
+    zip_path = entry_dir / set_dependency_path.ZIP_ENTRY_NAME
+    assert zip_path.read_bytes() == dependencies
+    assert str(zip_path) in sys.path
+    assert not extension_dir.exists()
+
+    from package import module
+
+    assert module.VALUE == 42
+    assert module.__file__ == str(zip_path / "package" / "module.py")
+    assert not extension_dir.exists()
+
+    from package import _bisect
+
+    assert _bisect.bisect_left([1, 2, 3], 2) == 1
+    assert _bisect.__file__.startswith(str(extension_dir / "package" / "_bisect"))
+    assert (extension_dir / "package.libs" / "libbundled.so").read_bytes() == b"library"
+    # Only the imported extension module and the libraries are extracted
+    extracted = {
+        p.relative_to(extension_dir).as_posix()
+        for p in extension_dir.rglob("*")
+        if p.is_file()
+    }
+    assert extracted == {
+        Path(_bisect.__file__).relative_to(extension_dir).as_posix(),
+        "package.libs/libbundled.so",
+    }
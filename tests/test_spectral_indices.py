@@ -0,0 +1,146 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from utils.local_executor import LocalExecutor
+from utils.offline_connection import connect_offline
+from utils.sentinel2 import load_masked_s2
+from utils import spectral_indices
+from utils.spectral_indices import (
+    CHUNK_SIZE,
+    INDICES,
+    compute_indices,
+    compute_indices_xarray,
+    get_required_bands,
+)
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def masked_cube(fixtures_dir, temporal_extent):
+    """
+    Cloud masked bands of all indices, like the multi_index UDP loads them.
+    """
+    cube = load_masked_s2(
+        connect_offline(),
+        spatial_extent=None,
+        temporal_extent=temporal_extent,
+        bands=get_required_bands(INDICES),
+    )
+    return LocalExecutor(fixtures_dir).execute({"process_graph": cube.flat_graph()})
+
+
+def test_multi_index_udp_computes_the_indices_natively(
+    fixtures_dir, temporal_extent, masked_cube
+):
+    udp = json.loads(
+        (
+            REPOSITORY_ROOT / "multi_index" / "openeo_udp" / "multi_index.json"
+        ).read_text()
+    )
+    assert "run_udf" not in json.dumps(udp["process_graph"])
+    indices = ["NBR", "NDVI", "EVI"]
+
+    result = LocalExecutor(fixtures_dir).execute(
+        udp,
+        {
+            "spatial_extent": None,
+            "temporal_extent": temporal_extent,
+            "indices": indices,
+        },
+    )
+
+    assert list(result["bands"].values) == indices
+    expected = compute_indices_xarray(masked_cube, indices)
+    np.testing.assert_allclose(
+        result.values, expected.transpose(*result.dims).values, rtol=1e-5
+    )
+
+
+@pytest.mark.parametrize("index", [i for i in INDICES if i != "NDVI"])
+def test_index_matches_its_udp(fixtures_dir, temporal_extent, masked_cube, index):
+    algorithm = index.lower()
+    udp = json.loads(
+        (REPOSITORY_ROOT / algorithm / "openeo_udp" / f"{algorithm}.json").read_text()
+    )
+
+    result = LocalExecutor(fixtures_dir).execute(
+        udp, {"spatial_extent": None, "temporal_extent": temporal_extent}
+    )
+
+    expected = compute_indices_xarray(masked_cube, [index]).isel(bands=0)
+    assert np.isfinite(expected).any()
+    np.testing.assert_allclose(
+        result.values, expected.transpose(*result.dims).values, rtol=1e-5
+    )
+
+
+def test_ndvi_matches_the_ndvi_process(fixtures_dir, temporal_extent, masked_cube):
+    cube = load_masked_s2(
+        connect_offline(),
+        spatial_extent=None,
+        temporal_extent=temporal_extent,
+        bands=["B04", "B08"],
+    ).ndvi(nir="B08", red="B04")
+
+    result = LocalExecutor(fixtures_dir).execute({"process_graph": cube.flat_graph()})
+
+    expected = compute_indices_xarray(masked_cube, ["NDVI"]).isel(bands=0)
+    np.testing.assert_allclose(
+        result.values, expected.transpose(*result.dims).values, rtol=1e-5
+    )
+
+
+@pytest.fixture
+def bands():
+    """
+    Reflectances of 1000 pixels, with a few zero sums and no-data values.
+    """
+    rng = np.random.default_rng(0)
+    bands = {
+        name: rng.uniform(0, 10000, (10, 100)).astype(np.uint16)
+        for name in get_required_bands(INDICES)
+    }
+    bands["B04"][0, :5] = 0
+    bands["B08"][0, :5] = 0
+    bands = {name: values.astype(np.float32) for name, values in bands.items()}
+    bands["B12"][1, :5] = np.nan
+    return bands
+
+
+def test_compute_indices_does_not_depend_on_the_chunks(bands):
+    expected = compute_indices(bands, list(INDICES), chunk_size=len(bands["B04"].flat))
+
+    for chunk_size in (1, 7, 64, CHUNK_SIZE):
+        result = compute_indices(bands, list(INDICES), chunk_size=chunk_size)
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_compute_indices_numexpr_matches_eval(bands, monkeypatch):
+    pytest.importorskip("numexpr")
+    with_numexpr = compute_indices(bands, list(INDICES), chunk_size=77)
+
+    monkeypatch.setattr(spectral_indices, "numexpr", None)
+    with_eval = compute_indices(bands, list(INDICES), chunk_size=77)
+
+    np.testing.assert_allclose(with_numexpr, with_eval, rtol=1e-6, equal_nan=True)
+
+
+def test_compute_indices_formulas(bands):
+    result = compute_indices(bands, ["ndwi", "EVI"])
+
+    b02, b04, b08, b12 = (bands[name] for name in ["B02", "B04", "B08", "B12"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.testing.assert_allclose(
+            result[0], (b08 - b12) / (b08 + b12), rtol=1e-6, equal_nan=True
+        )
+        np.testing.assert_allclose(
+            result[1],
+            2.5 * (b08 - b04) / (b08 + 6 * b04 - 7.5 * b02 + 1),
+            rtol=1e-5,
+            equal_nan=True,
+        )
+    assert result.dtype == np.float32 and result.shape == (2, 10, 100)
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+
+import numpy as np
+import openeo
+import pytest
+import xarray as xr
+
+from utils.async_jobs import create_session, get_udp_job, run_jobs
+from utils.temporal_chunking import (
+    UDP_STITCH_METHODS,
+    UDP_TIME_DIMENSIONS,
+    get_windows,
+    run_in_windows,
+)
+
+
+def test_windows_tile_the_temporal_extent():
+    windows = get_windows(["2021-01-01", "2023-07-01"], 365, 60)
+
+    assert [w.core_start.isoformat() for w in windows] == [
+        "2021-01-01",
+        "2022-01-01",
+        "2023-01-01",
+    ]
+    assert all(a.core_end == b.core_start for a, b in zip(windows, windows[1:]))
+    assert windows[0].start == windows[0].core_start
+    assert windows[1].start == windows[1].core_start - datetime.timedelta(60)
+    assert windows[1].end == windows[1].core_end + datetime.timedelta(60)
+    assert windows[-1].end == windows[-1].core_end == datetime.date(2023, 7, 1)
+
+
+def test_every_udp_has_a_time_dimension():
+    assert set(UDP_TIME_DIMENSIONS) == set(UDP_STITCH_METHODS)
+
+
+def test_run_in_windows_matches_a_single_job(
+    mock_backend, fixtures_dir, parcels, temporal_extent, tmp_path
+):
+    connection = openeo.connect(
+        mock_backend(fixtures_dir), session=create_session(8), auto_validate=False
+    )
+    arguments = {
+        "spatial_extent": parcels["features"][0]["geometry"],
+        "temporal_extent": temporal_extent,
+        "smoothing_lambda": 100,
+    }
+
+    stitched = run_in_windows(
+        connection,
+        "whittaker",
+        arguments,
+        tmp_path / "windows",
+        window_days=30,
+        overlap_days=15,
+    )
+
+    assert len(list((tmp_path / "windows").iterdir())) == 2
+    [record] = asyncio.run(
+        run_jobs(
+            connection,
+            [get_udp_job("full", "whittaker", arguments)],
+            tmp_path,
+            min_interval=0.05,
+        )
+    )
+    assert record["status"] == "ok"
+    with xr.open_dataset(tmp_path / "full" / "result.nc") as dataset:
+        expected = dataset["data"].load()
+    stitched = stitched.transpose(*expected.dims)
+    assert stitched.sizes == expected.sizes
+    np.testing.assert_allclose(stitched.values, expected.values, atol=0.05)
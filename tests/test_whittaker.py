@@ -0,0 +1,150 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from utils.whittaker import DEFAULT_LAMBDA, LAMBDAS, get_days, smooth, whittaker
+
+DATES = np.array(
+    ["2021-01-01", "2021-01-06", "2021-01-11", "2021-01-21", "2021-02-05"]
+    + ["2021-02-10", "2021-02-25", "2021-03-07", "2021-03-22", "2021-04-01"],
+    dtype="datetime64[ns]",
+)
+
+
+def dense_whittaker(values: np.ndarray, days: np.ndarray, smoothing_lambda: float):
+    """
+    Solve (W + λDᵀD) z = Wy of a single time series with a dense solver, as the reference.
+    :return: Smoothed values at the days and the inverse of the system
+    """
+    size = days.max() + 1
+    observed = ~np.isnan(values)
+    weights, weighted = np.zeros(size), np.zeros(size)
+    np.add.at(weights, days[observed], 1)
+    np.add.at(weighted, days[observed], values[observed])
+    difference = np.diff(np.eye(size), 2, axis=0)
+    inverse = np.linalg.inv(
+        np.diag(weights) + smoothing_lambda * difference.T @ difference
+    )
+    return (inverse @ weighted)[days], inverse
+
+
+@pytest.fixture
+def time_series():
+    """
+    Noisy seasonal time series of which the pixels share a few observation masks, with some unique ones.
+    """
+    rng = np.random.default_rng(42)
+    days = get_days(DATES)
+    values = 0.5 + 0.3 * np.sin(days / 30) + rng.normal(0, 0.05, (40, len(days)))
+    masks = rng.random((4, len(days))) > 0.3
+    values[:30][~masks[np.arange(30) % 4]] = np.nan
+    values[30:][rng.random((10, len(days))) > 0.6] = np.nan
+    values[30:, :3] = 0.4
+    return values, days
+
+
+def test_smooth_matches_dense_solve(time_series):
+    values, days = time_series
+
+    smoothed, lambdas = smooth(values, days, 100)
+
+    for pixel in range(len(values)):
+        expected, _ = dense_whittaker(values[pixel], days, 100)
+        np.testing.assert_allclose(smoothed[pixel], expected, rtol=1e-8, atol=1e-10)
+    np.testing.assert_array_equal(lambdas, 100)
+
+
+def test_smooth_pixels_without_enough_observations():
+    days = get_days(DATES)
+    values = np.full((3, len(days)), np.nan)
+    values[1, 4] = 0.7
+    values[2, [2, 6]] = [0.2, 0.6]
+
+    smoothed, lambdas = smooth(values, days, 100)
+
+    assert np.isnan(smoothed[0]).all() and np.isnan(lambdas[0])
+    np.testing.assert_allclose(smoothed[1], 0.7)
+    # Two observations are interpolated by a straight line, for any lambda
+    expected, _ = dense_whittaker(values[2], days, 100)
+    np.testing.assert_allclose(smoothed[2], expected)
+    np.testing.assert_allclose(
+        smoothed[2], 0.2 + 0.4 * (days - days[2]) / (days[6] - days[2])
+    )
+    np.testing.assert_array_equal(lambdas[1:], 100)
+
+
+def test_smooth_observations_on_the_same_day():
+    days = get_days(DATES)
+    # Two dates of the same day, as for overlapping tiles
+    days = np.insert(days, 3, days[3])
+    values = np.linspace(0.2, 0.8, len(days))
+    values[[1, 7]] = np.nan
+
+    smoothed, _ = smooth(values[np.newaxis], days, 10)
+
+    expected, _ = dense_whittaker(values, days, 10)
+    np.testing.assert_allclose(smoothed[0], expected, rtol=1e-8)
+
+
+def test_whittaker_keeps_the_dimensions(time_series):
+    values, _ = time_series
+    array = xr.DataArray(
+        values.reshape(5, 8, len(DATES)).transpose(2, 0, 1).astype(np.float32),
+        dims=("t", "y", "x"),
+        coords={"t": DATES},
+    )
+
+    smoothed, lambdas = whittaker(array, 100)
+
+    assert smoothed.dims == ("t", "y", "x") and smoothed.dtype == np.float32
+    assert lambdas.dims == ("y", "x")
+    expected, _ = smooth(
+        values.astype(np.float32).astype(np.float64), get_days(DATES), 100
+    )
+    np.testing.assert_allclose(
+        smoothed.transpose("y", "x", "t").values.reshape(40, -1), expected, rtol=1e-5
+    )
+
+
+def brute_force_gcv(values: np.ndarray, days: np.ndarray):
+    """
+    Select the lambda of a single time series by evaluating the GCV score of every candidate with dense matrices.
+    """
+    observed = ~np.isnan(values)
+    n = observed.sum()
+    scores = []
+    for candidate in LAMBDAS:
+        smoothed, inverse = dense_whittaker(values, days, candidate)
+        # With a weight of 1 per observation, the hat matrix of the observations is the inverse at the observed days
+        trace = np.trace(inverse[np.ix_(days[observed], days[observed])])
+        residuals = np.sum((values[observed] - smoothed[observed]) ** 2)
+        scores.append(n * residuals / (n - trace) ** 2)
+    best = int(np.argmin(scores))
+    return dense_whittaker(values, days, LAMBDAS[best])[0], LAMBDAS[best]
+
+
+def test_smooth_selects_the_lambda_of_brute_force_gcv(time_series):
+    values, days = time_series
+
+    smoothed, lambdas = smooth(values, days, "auto")
+
+    for pixel in range(len(values)):
+        expected, expected_lambda = brute_force_gcv(values[pixel], days)
+        assert lambdas[pixel] == expected_lambda
+        np.testing.assert_allclose(smoothed[pixel], expected, rtol=1e-8, atol=1e-10)
+    # The selection is not stuck at a bound of the candidates
+    assert len(np.unique(lambdas)) > 1
+
+
+def test_smooth_auto_falls_back_to_the_default_lambda():
+    days = get_days(DATES)
+    values = np.full((3, len(days)), np.nan)
+    values[1, 4] = 0.7
+    values[2, [2, 6]] = [0.2, 0.6]
+
+    smoothed, lambdas = smooth(values, days, "auto")
+
+    assert np.isnan(smoothed[0]).all() and np.isnan(lambdas[0])
+    np.testing.assert_array_equal(lambdas[1:], DEFAULT_LAMBDA)
+    expected, _ = smooth(values, days, DEFAULT_LAMBDA)
+    np.testing.assert_allclose(smoothed[1:], expected[1:])
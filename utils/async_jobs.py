@@ -0,0 +1,375 @@
+"""
+Submits and follows many openEO batch jobs from a single process with asyncio.
+
+Every job is a coroutine: it creates and starts a batch job, polls its status and streams its result assets to the
+output folder. The blocking calls of the openEO client run in a thread pool with `asyncio.to_thread`, and all of them
+share a single `requests` session, so the connections to the backend are pooled and reused by all jobs. The number of
+jobs running on the backend and the number of concurrent downloads are bounded separately.
+
+The status of a job is polled with an adaptive backoff: the interval grows while the status stays the same and goes
+back to the minimum when it changes, with some jitter so the jobs do not poll in lockstep. Connection errors while
+polling are retried up to SOFT_ERRORS times.
+
+The jobs are the benchmark scenarios of the catalog (see `utils.benchmark`), e.g. a cell of `utils.scenario_grid` with
+a scenario per collection of mogpr_s1s2, and/or a JSON file with a list of UDP calls:
+
+    [
+        {"name": "evi_2021", "udp": "evi", "arguments": {"spatial_extent": {...}, "temporal_extent": [...]}},
+        {"name": "mogpr_rvi", "udp": "mogpr_s1s2", "arguments": {..., "s1_collection": "RVI"}, "format": "netcdf"}
+    ]
+
+The wall time (from submission until the job finished) and output size of every job can be appended to the history of
+`utils.benchmark`, with `batch:<backend>` as backend.
+
+Usage, from the root of the repository:
+
+    python -m utils.async_jobs [SCENARIO ...] [--scenarios-dir DIR] [--jobs jobs.json] --backend URL
+        --output-dir results/ [--max-running 10] [--max-downloads 4] [--min-poll 5] [--max-poll 120] [--history PATH]
+
+    # against the mock backend
+    python -m utils.offline_connection --serve 8080 --fixtures fixtures/
+    python -m utils.async_jobs --scenarios-dir grid/1km2_1y --backend http://localhost:8080 --no-auth
+        --output-dir results/
+
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import openeo
+import requests
+from openeo.rest import OpenEoApiError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.benchmark import (
+    FIELDS,
+    REPOSITORY_ROOT,
+    discover_scenarios,
+    find_regressions,
+    get_commit,
+    load_history,
+    save_history,
+)
+from utils.output_profiles import SAVE_RESULT_PRESETS
+from utils.scenario_grid import NAMESPACE
+
+FINAL_STATUSES = {"finished", "error", "canceled"}
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 120
+# Factor by which the poll interval grows while the status of a job does not change
+POLL_BACKOFF = 1.5
+# Number of failed status requests of a job before it is given up
+SOFT_ERRORS = 10
+
+
+class JobSpec(NamedTuple):
+    """
+    Process graph to run as a batch job.
+    """
+
+    name: str
+    process_graph: dict
+
+
+def get_udp_job(
+    name: str, udp: str, arguments: dict, format: str = "netcdf"
+) -> JobSpec:
+    """
+    Batch job calling a UDP of the catalog.
+    :param format: `save_result` preset of `utils.output_profiles`
+    """
+    node_id = udp.replace("_", "") + "1"
+    return JobSpec(
+        name,
+        {
+            "process_graph": {
+                node_id: {
+                    "process_id": udp,
+                    "namespace": NAMESPACE.format(algorithm=udp),
+                    "arguments": arguments,
+                },
+                "saveresult1": {
+                    "process_id": "save_result",
+                    "arguments": {
+                        "data": {"from_node": node_id},
+                        **SAVE_RESULT_PRESETS[format],
+                    },
+                    "result": True,
+                },
+            }
+        },
+    )
+
+
+def load_jobs(
+    jobs_path: Optional[Path] = None,
+    scenarios_dir: Optional[Path] = None,
+    scenarios: Optional[List[str]] = None,
+) -> List[JobSpec]:
+    """
+    Jobs of a JSON file with UDP calls, and of the benchmark scenarios in a folder.
+    :param scenarios: Names or algorithms of the scenarios to include, all scenarios when not given
+    """
+    jobs = []
+    if scenarios_dir is not None:
+        for name, path in discover_scenarios(scenarios_dir, scenarios).items():
+            jobs.append(JobSpec(name, json.loads(path.read_text())))
+    if jobs_path is not None:
+        for job in json.loads(Path(jobs_path).read_text()):
+            jobs.append(
+                get_udp_job(
+                    job["name"],
+                    job["udp"],
+                    job["arguments"],
+                    job.get("format", "netcdf"),
+                )
+            )
+    return jobs
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """
+    HTTP session with a connection pool for the given number of concurrent requests. Idempotent requests are retried
+    when the backend is temporarily unavailable, jobs are never created twice.
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+async def wait_for_job(
+    job: openeo.BatchJob,
+    min_interval: float = MIN_POLL_INTERVAL,
+    max_interval: float = MAX_POLL_INTERVAL,
+    backoff: float = POLL_BACKOFF,
+    soft_errors: int = SOFT_ERRORS,
+) -> str:
+    """
+    Poll the status of a job until it is finished, failed or canceled.
+    :return: Final status
+    """
+    interval, previous, errors = min_interval, None, 0
+    while True:
+        try:
+            status = await asyncio.to_thread(job.status)
+        except (requests.ConnectionError, OpenEoApiError) as e:
+            if isinstance(e, OpenEoApiError) and e.http_status_code < 500:
+                raise
+            errors += 1
+            if errors > soft_errors:
+                raise
+            status = previous
+        if status in FINAL_STATUSES:
+            return status
+        interval = min_interval if status != previous else interval * backoff
+        interval = min(interval, max_interval)
+        previous = status
+        await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+
+
+async def run_job(
+    connection: openeo.Connection,
+    spec: JobSpec,
+    output_dir: Path,
+    running: asyncio.Semaphore,
+    downloads: asyncio.Semaphore,
+    min_interval: float = MIN_POLL_INTERVAL,
+    max_interval: float = MAX_POLL_INTERVAL,
+) -> dict:
+    """
+    Run a batch job and download its assets to `output_dir/<name>/`.
+    :param running: Bounds the number of jobs that run on the backend at the same time
+    :param downloads: Bounds the number of assets that are downloaded at the same time
+    :return: Job id, status, wall time in seconds, output size in bytes and error
+    """
+    record = {"job_id": None, "wall_time": None, "output_bytes": None, "error": ""}
+    try:
+        async with running:
+            start = time.perf_counter()
+            job = await asyncio.to_thread(
+                connection.create_job, spec.process_graph, title=spec.name
+            )
+            record["job_id"] = job.job_id
+            await asyncio.to_thread(job.start)
+            status = await wait_for_job(job, min_interval, max_interval)
+            if status != "finished":
+                logs = await asyncio.to_thread(job.logs, level="error")
+                messages = "; ".join(log.get("message", "") for log in logs)
+                raise RuntimeError(f"Job {job.job_id} {status}: {messages}")
+            record["wall_time"] = time.perf_counter() - start
+
+        assets = await asyncio.to_thread(lambda: job.get_results().get_assets())
+        target = output_dir / spec.name.replace("/", "_")
+        target.mkdir(parents=True, exist_ok=True)
+
+        async def download(asset) -> Path:
+            async with downloads:
+                return await asyncio.to_thread(asset.download, target / asset.key)
+
+        paths = await asyncio.gather(*(download(asset) for asset in assets))
+        record.update(
+            status="ok", output_bytes=sum(path.stat().st_size for path in paths)
+        )
+    except Exception as e:
+        record.update(status="failed", error=repr(e))
+    print(f"{spec.name}: {record['status']} {record['error']}".rstrip())
+    return record
+
+
+async def run_jobs(
+    connection: openeo.Connection,
+    jobs: List[JobSpec],
+    output_dir: Path,
+    max_running: int = 10,
+    max_downloads: int = 4,
+    min_interval: float = MIN_POLL_INTERVAL,
+    max_interval: float = MAX_POLL_INTERVAL,
+) -> List[dict]:
+    """
+    Run batch jobs concurrently.
+    :param connection: Connection of which the session has a pool of at least `max_running + max_downloads`
+        connections, see `create_session`
+    :return: Record of every job, in the order of `jobs`
+    """
+    # Every running job and download needs at most one thread at a time
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max_running + max_downloads)
+    )
+    running = asyncio.Semaphore(max_running)
+    downloads = asyncio.Semaphore(max_downloads)
+    return await asyncio.gather(
+        *(
+            run_job(
+                connection,
+                spec,
+                Path(output_dir),
+                running,
+                downloads,
+                min_interval,
+                max_interval,
+            )
+            for spec in jobs
+        )
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "scenarios", nargs="*", help="Scenarios or algorithms to run (default: all)"
+    )
+    parser.add_argument(
+        "--scenarios-dir", type=Path, help="Run the scenarios in this folder"
+    )
+    parser.add_argument("--jobs", type=Path, help="JSON file with UDP calls to run")
+    parser.add_argument(
+        "--backend", default="openeofed.dataspace.copernicus.eu", help="Backend URL"
+    )
+    parser.add_argument(
+        "--no-auth",
+        action="store_true",
+        help="Do not authenticate, e.g. for the mock backend",
+    )
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument(
+        "--max-running",
+        type=int,
+        default=10,
+        help="Maximum number of jobs running at the same time",
+    )
+    parser.add_argument(
+        "--max-downloads",
+        type=int,
+        default=4,
+        help="Maximum number of assets downloaded at the same time",
+    )
+    parser.add_argument(
+        "--min-poll", type=float, default=MIN_POLL_INTERVAL, help="Seconds"
+    )
+    parser.add_argument(
+        "--max-poll", type=float, default=MAX_POLL_INTERVAL, help="Seconds"
+    )
+    parser.add_argument(
+        "--history", type=Path, help="Append the runs to this benchmark history"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative increase that is flagged as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    if args.scenarios_dir is None and args.jobs is None:
+        args.scenarios_dir = REPOSITORY_ROOT
+    jobs = load_jobs(args.jobs, args.scenarios_dir, args.scenarios)
+    session = create_session(args.max_running + args.max_downloads)
+    connection = openeo.connect(args.backend, session=session, auto_validate=False)
+    if not args.no_auth:
+        connection.authenticate_oidc()
+    print(f"Running {len(jobs)} jobs on {args.backend}")
+    records = asyncio.run(
+        run_jobs(
+            connection,
+            jobs,
+            args.output_dir,
+            args.max_running,
+            args.max_downloads,
+            args.min_poll,
+            args.max_poll,
+        )
+    )
+
+    history = load_history(args.history) if args.history else []
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(
+        timespec="seconds"
+    )
+    commit = get_commit()
+    width = max([len(job.name) for job in jobs] + [26]) + 2
+    print(f"\n{'job':<{width}}{'wall time':>12}{'output':>18}")
+    failed = False
+    for job, record in zip(jobs, records):
+        entry = dict.fromkeys(FIELDS, "")
+        entry.update(
+            timestamp=timestamp,
+            commit=commit,
+            backend=f"batch:{args.backend}",
+            scenario=job.name,
+            status=record["status"],
+            wall_time=record["wall_time"],
+            peak_rss_mib=None,
+            output_bytes=record["output_bytes"],
+            error=record["error"],
+        )
+        regressions = find_regressions(entry, history, args.threshold)
+        history.append(entry)
+        if record["status"] != "ok":
+            print(f"{job.name:<{width}}{'FAILED':>12}  {record['error']}")
+        else:
+            print(
+                f"{job.name:<{width}}"
+                f"{record['wall_time']:>10.2f} s"
+                f"{record['output_bytes']:>12.0f} bytes"
+            )
+        for metric, increase in regressions.items():
+            print(f"  REGRESSION: {metric} +{increase:.0%}")
+        failed |= record["status"] != "ok" or bool(regressions)
+    if args.history:
+        save_history(history, args.history)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,415 @@
+"""
+Runs a UDP of the catalog over a large set of parcels, split into batch jobs.
+
+The parcels of a GeoJSON FeatureCollection are packed into spatially compact bins with a quadtree: they are grouped by
+the cell of a regular longitude/latitude grid (1° by default, about the size of a Sentinel-2 tile) that contains their
+centre, and a cell is split into quadrants as long as the bounding box of its parcels exceeds the pixel budget
+(pixels times expected observations) or it holds more than the maximum number of parcels. Every bin becomes a job:
+
+* for the UDPs with a `geometries` parameter (the index UDPs), the bounding box of the bin, padded by the radius of the
+  dilated cloud mask, is the `spatial_extent` and the parcels are the `geometries`, so every job returns the time
+  series of its parcels. The padding makes the mask of a parcel independent of the bin it is packed into;
+* for the other UDPs, the parcels are the `spatial_extent`, so every job returns the time series of its parcels for
+  the UDPs that aggregate over their `spatial_extent` (e.g. whittaker), and a raster covering them for the others.
+
+The jobs are submitted concurrently by a bounded pool of workers, as batch jobs or synchronous requests, and a failed
+job is retried with exponential backoff. The results are downloaded as NetCDF to the output folder, one file per bin.
+The time series of all bins can be merged into a single table or NetCDF file, with a `geometry` coordinate holding the
+index of the parcel in the FeatureCollection.
+
+Usage, from the root of the repository:
+
+    python -m utils.batch_runner evi parcels.geojson --temporal-extent 2021-01-01 2021-12-31 --backend URL
+        --output-dir results/ [--merge timeseries.parquet] [--argument reducer=median] [--workers 4] [--retries 3]
+        [--budget 1e9] [--max-features 500] [--mode batch|sync]
+
+    # against the mock backend, with failing jobs to exercise the retries
+    python -m utils.offline_connection --serve 8080 --fixtures fixtures/ --failure-rate 0.2
+    python -m utils.batch_runner evi parcels.geojson --temporal-extent 2021-01-01 2021-12-31
+        --backend http://localhost:8080 --no-auth --output-dir results/ --merge timeseries.csv
+
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import openeo
+
+from utils.output_profiles import SAVE_RESULT_PRESETS
+from utils.scenario_grid import NAMESPACE
+from utils.sentinel2 import SCL_DILATION_RADIUS
+from utils.tiling import PIXEL_SIZE, get_area, get_observations
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+MODES = ["batch", "sync"]
+# Pixel observations per job: about 10 km × 10 km over a year of Sentinel-2 acquisitions
+DEFAULT_BUDGET = 1e6 * 73
+DEFAULT_MAX_FEATURES = 500
+# Size in degrees of the cells at the root of the quadtree
+CELL_SIZE = 1.0
+MAX_DEPTH = 10
+# Seconds to wait before the first retry, doubled for every next retry
+RETRY_BACKOFF = 5
+
+
+class Bin(NamedTuple):
+    """
+    Parcels that are processed by a single job.
+    """
+
+    name: str
+    features: Tuple[int, ...]
+    bbox: Tuple[float, float, float, float]
+
+
+def _coordinates(geometry: dict) -> Iterable[Sequence[float]]:
+    if geometry["type"] == "GeometryCollection":
+        for part in geometry["geometries"]:
+            yield from _coordinates(part)
+        return
+    stack = [geometry["coordinates"]]
+    while stack:
+        value = stack.pop()
+        if value and isinstance(value[0], (int, float)):
+            yield value
+        else:
+            stack.extend(value)
+
+
+def get_bbox(geometries: Iterable[dict]) -> Tuple[float, float, float, float]:
+    """
+    Bounding box (west, south, east, north) of GeoJSON geometries.
+    """
+    points = [point for geometry in geometries for point in _coordinates(geometry)]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def get_bbox_extent(bbox: Tuple[float, float, float, float]) -> dict:
+    return dict(zip(("west", "south", "east", "north"), bbox), crs="EPSG:4326")
+
+
+def pad_bbox(
+    bbox: Tuple[float, float, float, float], distance: float
+) -> Tuple[float, float, float, float]:
+    """
+    Grow a bounding box in longitude/latitude by a distance in metres on every side.
+    """
+    west, south, east, north = bbox
+    latitude = math.radians((south + north) / 2)
+    dx = distance / (111320 * math.cos(latitude))
+    dy = distance / 110540
+    return west - dx, south - dy, east + dx, north + dy
+
+
+def get_cost(
+    bbox: Tuple[float, float, float, float], temporal_extent: Sequence[str]
+) -> float:
+    """
+    Pixel observations of a job covering a bounding box.
+    """
+    pixels = get_area(get_bbox_extent(bbox)) / PIXEL_SIZE**2
+    return max(pixels, 1) * get_observations(temporal_extent)
+
+
+def split_into_bins(
+    feature_collection: dict,
+    temporal_extent: Sequence[str],
+    budget: float = DEFAULT_BUDGET,
+    max_features: int = DEFAULT_MAX_FEATURES,
+    cell_size: float = CELL_SIZE,
+    max_depth: int = MAX_DEPTH,
+) -> List[Bin]:
+    """
+    Pack the features of a FeatureCollection into spatially compact bins with a quadtree.
+    :param budget: Maximum pixel observations of the bounding box of a bin
+    :param max_features: Maximum number of features of a bin
+    :param cell_size: Size in degrees of the cells at the root of the quadtree
+    :param max_depth: Maximum number of times a cell is split, bins at this depth may exceed the budget
+    :return: Bins, ordered by cell
+    """
+    bboxes = [get_bbox([f["geometry"]]) for f in feature_collection["features"]]
+    centres = [((w + e) / 2, (s + n) / 2) for w, s, e, n in bboxes]
+
+    def pack(indices: List[int], cell, depth: int, name: str) -> List[Bin]:
+        bbox = (
+            min(bboxes[i][0] for i in indices),
+            min(bboxes[i][1] for i in indices),
+            max(bboxes[i][2] for i in indices),
+            max(bboxes[i][3] for i in indices),
+        )
+        fits = (
+            get_cost(bbox, temporal_extent) <= budget and len(indices) <= max_features
+        )
+        if fits or depth == max_depth or len(indices) == 1:
+            return [Bin(name, tuple(indices), bbox)]
+        west, south, east, north = cell
+        x, y = (west + east) / 2, (south + north) / 2
+        quadrants = defaultdict(list)
+        for i in indices:
+            quadrants[(centres[i][1] >= y, centres[i][0] >= x)].append(i)
+        bins = []
+        for (top, right), members in sorted(quadrants.items()):
+            quadrant = (
+                x if right else west,
+                y if top else south,
+                east if right else x,
+                north if top else y,
+            )
+            quadrant_name = f"{name}_{2 * top + right}"
+            bins.extend(pack(members, quadrant, depth + 1, quadrant_name))
+        return bins
+
+    cells = defaultdict(list)
+    for i, (x, y) in enumerate(centres):
+        cells[(math.floor(x / cell_size), math.floor(y / cell_size))].append(i)
+    bins = []
+    for (column, row), indices in sorted(cells.items()):
+        cell = (
+            column * cell_size,
+            row * cell_size,
+            (column + 1) * cell_size,
+            (row + 1) * cell_size,
+        )
+        bins.extend(pack(indices, cell, 0, f"{column}_{row}"))
+    return bins
+
+
+def get_udp_parameters(udp_id: str) -> List[str]:
+    """
+    Parameter names of a UDP of the catalog.
+    """
+    path = REPOSITORY_ROOT / udp_id / "openeo_udp" / f"{udp_id}.json"
+    return [p["name"] for p in json.loads(path.read_text())["parameters"]]
+
+
+def get_arguments(
+    udp_id: str,
+    bin: Bin,
+    feature_collection: dict,
+    temporal_extent: Sequence[str],
+    arguments: Optional[dict] = None,
+) -> dict:
+    """
+    Arguments of the UDP for the job of a bin.
+    :param arguments: Other arguments of the UDP
+    """
+    parcels = {
+        "type": "FeatureCollection",
+        "features": [feature_collection["features"][i] for i in bin.features],
+    }
+    if "geometries" in get_udp_parameters(udp_id):
+        bbox = pad_bbox(bin.bbox, SCL_DILATION_RADIUS)
+        extent = {"spatial_extent": get_bbox_extent(bbox), "geometries": parcels}
+    else:
+        extent = {"spatial_extent": parcels}
+    return {**extent, "temporal_extent": list(temporal_extent), **(arguments or {})}
+
+
+def run_job(
+    connection: openeo.Connection,
+    udp_id: str,
+    arguments: dict,
+    output_path: Path,
+    mode: str = "batch",
+    retries: int = 3,
+    backoff: float = RETRY_BACKOFF,
+    poll_interval: float = 60,
+) -> Path:
+    """
+    Run a UDP and download its result as NetCDF, retrying with exponential backoff when it fails.
+    :param mode: `batch` to run a batch job, `sync` for a synchronous request
+    :param poll_interval: Maximum number of seconds between two status requests of a batch job
+    """
+    cube = connection.datacube_from_process(
+        udp_id, namespace=NAMESPACE.format(algorithm=udp_id), **arguments
+    ).save_result(**SAVE_RESULT_PRESETS["netcdf"])
+    for attempt in range(retries + 1):
+        try:
+            if mode == "sync":
+                cube.download(output_path)
+            else:
+                job = cube.create_job(title=f"{udp_id} {output_path.stem}")
+                job.start_and_wait(
+                    print=lambda *args, **kwargs: None,
+                    max_poll_interval=poll_interval,
+                    show_error_logs=False,
+                )
+                job.get_results().download_file(output_path)
+            return output_path
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            print(
+                f"{output_path.stem}: attempt {attempt + 1} failed ({e}), retrying in {delay:g} s"
+            )
+            time.sleep(delay)
+
+
+def merge_results(results: Dict[Bin, Path], output_path: Path):
+    """
+    Merge the time series of the bins into a single table (.csv, .parquet) or NetCDF file (.nc), with a `geometry`
+    coordinate holding the index of the parcel in the FeatureCollection.
+    """
+    import xarray as xr
+
+    from utils.local_executor import save
+
+    merged = []
+    for bin, path in sorted(results.items()):
+        with xr.open_dataset(path) as dataset:
+            array = dataset["data"] if "data" in dataset else dataset.to_array("bands")
+            if "geometry" not in array.dims:
+                raise ValueError(
+                    f"The result of bin {bin.name} is a raster, only time series can be merged"
+                )
+            merged.append(array.load().assign_coords(geometry=list(bin.features)))
+    save(xr.concat(merged, dim="geometry").sortby("geometry"), output_path)
+
+
+def run_batch(
+    connection: openeo.Connection,
+    udp_id: str,
+    feature_collection: dict,
+    temporal_extent: Sequence[str],
+    output_dir: Path,
+    arguments: Optional[dict] = None,
+    budget: float = DEFAULT_BUDGET,
+    max_features: int = DEFAULT_MAX_FEATURES,
+    workers: int = 4,
+    retries: int = 3,
+    mode: str = "batch",
+    poll_interval: float = 60,
+    backoff: float = RETRY_BACKOFF,
+) -> Tuple[Dict[Bin, Path], Dict[Bin, str]]:
+    """
+    Run a UDP over the features of a FeatureCollection, split into bins that are processed concurrently.
+    :param workers: Maximum number of jobs that run at the same time
+    :return: Result path of every bin that succeeded, and error of every bin that failed
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {MODES}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    bins = split_into_bins(feature_collection, temporal_extent, budget, max_features)
+    print(f"Split {len(feature_collection['features'])} features into {len(bins)} bins")
+
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                run_job,
+                connection,
+                udp_id,
+                get_arguments(
+                    udp_id, bin, feature_collection, temporal_extent, arguments
+                ),
+                output_dir / f"{udp_id}_{bin.name}.nc",
+                mode,
+                retries,
+                backoff,
+                poll_interval,
+            ): bin
+            for bin in bins
+        }
+        for future in as_completed(futures):
+            bin = futures[future]
+            try:
+                results[bin] = future.result()
+                print(f"{bin.name}: {len(bin.features)} features OK")
+            except Exception as e:
+                failures[bin] = repr(e)
+                print(f"{bin.name}: {len(bin.features)} features FAILED {e!r}")
+    return results, failures
+
+
+def parse_argument(text: str) -> Tuple[str, object]:
+    # name=value, where the value is JSON or else a string
+    name, value = text.split("=", 1)
+    try:
+        return name, json.loads(value)
+    except json.JSONDecodeError:
+        return name, value
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("udp", help="Id of the UDP of the catalog, e.g. evi")
+    parser.add_argument("features", type=Path, help="GeoJSON FeatureCollection")
+    parser.add_argument(
+        "--temporal-extent", nargs=2, required=True, metavar=("START", "END")
+    )
+    parser.add_argument(
+        "--backend", default="openeofed.dataspace.copernicus.eu", help="Backend URL"
+    )
+    parser.add_argument(
+        "--no-auth",
+        action="store_true",
+        help="Do not authenticate, e.g. for the mock backend",
+    )
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument(
+        "--merge", type=Path, help="Merge the time series into this file"
+    )
+    parser.add_argument(
+        "--argument",
+        action="append",
+        type=parse_argument,
+        default=[],
+        metavar="NAME=VALUE",
+        help="Other argument of the UDP, the value is parsed as JSON if possible",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="Maximum pixel observations per job",
+    )
+    parser.add_argument("--max-features", type=int, default=DEFAULT_MAX_FEATURES)
+    parser.add_argument("--mode", choices=MODES, default="batch")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60,
+        help="Maximum number of seconds between two status requests of a job",
+    )
+    args = parser.parse_args(argv)
+
+    connection = openeo.connect(args.backend, auto_validate=False)
+    if not args.no_auth:
+        connection.authenticate_oidc()
+    results, failures = run_batch(
+        connection,
+        args.udp,
+        json.loads(args.features.read_text()),
+        args.temporal_extent,
+        args.output_dir,
+        arguments=dict(args.argument),
+        budget=args.budget,
+        max_features=args.max_features,
+        workers=args.workers,
+        retries=args.retries,
+        mode=args.mode,
+        poll_interval=args.poll_interval,
+    )
+    if args.merge and results:
+        merge_results(results, args.merge)
+        print(f"Merged the time series of {len(results)} bins into {args.merge}")
+    if failures:
+        print(f"{len(failures)} of {len(results) + len(failures)} bins failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+Runs the benchmark scenarios of the catalog and records their performance over time.
+
+Every `*/benchmark_scenario/*.json` (and `*/bechmark_scenario/*.json`) in the repository is discovered and executed
+in a fresh process against one of the following backends:
+
+* `local`: the local executor of `utils.local_executor`, reading the collections from a fixtures folder;
+* an URL: an openEO backend executing synchronous requests, e.g. the mock backend started with
+  `python -m utils.offline_connection --serve 8080 --fixtures fixtures/`.
+
+The wall time, peak memory (RSS) of the executing process and output size of every scenario are appended to a
+history file (CSV or JSON, depending on the extension). A run is flagged as a regression when its wall time or peak
+memory exceeds the median of the previous runs of the scenario on the same backend by more than the threshold.
+
+Usage, from the root of the repository:
+
+    python -m utils.benchmark [SCENARIO ...] [--scenarios-dir DIR] [--backend local|URL] [--fixtures DIR] [--chunks t=1,y=256,x=256]
+        [--history PATH] [--threshold 0.2]
+
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import multiprocessing
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+HISTORY_PATH = REPOSITORY_ROOT / "benchmark_history.csv"
+SCENARIO_PATTERNS = ["*/benchmark_scenario/*.json", "*/bechmark_scenario/*.json"]
+# Number of previous runs of a scenario that make up its baseline
+BASELINE_RUNS = 5
+METRICS = ["wall_time", "peak_rss_mib"]
+# File extension of the output of the local executor, by `save_result` format
+FORMAT_SUFFIXES = {
+    "gtiff": ".tif",
+    "netcdf": ".nc",
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "json": ".json",
+}
+FIELDS = [
+    "timestamp",
+    "commit",
+    "backend",
+    "scenario",
+    "status",
+    "wall_time",
+    "peak_rss_mib",
+    "output_bytes",
+    "error",
+]
+
+
+def discover_scenarios(
+    root: Path = REPOSITORY_ROOT, scenarios: Optional[Iterable[str]] = None
+) -> Dict[str, Path]:
+    """
+    Find the benchmark scenarios of the catalog.
+    :param root: Root folder of the catalog
+    :param scenarios: Names (`<algorithm>/<scenario>`) or algorithms of the scenarios to include, all scenarios
+        when not given
+    :return: Mapping of scenario name to the path of its process graph
+    """
+    found = {
+        f"{path.parent.parent.name}/{path.stem}": path
+        for pattern in SCENARIO_PATTERNS
+        for path in sorted(root.glob(pattern))
+    }
+    found = dict(sorted(found.items()))
+    if scenarios:
+        selected = {
+            name: path
+            for name, path in found.items()
+            if name in scenarios or name.split("/")[0] in scenarios
+        }
+        unknown = {
+            s for s in scenarios if not any(s in (n, n.split("/")[0]) for n in found)
+        }
+        if unknown:
+            raise ValueError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        found = selected
+    return found
+
+
+def get_output_suffix(process_graph: dict) -> str:
+    """
+    File extension of the output of a scenario, from the format of its `save_result` node. Scenarios without
+    `save_result` are written as NetCDF.
+    """
+    for node in process_graph.get("process_graph", process_graph).values():
+        if node["process_id"] == "save_result":
+            return FORMAT_SUFFIXES.get(node["arguments"]["format"].lower(), ".json")
+    return ".nc"
+
+
+def run_scenario(
+    scenario_path: Path,
+    backend: str,
+    fixtures_dir: Optional[Path] = None,
+    chunks: Optional[Dict[str, int]] = None,
+) -> dict:
+    """
+    Execute a scenario and measure it. Meant to run in a fresh process, so the peak memory is that of this scenario.
+    :return: Wall time in seconds, peak RSS in MiB and size of the output file in bytes. The output of the local
+        executor is written in the format of the scenario, like a backend would, after the wall time and peak memory
+        are measured. When it cannot be written, e.g. GeoTIFF without `rioxarray`, the output size is None and the
+        reason is returned as `error`.
+    """
+    process_graph = json.loads(Path(scenario_path).read_text())
+    error = ""
+    try:
+        if backend == "local":
+            from utils.local_executor import LocalExecutor, save
+
+            executor = LocalExecutor(fixtures_dir, chunks=chunks)
+            start = time.perf_counter()
+            result = executor.execute(process_graph).compute()
+            wall_time = time.perf_counter() - start
+            peak_rss_mib = get_peak_rss_mib()
+            try:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    path = Path(temp_dir) / f"result{get_output_suffix(process_graph)}"
+                    save(result, path)
+                    output_bytes = path.stat().st_size
+            except Exception as e:
+                output_bytes = None
+                error = f"Output not encoded: {e!r}"
+        else:
+            import openeo
+
+            connection = openeo.connect(backend, auto_validate=False)
+            start = time.perf_counter()
+            output_bytes = len(connection.download(process_graph))
+            wall_time = time.perf_counter() - start
+            peak_rss_mib = get_peak_rss_mib()
+    except Exception as e:
+        # Not every exception can be sent back to the parent process
+        raise RuntimeError(repr(e)) from None
+    return {
+        "wall_time": wall_time,
+        "peak_rss_mib": peak_rss_mib,
+        "output_bytes": output_bytes,
+        "error": error,
+    }
+
+
+def get_peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPOSITORY_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def load_history(path: Path = HISTORY_PATH) -> List[dict]:
+    if not path.exists():
+        return []
+    if path.suffix == ".json":
+        return json.loads(path.read_text())
+    with open(path, newline="") as f:
+        return [
+            {
+                **row,
+                **{
+                    k: float(row[k]) if row[k] else None
+                    for k in ("wall_time", "peak_rss_mib", "output_bytes")
+                },
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def save_history(history: List[dict], path: Path = HISTORY_PATH):
+    if path.suffix == ".json":
+        path.write_text(json.dumps(history, indent=2) + "\n")
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(history)
+
+
+def find_regressions(
+    record: dict, history: List[dict], threshold: float
+) -> Dict[str, float]:
+    """
+    Compare a run with the median of the previous successful runs of the same scenario on the same backend.
+    :return: Mapping of regressed metric to its relative increase
+    """
+    previous = [
+        r
+        for r in history
+        if r["scenario"] == record["scenario"]
+        and r["backend"] == record["backend"]
+        and r["status"] == "ok"
+    ][-BASELINE_RUNS:]
+    regressions = {}
+    if record["status"] != "ok" or not previous:
+        return regressions
+    for metric in METRICS:
+        values = [r[metric] for r in previous if r[metric] is not None]
+        if not values or record[metric] is None:
+            continue
+        baseline = statistics.median(values)
+        if baseline > 0 and record[metric] > baseline * (1 + threshold):
+            regressions[metric] = record[metric] / baseline - 1
+    return regressions
+
+
+def run_benchmarks(
+    scenarios: Optional[Iterable[str]] = None,
+    scenarios_dir: Path = REPOSITORY_ROOT,
+    backend: str = "local",
+    fixtures_dir: Optional[Path] = None,
+    chunks: Optional[Dict[str, int]] = None,
+    history_path: Path = HISTORY_PATH,
+    threshold: float = 0.2,
+) -> List[dict]:
+    """
+    Run the benchmark scenarios one by one, each in a fresh process, and append the results to the history.
+    :param scenarios: Names or algorithms of the scenarios to run, all scenarios when not given
+    :param scenarios_dir: Root folder of the scenarios, e.g. a cell of `utils.scenario_grid`
+    :param backend: "local" or the URL of an openEO backend
+    :param fixtures_dir: Folder with collection fixtures, for the local backend
+    :param chunks: Dask chunk sizes, for the local backend
+    :param history_path: CSV or JSON file with the results of previous runs
+    :param threshold: Relative increase of a metric that is flagged as a regression
+    :return: Records of the runs, with the regressed metrics under "regressions"
+    """
+    if backend == "local" and fixtures_dir is None:
+        raise ValueError("The local backend requires a fixtures folder")
+    history = load_history(history_path)
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(
+        timespec="seconds"
+    )
+    commit = get_commit()
+    records = []
+    context = multiprocessing.get_context("spawn")
+    for name, path in discover_scenarios(scenarios_dir, scenarios).items():
+        record = dict.fromkeys(FIELDS, "")
+        record.update(
+            timestamp=timestamp, commit=commit, backend=backend, scenario=name
+        )
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            future = executor.submit(run_scenario, path, backend, fixtures_dir, chunks)
+            try:
+                record.update(future.result(), status="ok")
+            except Exception as e:
+                record.update(
+                    status="failed",
+                    error=repr(e),
+                    wall_time=None,
+                    peak_rss_mib=None,
+                    output_bytes=None,
+                )
+        regressions = find_regressions(record, history, threshold)
+        history.append(record)
+        records.append({**record, "regressions": regressions})
+    save_history(history, history_path)
+    return records
+
+
+def main(argv=None) -> int:
+    from utils.local_executor import parse_chunks
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "scenarios", nargs="*", help="Scenarios or algorithms to run (default: all)"
+    )
+    parser.add_argument(
+        "--scenarios-dir",
+        type=Path,
+        default=REPOSITORY_ROOT,
+        help="Root folder of the scenarios (default: the catalog)",
+    )
+    parser.add_argument(
+        "--backend", default="local", help="'local' or the URL of an openEO backend"
+    )
+    parser.add_argument("--fixtures", type=Path, help="Folder with collection fixtures")
+    parser.add_argument("--chunks", help="Dask chunks, e.g. t=1,y=256,x=256")
+    parser.add_argument(
+        "--history", type=Path, default=HISTORY_PATH, help="CSV or JSON history file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative increase that is flagged as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(
+        scenarios=args.scenarios,
+        scenarios_dir=args.scenarios_dir,
+        backend=args.backend,
+        fixtures_dir=args.fixtures,
+        chunks=parse_chunks(args.chunks) or None,
+        history_path=args.history,
+        threshold=args.threshold,
+    )
+
+    width = max([len(r["scenario"]) for r in records] + [26]) + 2
+    print(f"\n{'scenario':<{width}}{'wall time':>12}{'peak RSS':>12}{'output':>14}")
+    for record in records:
+        if record["status"] != "ok":
+            print(f"{record['scenario']:<{width}}{'FAILED':>12}  {record['error']}")
+            continue
+        output = (
+            "unknown"
+            if record["output_bytes"] is None
+            else f"{record['output_bytes']:.0f} bytes"
+        )
+        print(
+            f"{record['scenario']:<{width}}"
+            f"{record['wall_time']:>10.2f} s"
+            f"{record['peak_rss_mib']:>8.0f} MiB"
+            f"{output:>14}"
+        )
+        if record["error"]:
+            print(f"  {record['error']}")
+        for metric, increase in record["regressions"].items():
+            print(f"  REGRESSION: {metric} +{increase:.0%}")
+    failed = any(r["status"] != "ok" or r["regressions"] for r in records)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Builds the User Defined Processes of the whole catalog with a single command.
+
+Every `*/openeo_udp/generate_udp_pg.py` in the repository is discovered and its `generate()` function is run in a
+pool of worker processes. Each resulting process is written atomically next to its generator as
+`<algorithm>.json`, so a full rebuild takes about as long as the slowest algorithm. Before writing, the process
+graph is optimized by `utils.pg_optimizer`, which merges duplicate nodes and prunes unreachable ones; the node
+counts before and after optimization are reported.
+
+Builds are incremental: the inputs of every generator are fingerprinted and recorded in a build manifest, and only
+the UDPs whose fingerprint changed, or whose output was modified or removed, are regenerated.
+
+Usage, from the root of the repository:
+
+    python -m utils.build_catalog [ALGORITHM ...] [--workers N] [--force]
+
+"""
+
+import argparse
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+from utils.pg_optimizer import optimize_process
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+MANIFEST_PATH = REPOSITORY_ROOT / "catalog_manifest.json"
+
+# Files outside of the generator folder that end up in the generated UDPs
+SHARED_INPUTS = [
+    REPOSITORY_ROOT / "utils" / "set_dependency_path.py",
+    REPOSITORY_ROOT / "utils" / "pg_optimizer.py",
+    *sorted((REPOSITORY_ROOT / "utils" / "offline_backend").rglob("*.json")),
+]
+# Installed packages that determine the generated UDPs
+PACKAGE_INPUTS = ["openeo", "fusets"]
+
+
+class BuildResult(NamedTuple):
+    wall_time: float
+    nodes_before: Optional[int] = None
+    nodes_after: Optional[int] = None
+
+
+def discover_generators(
+    root: Path = REPOSITORY_ROOT, algorithms: Optional[Iterable[str]] = None
+) -> Dict[str, Path]:
+    """
+    Find the UDP generators of the catalog.
+    :param root: Root folder of the catalog
+    :param algorithms: Names of the algorithms to include, all algorithms when not given
+    :return: Mapping of algorithm name to the path of its generator
+    """
+    generators = {
+        path.parent.parent.name: path
+        for path in sorted(root.glob("*/openeo_udp/generate_udp_pg.py"))
+    }
+    if algorithms:
+        unknown = set(algorithms) - set(generators)
+        if unknown:
+            raise ValueError(f"Unknown algorithm(s): {', '.join(sorted(unknown))}")
+        generators = {name: generators[name] for name in algorithms}
+    return generators
+
+
+def load_generator(algorithm: str, generator_path: Path):
+    """
+    Import a generator module. The folder of the generator is put on the path, so that its helper modules can be
+    imported the same way as when the generator is run as a script.
+    :param algorithm: Name of the algorithm
+    :param generator_path: Path of the generator
+    :return: The imported module
+    """
+    for path in (str(generator_path.parent), str(REPOSITORY_ROOT)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(
+        f"{algorithm}_generate_udp_pg", generator_path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def unload_generator(generator_path: Path):
+    """
+    Remove the folder of a generator from the path and forget the modules imported from it, so that a worker
+    process can be reused for a generator with identically named helper modules.
+    """
+    folder = str(generator_path.parent)
+    while folder in sys.path:
+        sys.path.remove(folder)
+    for name, module in list(sys.modules.items()):
+        if str(getattr(module, "__file__", None) or "").startswith(folder + os.sep):
+            del sys.modules[name]
+
+
+def write_json_atomic(data: dict, path: Path):
+    """
+    Write the data as JSON to a temporary file next to the target and rename it into place, so that readers never
+    observe a partially written file.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def find_repository_modules(module: ModuleType) -> Set[Path]:
+    """
+    Find the source files of the repository modules a module depends on, by following the modules and functions
+    it imports.
+    """
+    root = REPOSITORY_ROOT.resolve()
+    sources = set()
+    stack = [module]
+    while stack:
+        for value in list(vars(stack.pop()).values()):
+            if isinstance(value, ModuleType):
+                dependency = value
+            else:
+                dependency = sys.modules.get(getattr(value, "__module__", None) or "")
+            source = getattr(dependency, "__file__", None)
+            if source is None:
+                continue
+            source = Path(source).resolve()
+            if root in source.parents and source not in sources:
+                sources.add(source)
+                stack.append(dependency)
+    return sources
+
+
+def compute_fingerprint(algorithm: str, generator_path: Path) -> str:
+    """
+    Fingerprint the inputs of a generator: the sources and readme in its folder, the modules of the repository it
+    imports, the shared files embedded in the UDPs, the versions of the packages building the process graph and the
+    text of the UDFs returned by the `load_*_udf()` functions the generator imports.
+    :return: Hex digest of the fingerprint
+    """
+    digest = hashlib.sha256()
+
+    def update(label: str, content: bytes):
+        digest.update(f"{label}\0{len(content)}\0".encode("utf-8"))
+        digest.update(content)
+
+    try:
+        module = load_generator(algorithm, generator_path)
+        sources = find_repository_modules(module)
+        udfs = {
+            name: getattr(module, name)()
+            for name in sorted(dir(module))
+            if name.startswith("load_")
+            and name.endswith("_udf")
+            and callable(getattr(module, name))
+        }
+    finally:
+        unload_generator(generator_path)
+
+    folder = generator_path.parent
+    inputs = (
+        set(folder.glob("*.py")) | set(folder.glob("*.md")) | set(folder.glob("*.txt"))
+    )
+    inputs |= {path.resolve() for path in SHARED_INPUTS} | sources
+    for path in sorted(path.resolve() for path in inputs):
+        update(str(path.relative_to(REPOSITORY_ROOT.resolve())), path.read_bytes())
+    for package in PACKAGE_INPUTS:
+        try:
+            version = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            version = ""
+        update(f"package:{package}", version.encode("utf-8"))
+    for name, udf in udfs.items():
+        update(f"udf:{name}", udf.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_manifest(path: Path = MANIFEST_PATH) -> Dict[str, dict]:
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def is_up_to_date(entry: Optional[dict], fingerprint: str, output_path: Path) -> bool:
+    """
+    Check whether a UDP was built from the given inputs and its output was not modified since.
+    """
+    return (
+        entry is not None
+        and entry.get("fingerprint") == fingerprint
+        and output_path.exists()
+        and entry.get("output_sha256") == file_sha256(output_path)
+    )
+
+
+def build_udp(algorithm: str, generator_path: Path) -> BuildResult:
+    """
+    Generate and optimize the UDP of a single algorithm and write it next to its generator.
+    :return: Wall time in seconds and the number of process graph nodes before and after optimization
+    """
+    start = time.perf_counter()
+    try:
+        module = load_generator(algorithm, generator_path)
+        udp = module.generate()
+    finally:
+        unload_generator(generator_path)
+    udp, nodes_before, nodes_after = optimize_process(udp)
+    write_json_atomic(udp, get_output_path(algorithm, generator_path))
+    return BuildResult(time.perf_counter() - start, nodes_before, nodes_after)
+
+
+def get_output_path(algorithm: str, generator_path: Path) -> Path:
+    return generator_path.parent / f"{algorithm}.json"
+
+
+def build_catalog(
+    algorithms: Optional[Iterable[str]] = None,
+    workers: Optional[int] = None,
+    force: bool = False,
+    manifest_path: Path = MANIFEST_PATH,
+) -> Dict[str, Optional[BuildResult]]:
+    """
+    Generate the UDPs of the catalog whose inputs changed since the previous build, in parallel.
+    :param algorithms: Names of the algorithms to build, all algorithms when not given
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :param force: Rebuild all UDPs, regardless of the build manifest
+    :param manifest_path: Path of the build manifest
+    :return: Mapping of algorithm name to its build result, with a wall time of 0 when it was up to date, or None
+        when the generation failed
+    """
+    generators = discover_generators(algorithms=algorithms)
+    manifest = load_manifest(manifest_path)
+    results = {}
+
+    fingerprints = {}
+    for algorithm, path in generators.items():
+        try:
+            fingerprints[algorithm] = compute_fingerprint(algorithm, path)
+        except Exception as e:
+            print(f"Failed to fingerprint UDP '{algorithm}': {e!r}", file=sys.stderr)
+            results[algorithm] = None
+            continue
+        entry = manifest.get(algorithm)
+        if not force and is_up_to_date(
+            entry,
+            fingerprints[algorithm],
+            get_output_path(algorithm, path),
+        ):
+            results[algorithm] = BuildResult(
+                0.0, entry.get("nodes_before"), entry.get("nodes_after")
+            )
+
+    stale = {
+        algorithm: path
+        for algorithm, path in generators.items()
+        if algorithm not in results
+    }
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(build_udp, algorithm, path): algorithm
+                for algorithm, path in stale.items()
+            }
+            for future in as_completed(futures):
+                algorithm = futures[future]
+                try:
+                    results[algorithm] = future.result()
+                except Exception as e:
+                    print(
+                        f"Failed to generate UDP '{algorithm}': {e!r}", file=sys.stderr
+                    )
+                    results[algorithm] = None
+                    continue
+                manifest[algorithm] = {
+                    "nodes_before": results[algorithm].nodes_before,
+                    "nodes_after": results[algorithm].nodes_after,
+                    "fingerprint": fingerprints[algorithm],
+                    "output_sha256": file_sha256(
+                        get_output_path(algorithm, stale[algorithm])
+                    ),
+                }
+        write_json_atomic(manifest, manifest_path)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "algorithms", nargs="*", help="Algorithms to build (default: all)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild UDPs that are up to date"
+    )
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = build_catalog(
+        algorithms=args.algorithms, workers=args.workers, force=args.force
+    )
+    total = time.perf_counter() - start
+
+    print(f"\n{'algorithm':<20}{'wall time':>12}{'nodes':>16}")
+    for algorithm in sorted(results):
+        result = results[algorithm]
+        nodes = ""
+        if result is None:
+            status = "FAILED"
+        else:
+            status = (
+                "up to date" if result.wall_time == 0 else f"{result.wall_time:.2f} s"
+            )
+            if result.nodes_before is not None:
+                nodes = f"{result.nodes_before} -> {result.nodes_after}"
+        print(f"{algorithm:<20}{status:>12}{nodes:>16}")
+    print(f"{'total':<20}{f'{total:.2f} s':>12}")
+    return 1 if None in results.values() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
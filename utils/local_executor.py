@@ -0,0 +1,887 @@
+"""
+Local execution engine for the process graphs of the catalog.
+
+Interprets the UDPs and benchmark scenarios of the catalog on xarray, so their hot paths can be profiled on a single
+machine without an openEO backend. Only the processes used by the catalog are implemented; other processes can be
+added with the `process` decorator. A process that is not implemented, but for which the catalog contains a UDP
+(`<process_id>/openeo_udp/<process_id>.json`), is executed by interpreting that UDP.
+
+Collections are loaded from local fixtures in the fixtures folder:
+
+* `<collection id>.nc`: NetCDF file with a variable per band and dimensions `t`, `y` and `x`;
+* `<collection id>/*.nc`: NetCDF files like the above, e.g. one per date, concatenated along `t`;
+* `<collection id>/<YYYY-MM-DD>_<band>.tif`: GeoTIFF file per date and band, requires `rioxarray`.
+
+The `x` and `y` coordinates of the fixtures are longitudes and latitudes of the pixel centres, so the spatial
+extents of the scenarios can be used unchanged. When `chunks` are given, the fixtures are opened as Dask arrays and
+the processes are evaluated lazily, chunk by chunk, until the result is computed.
+
+Usage, from the root of the repository:
+
+    python -m utils.local_executor SCENARIO.json --fixtures DIR [--output PATH] [--chunks t=1,y=256,x=256]
+
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import re
+import resource
+import time
+from collections import ChainMap
+from pathlib import Path
+from typing import Callable, Dict, List, Mapping, Optional
+
+import numpy as np
+import xarray as xr
+from scipy import signal
+
+from utils.output_profiles import INT16_MAX, INT16_NODATA, SAVE_RESULT_PRESETS
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+DIMENSION_ORDER = ["geometry", "t", "bands", "y", "x"]
+DIMENSION_ALIASES = {
+    "time": "t",
+    "band": "bands",
+    "lat": "y",
+    "latitude": "y",
+    "lon": "x",
+    "longitude": "x",
+}
+
+PROCESSES: Dict[str, Callable] = {}
+
+
+def process(process_id: str):
+    """
+    Register the implementation of an openEO process. The implementation is called with the `LocalExecutor` and
+    the `Arguments` of the process node.
+    """
+
+    def register(implementation: Callable) -> Callable:
+        PROCESSES[process_id] = implementation
+        return implementation
+
+    return register
+
+
+class ProcessGraphError(Exception):
+    pass
+
+
+class Callback:
+    """
+    Process graph passed as argument to a process, e.g. the reducer of `reduce_dimension`.
+    """
+
+    def __init__(self, executor: "LocalExecutor", process_graph: dict, scope: Mapping):
+        self.executor = executor
+        self.process_graph = process_graph
+        self.scope = scope
+
+    def __call__(self, **parameters):
+        return self.executor.evaluate_graph(
+            self.process_graph, ChainMap(parameters, self.scope)
+        )
+
+
+class ArrayView:
+    """
+    Data cube that is passed to a callback as an array along one of its dimensions.
+    """
+
+    def __init__(self, array: xr.DataArray, dimension: str):
+        self.array = array
+        self.dimension = dimension
+
+
+class Arguments:
+    """
+    Arguments of a process node, evaluated on first access so that e.g. `if` only evaluates the selected branch.
+    """
+
+    def __init__(self, executor: "LocalExecutor", arguments: dict, scope, results):
+        self.executor = executor
+        self.arguments = arguments
+        self.scope = scope
+        self.results = results
+        self.values = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arguments
+
+    def get(self, name: str, default=None):
+        if name not in self.arguments:
+            return default
+        if name not in self.values:
+            self.values[name] = self.executor.evaluate_value(
+                self.arguments[name], self.scope, self.results
+            )
+        return self.values[name]
+
+    def __getitem__(self, name: str):
+        if name not in self.arguments:
+            raise ProcessGraphError(f"Missing argument '{name}'")
+        return self.get(name)
+
+
+def _canonical(array: xr.DataArray) -> xr.DataArray:
+    """
+    Order the dimensions of a data cube like the openEO UDF data cubes: geometry, t, bands, y, x.
+    """
+    known = [d for d in DIMENSION_ORDER if d in array.dims]
+    return array.transpose(*known, *[d for d in array.dims if d not in known])
+
+
+def _unwrap(value):
+    return value.array if isinstance(value, ArrayView) else value
+
+
+def _view(value) -> ArrayView:
+    if not isinstance(value, ArrayView):
+        raise ProcessGraphError("Process can only be used in a dimension callback")
+    return value
+
+
+def _read_geometries(geojson: dict) -> List[List[list]]:
+    """
+    Read the polygons of a GeoJSON object.
+    :return: Polygon per geometry, as a list of rings
+    """
+    if geojson["type"] == "FeatureCollection":
+        return [
+            rings
+            for feature in geojson["features"]
+            for rings in _read_geometries(feature)
+        ]
+    if geojson["type"] == "Feature":
+        return [
+            [
+                ring
+                for polygon in _read_geometries(geojson["geometry"])
+                for ring in polygon
+            ]
+        ]
+    if geojson["type"] == "Polygon":
+        return [geojson["coordinates"]]
+    if geojson["type"] == "MultiPolygon":
+        return [[ring for polygon in geojson["coordinates"] for ring in polygon]]
+    raise ProcessGraphError(f"Unsupported geometry type '{geojson['type']}'")
+
+
+def _get_bounds(spatial_extent: dict):
+    """
+    Bounding box of a GeoJSON object or openEO bounding box, as (west, south, east, north).
+    """
+    if {"west", "south", "east", "north"} <= set(spatial_extent):
+        return (
+            spatial_extent["west"],
+            spatial_extent["south"],
+            spatial_extent["east"],
+            spatial_extent["north"],
+        )
+    points = np.array(
+        [
+            point
+            for rings in _read_geometries(spatial_extent)
+            for ring in rings
+            for point in ring
+        ]
+    )
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def _rasterize(rings: List[list], x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Find the pixel centres inside a polygon with the even-odd rule, so holes and multi-polygons are supported.
+    :return: Boolean mask with shape (y, x)
+    """
+    xx, yy = np.meshgrid(x, y)
+    inside = np.zeros(xx.shape, dtype=bool)
+    for ring in rings:
+        ring = np.asarray(ring, dtype=float)
+        for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+            crosses = (y1 > yy) != (y2 > yy)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = x1 + (yy - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses & (xx < x_cross)
+    return inside
+
+
+def _disk(size: int) -> np.ndarray:
+    radius = (size - 1) / 2
+    yy, xx = np.mgrid[:size, :size] - radius
+    return (xx**2 + yy**2 <= radius**2 + 0.5).astype(np.float32)
+
+
+def _dilate(mask: np.ndarray, size: int) -> np.ndarray:
+    if size <= 1 or not mask.any():
+        return mask
+    return signal.fftconvolve(mask.astype(np.float32), _disk(size), mode="same") > 0.5
+
+
+def _erode(mask: np.ndarray, size: int) -> np.ndarray:
+    return ~_dilate(~mask, size)
+
+
+class LocalExecutor:
+    """
+    Interpreter of openEO process graphs on xarray data cubes.
+    :param fixtures_dir: Folder containing the collection fixtures
+    :param chunks: Dask chunk sizes per dimension, e.g. {"t": 1, "y": 256, "x": 256}. The fixtures are loaded in
+        memory when not given.
+    :param catalog_dir: Root folder of the catalog, used to look up UDPs
+    :param dependencies_provided: Do not download the dependencies of the catalog UDFs, but use the installed packages
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: Path,
+        chunks: Optional[Dict[str, int]] = None,
+        catalog_dir: Path = REPOSITORY_ROOT,
+        dependencies_provided: bool = True,
+    ):
+        if chunks and importlib.util.find_spec("dask") is None:
+            raise ImportError("Chunked execution requires the 'dask' package")
+        self.fixtures_dir = Path(fixtures_dir)
+        self.chunks = chunks
+        self.catalog_dir = Path(catalog_dir)
+        self.dependencies_provided = dependencies_provided
+
+    def execute(self, process: dict, arguments: Optional[dict] = None):
+        """
+        Execute a process graph, e.g. a benchmark scenario, or a UDP.
+        :param process: Process definition containing a `process_graph`
+        :param arguments: Values of the parameters of the process
+        :return: Value of the result node
+        """
+        scope = {
+            parameter["name"]: parameter["default"]
+            for parameter in process.get("parameters", [])
+            if "default" in parameter
+        }
+        scope.update(arguments or {})
+        return self.evaluate_graph(process["process_graph"], scope)
+
+    def evaluate_graph(self, process_graph: dict, scope: Mapping):
+        results = {}
+        result_nodes = [k for k, node in process_graph.items() if node.get("result")]
+        if len(result_nodes) != 1:
+            raise ProcessGraphError(
+                f"Expected a single result node, found {len(result_nodes)}"
+            )
+        return self.evaluate_node(process_graph, result_nodes[0], scope, results)
+
+    def evaluate_node(self, process_graph: dict, node_id: str, scope, results):
+        if node_id not in results:
+            node = process_graph[node_id]
+            arguments = Arguments(
+                self, node.get("arguments", {}), scope, (process_graph, results)
+            )
+            results[node_id] = self.run_process(
+                node["process_id"], node.get("namespace"), arguments
+            )
+        return results[node_id]
+
+    def evaluate_value(self, value, scope, results):
+        if isinstance(value, dict):
+            if set(value) == {"from_node"}:
+                process_graph, node_results = results
+                return self.evaluate_node(
+                    process_graph, value["from_node"], scope, node_results
+                )
+            if set(value) == {"from_parameter"}:
+                if value["from_parameter"] not in scope:
+                    raise ProcessGraphError(
+                        f"Parameter '{value['from_parameter']}' has no value"
+                    )
+                return scope[value["from_parameter"]]
+            if "process_graph" in value:
+                return Callback(self, value["process_graph"], scope)
+            return {k: self.evaluate_value(v, scope, results) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.evaluate_value(v, scope, results) for v in value]
+        return value
+
+    def run_process(self, process_id: str, namespace: Optional[str], arguments):
+        if process_id in PROCESSES:
+            return PROCESSES[process_id](self, arguments)
+        udp_path = self.catalog_dir / process_id / "openeo_udp" / f"{process_id}.json"
+        if udp_path.exists():
+            udp = json.loads(udp_path.read_text())
+            return self.execute(
+                udp, {name: arguments.get(name) for name in arguments.arguments}
+            )
+        raise ProcessGraphError(
+            f"Process '{process_id}' ({namespace or 'predefined'}) is not supported locally"
+        )
+
+    def load_fixture(self, collection_id: str, bands: Optional[List[str]]):
+        """
+        Load the fixture of a collection as a data cube with dimensions t, bands, y and x.
+        """
+        netcdfs = sorted((self.fixtures_dir / collection_id).glob("*.nc"))
+        if (self.fixtures_dir / f"{collection_id}.nc").exists():
+            netcdfs = [self.fixtures_dir / f"{collection_id}.nc"]
+        geotiffs = sorted((self.fixtures_dir / collection_id).glob("*.tif"))
+        if netcdfs:
+            datasets = []
+            for path in netcdfs:
+                dataset = xr.open_dataset(path, chunks=self.chunks)
+                datasets.append(
+                    dataset.rename(
+                        {
+                            k: v
+                            for k, v in DIMENSION_ALIASES.items()
+                            if k in dataset.dims
+                        }
+                    )
+                )
+            dataset = datasets[0] if len(datasets) == 1 else xr.concat(datasets, "t")
+            bands = bands or list(dataset.data_vars)
+            cube = dataset[bands].to_array(dim="bands")
+        elif geotiffs:
+            try:
+                import rioxarray
+            except ImportError:
+                raise ImportError("GeoTIFF fixtures require the 'rioxarray' package")
+            slices = {}
+            for path in geotiffs:
+                date, band = path.stem.split("_", 1)
+                if bands is None or band in bands:
+                    array = rioxarray.open_rasterio(path, chunks=self.chunks)
+                    slices.setdefault(date, {})[band] = array.squeeze("band", drop=True)
+            bands = bands or sorted({b for date in slices.values() for b in date})
+            cube = xr.concat(
+                [
+                    xr.concat([slices[date][b] for b in bands], dim="bands")
+                    for date in sorted(slices)
+                ],
+                dim=xr.DataArray(
+                    np.array(sorted(slices), dtype="datetime64[ns]"), dims="t"
+                ),
+            ).assign_coords(bands=bands)
+        else:
+            raise ProcessGraphError(
+                f"No fixture for collection '{collection_id}' in {self.fixtures_dir}"
+            )
+        return _canonical(cube)
+
+    @contextlib.contextmanager
+    def udf_environment(self):
+        if not self.dependencies_provided:
+            yield
+            return
+        previous = os.environ.get("OPENEO_UDF_DEPENDENCIES_PROVIDED")
+        os.environ["OPENEO_UDF_DEPENDENCIES_PROVIDED"] = "1"
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ["OPENEO_UDF_DEPENDENCIES_PROVIDED"]
+            else:
+                os.environ["OPENEO_UDF_DEPENDENCIES_PROVIDED"] = previous
+
+
+#######################################################################################################################
+# Data cube processes
+#######################################################################################################################
+
+
+@process("load_collection")
+def load_collection(executor: LocalExecutor, args: Arguments):
+    cube = executor.load_fixture(args["id"], args.get("bands"))
+    spatial_extent = args.get("spatial_extent")
+    if spatial_extent:
+        west, south, east, north = _get_bounds(spatial_extent)
+        y = cube["y"].values
+        cube = cube.sel(
+            x=slice(west, east),
+            y=slice(north, south) if y[0] > y[-1] else slice(south, north),
+        )
+    temporal_extent = args.get("temporal_extent")
+    if temporal_extent:
+        start, end = temporal_extent
+        t = cube["t"].values
+        selected = np.ones(t.shape, dtype=bool)
+        if start:
+            selected &= t >= np.datetime64(start)
+        if end:
+            # A single day extent selects that day, otherwise the end is exclusive
+            end = np.datetime64(end)
+            if start and np.datetime64(start) == end:
+                end = end + np.timedelta64(1, "D")
+            selected &= t < end
+        cube = cube.isel(t=np.flatnonzero(selected))
+    return cube
+
+
+@process("filter_bands")
+def filter_bands(executor: LocalExecutor, args: Arguments):
+    return args["data"].sel(bands=args["bands"])
+
+
+@process("mask")
+def mask(executor: LocalExecutor, args: Arguments):
+    data, mask = args["data"], args["mask"]
+    if "bands" in mask.dims and mask.sizes["bands"] == 1:
+        mask = mask.isel(bands=0, drop=True)
+    replacement = args.get("replacement")
+    return data.where(
+        ~mask.astype(bool), np.nan if replacement is None else replacement
+    )
+
+
+@process("to_scl_dilation_mask")
+def to_scl_dilation_mask(executor: LocalExecutor, args: Arguments):
+    """
+    Pixels of which the SCL value is not in `mask1_values` are dilated with a disk of `kernel1_size`, pixels of which
+    the SCL value is in `mask2_values` with a disk of `kernel2_size`. True values are masked.
+    """
+    scl = args["data"]
+    if "bands" in scl.dims:
+        scl = scl.isel(bands=0, drop=True)
+    erosion_kernel_size = args.get("erosion_kernel_size", 0)
+    mask1_values = args.get("mask1_values", [2, 4, 5, 6, 7])
+    mask2_values = args.get("mask2_values", [3, 8, 9, 10, 11])
+    kernel1_size = args.get("kernel1_size", 17)
+    kernel2_size = args.get("kernel2_size", 201)
+
+    def dilation_mask(values: np.ndarray) -> np.ndarray:
+        mask1 = ~np.isin(values, mask1_values)
+        if erosion_kernel_size:
+            mask1 = _erode(mask1, erosion_kernel_size)
+        mask2 = np.isin(values, mask2_values)
+        return _dilate(mask1, kernel1_size) | _dilate(mask2, kernel2_size)
+
+    return xr.apply_ufunc(
+        dilation_mask,
+        scl,
+        input_core_dims=[["y", "x"]],
+        output_core_dims=[["y", "x"]],
+        vectorize=True,
+        dask="parallelized",
+        dask_gufunc_kwargs={"allow_rechunk": True},
+        output_dtypes=[bool],
+    )
+
+
+@process("sar_backscatter")
+def sar_backscatter(executor: LocalExecutor, args: Arguments):
+    # The fixtures of SAR collections contain backscatter values
+    return args["data"]
+
+
+@process("ndvi")
+def ndvi(executor: LocalExecutor, args: Arguments):
+    data = args["data"]
+    nir = data.sel(bands=args.get("nir", "nir"), drop=True)
+    red = data.sel(bands=args.get("red", "red"), drop=True)
+    result = ((nir - red) / (nir + red)).rename("NDVI")
+    target_band = args.get("target_band")
+    if target_band is None:
+        return result
+    return xr.concat(
+        [data, result.expand_dims(bands=[target_band])], dim="bands"
+    ).transpose(*data.dims)
+
+
+@process("reduce_dimension")
+def reduce_dimension(executor: LocalExecutor, args: Arguments):
+    dimension = args["dimension"]
+    result = _unwrap(
+        args["reducer"](
+            data=ArrayView(args["data"], dimension), context=args.get("context")
+        )
+    )
+    if dimension in result.dims:
+        raise ProcessGraphError(f"Reducer did not reduce dimension '{dimension}'")
+    return result
+
+
+@process("apply")
+def apply(executor: LocalExecutor, args: Arguments):
+    return _canonical(
+        _unwrap(args["process"](x=args["data"], context=args.get("context")))
+    )
+
+
+@process("apply_dimension")
+def apply_dimension(executor: LocalExecutor, args: Arguments):
+    result = _unwrap(
+        args["process"](
+            data=ArrayView(args["data"], args["dimension"]),
+            context=args.get("context"),
+        )
+    )
+    if isinstance(result, list):
+        # The labels of an array created by the process are its indices, see rename_labels
+        result = xr.concat(
+            [_unwrap(value) for value in result], dim=args["dimension"]
+        ).assign_coords({args["dimension"]: list(range(len(result)))})
+    target_dimension = args.get("target_dimension")
+    if target_dimension:
+        result = result.rename({args["dimension"]: target_dimension})
+    return _canonical(result)
+
+
+@process("apply_neighborhood")
+def apply_neighborhood(executor: LocalExecutor, args: Arguments):
+    """
+    Run the process on spatial tiles of `size` pixels, extended with `overlap` pixels on every side. The overlap is
+    removed from the results before they are stitched together.
+    """
+    data = args["data"]
+    size = {s["dimension"]: s["value"] for s in args["size"] if s["dimension"] in "xy"}
+    overlap = {o["dimension"]: o["value"] for o in args.get("overlap") or []}
+    x_size, y_size = size.get("x", data.sizes["x"]), size.get("y", data.sizes["y"])
+    x_overlap, y_overlap = overlap.get("x", 0), overlap.get("y", 0)
+
+    rows = []
+    for y0 in range(0, data.sizes["y"], y_size):
+        row = []
+        for x0 in range(0, data.sizes["x"], x_size):
+            y_start, x_start = max(y0 - y_overlap, 0), max(x0 - x_overlap, 0)
+            tile = data.isel(
+                y=slice(y_start, y0 + y_size + y_overlap),
+                x=slice(x_start, x0 + x_size + x_overlap),
+            )
+            result = _unwrap(args["process"](data=tile, context=args.get("context")))
+            row.append(
+                result.isel(
+                    y=slice(y0 - y_start, y0 - y_start + y_size),
+                    x=slice(x0 - x_start, x0 - x_start + x_size),
+                )
+            )
+        rows.append(row)
+    return _canonical(xr.combine_nested(rows, concat_dim=["y", "x"]))
+
+
+@process("run_udf")
+def run_udf(executor: LocalExecutor, args: Arguments):
+    from openeo.udf import UdfData, XarrayDataCube
+    from openeo.udf.run_code import run_udf_code
+
+    cube = _unwrap(args["data"]).compute()
+    # Like on the backends, the data cube of a UDF always has a bands dimension
+    reduced = "bands" not in cube.dims
+    if reduced:
+        cube = cube.expand_dims("bands")
+    data = UdfData(
+        datacube_list=[XarrayDataCube(_canonical(cube))],
+        user_context=args.get("context") or {},
+    )
+    with executor.udf_environment():
+        result = run_udf_code(code=args["udf"], data=data)
+    result = result.get_datacube_list()[0].get_array()
+    if reduced and result.sizes.get("bands") == 1:
+        result = result.isel(bands=0, drop=True)
+    return _canonical(result)
+
+
+@process("add_dimension")
+def add_dimension(executor: LocalExecutor, args: Arguments):
+    data = args["data"]
+    if args.get("type") == "bands" and "bands" in data.dims:
+        # The bands a UDF returned for a cube without bands, the new dimension only describes them
+        return _canonical(data.rename({"bands": args["name"]}))
+    return _canonical(data.expand_dims({args["name"]: [args["label"]]}))
+
+
+@process("rename_labels")
+def rename_labels(executor: LocalExecutor, args: Arguments):
+    data, dimension = args["data"], args["dimension"]
+    target, source = args["target"], args.get("source") or []
+    labels = list(data[dimension].values)
+    if source:
+        mapping = dict(zip(source, target))
+        labels = [mapping.get(label, label) for label in labels]
+    elif len(target) == len(labels):
+        labels = list(target)
+    else:
+        raise ProcessGraphError(
+            f"Expected {len(labels)} target labels for dimension '{dimension}'"
+        )
+    return data.assign_coords({dimension: labels})
+
+
+@process("merge_cubes")
+def merge_cubes(executor: LocalExecutor, args: Arguments):
+    # Cubes without bands dimension, e.g. the result of ndvi, are merged as a single band named after the cube
+    cube1, cube2 = [
+        cube if "bands" in cube.dims else cube.expand_dims(bands=[cube.name or name])
+        for cube, name in [(args["cube1"], "cube1"), (args["cube2"], "cube2")]
+    ]
+    overlapping = sorted(
+        set(cube1["bands"].values.tolist()) & set(cube2["bands"].values.tolist())
+    )
+    if overlapping:
+        if "overlap_resolver" not in args:
+            raise ProcessGraphError(
+                f"Overlapping bands {overlapping} require an overlap resolver"
+            )
+        resolved = args["overlap_resolver"](
+            x=cube1.sel(bands=overlapping),
+            y=cube2.sel(bands=overlapping),
+            context=args.get("context"),
+        )
+        cube1 = xr.concat(
+            [cube1.drop_sel(bands=overlapping), _unwrap(resolved)], dim="bands"
+        )
+        cube2 = cube2.drop_sel(bands=overlapping)
+    return _canonical(xr.concat([cube1, cube2], dim="bands", join="outer"))
+
+
+@process("aggregate_spatial")
+def aggregate_spatial(executor: LocalExecutor, args: Arguments):
+    """
+    Reduce the pixels of which the centre lies in a geometry, per geometry. The result is a vector cube with a
+    `geometry` dimension.
+    """
+    data = args["data"]
+    reducer = args["reducer"]
+    results = []
+    for rings in _read_geometries(args["geometries"]):
+        inside = xr.DataArray(
+            _rasterize(rings, data["x"].values, data["y"].values), dims=("y", "x")
+        )
+        pixels = data.where(inside).stack(pixel=("y", "x"))
+        results.append(
+            _unwrap(
+                reducer(data=ArrayView(pixels, "pixel"), context=args.get("context"))
+            )
+        )
+    return _canonical(xr.concat(results, dim="geometry"))
+
+
+@process("save_result")
+def save_result(executor: LocalExecutor, args: Arguments):
+    # Writing the result is left to the caller, see `save`
+    return args["data"]
+
+
+#######################################################################################################################
+# Array and math processes
+#######################################################################################################################
+
+
+@process("array_element")
+def array_element(executor: LocalExecutor, args: Arguments):
+    view = _view(args["data"])
+    if args.get("label") is not None:
+        return view.array.sel({view.dimension: args["label"]}, drop=True)
+    return view.array.isel({view.dimension: args["index"]}, drop=True)
+
+
+@process("array_create")
+def array_create(executor: LocalExecutor, args: Arguments):
+    return list(args.get("data") or []) * args.get("repeat", 1)
+
+
+def _reducer(process_id: str, method: str):
+    @process(process_id)
+    def reduce(executor: LocalExecutor, args: Arguments):
+        view = _view(args["data"])
+        return getattr(view.array, method)(
+            dim=view.dimension, skipna=args.get("ignore_nodata", True)
+        )
+
+    return reduce
+
+
+for _process_id, _method in [
+    ("mean", "mean"),
+    ("median", "median"),
+    ("min", "min"),
+    ("max", "max"),
+    ("sum", "sum"),
+    ("sd", "std"),
+]:
+    _reducer(_process_id, _method)
+
+
+def _binary(process_id: str, operator: Callable):
+    @process(process_id)
+    def apply(executor: LocalExecutor, args: Arguments):
+        return operator(_unwrap(args["x"]), _unwrap(args["y"]))
+
+    return apply
+
+
+for _process_id, _operator in [
+    ("add", lambda x, y: x + y),
+    ("subtract", lambda x, y: x - y),
+    ("multiply", lambda x, y: x * y),
+    ("divide", lambda x, y: x / y),
+    ("gt", lambda x, y: x > y),
+    ("gte", lambda x, y: x >= y),
+    ("lt", lambda x, y: x < y),
+    ("lte", lambda x, y: x <= y),
+    ("and", lambda x, y: x & y),
+    ("or", lambda x, y: x | y),
+]:
+    _binary(_process_id, _operator)
+
+
+@process("linear_scale_range")
+def linear_scale_range(executor: LocalExecutor, args: Arguments):
+    """
+    Clip x to [inputMin, inputMax] and scale it linearly to [outputMin, outputMax]. Like on the backends, an explicit
+    output range of integers within the int16 range results in int16 values, with INT16_NODATA for no-data.
+    """
+    x = _unwrap(args["x"])
+    input_min, input_max = args["inputMin"], args["inputMax"]
+    output_min, output_max = args.get("outputMin", 0), args.get("outputMax", 1)
+    result = (np.clip(x, input_min, input_max) - input_min) / (
+        input_max - input_min
+    ) * (output_max - output_min) + output_min
+    if not all(
+        name in args
+        and float(args[name]).is_integer()
+        and INT16_NODATA < args[name] <= INT16_MAX
+        for name in ("outputMin", "outputMax")
+    ):
+        return result
+    return xr.where(np.isnan(result), INT16_NODATA, np.round(result)).astype(np.int16)
+
+
+@process("is_valid")
+def is_valid(executor: LocalExecutor, args: Arguments):
+    """
+    False for no-data, NaN and infinite values, element-wise for a data cube.
+    """
+    x = _unwrap(args["x"])
+    if isinstance(x, xr.DataArray):
+        if np.issubdtype(x.dtype, np.number):
+            return np.isfinite(x)
+        return x.notnull()
+    if isinstance(x, (float, np.floating)):
+        return bool(np.isfinite(x))
+    return x is not None
+
+
+@process("not")
+def not_(executor: LocalExecutor, args: Arguments):
+    x = _unwrap(args["x"])
+    if x is None:
+        return None
+    # `~` is the bitwise complement of a Python bool, e.g. ~True == -2
+    result = np.logical_not(x)
+    return result if isinstance(x, xr.DataArray) else bool(result)
+
+
+@process("eq")
+def eq(executor: LocalExecutor, args: Arguments):
+    x, y = _unwrap(args["x"]), _unwrap(args["y"])
+    if isinstance(x, str) and isinstance(y, str):
+        if not args.get("case_sensitive", True):
+            return x.lower() == y.lower()
+        return x == y
+    if args.get("delta") is not None:
+        return abs(x - y) <= args["delta"]
+    return x == y
+
+
+@process("if")
+def if_(executor: LocalExecutor, args: Arguments):
+    value = _unwrap(args["value"])
+    if isinstance(value, xr.DataArray):
+        return xr.where(value, args["accept"], args.get("reject"))
+    return args["accept"] if value else args.get("reject")
+
+
+#######################################################################################################################
+# Command line interface
+#######################################################################################################################
+
+
+def save(result, path: Path):
+    """
+    Write a result to NetCDF (.nc), GeoTIFF (.tif, requires `rioxarray`), a table (.csv, or .parquet which requires
+    `pyarrow`) with a row per value, e.g. for the time series of geometries, or JSON (any other extension).
+
+    The NetCDF file is compressed and chunked with the options of the `netcdf` preset of `utils.output_profiles` when
+    netCDF4 is installed, and the GeoTIFF file is a cloud-optimized GeoTIFF with the options of the `cog` preset.
+    """
+    path = Path(path)
+    if path.suffix == ".nc":
+        dataset = result.to_dataset(name="data")
+        options = SAVE_RESULT_PRESETS["netcdf"]["options"]
+        chunks = tuple(
+            min(options["chunksizes"].get(d, size), size)
+            for d, size in result.sizes.items()
+        )
+        try:
+            import netCDF4  # noqa: F401
+
+            encoding = {
+                "data": {
+                    "zlib": options["zlib"],
+                    "complevel": options["complevel"],
+                    "chunksizes": chunks,
+                }
+            }
+        except ImportError:
+            # Without netCDF4, xarray writes NetCDF3 with scipy, which has no compression
+            encoding = {}
+        dataset.to_netcdf(path, encoding=encoding)
+    elif path.suffix in (".tif", ".tiff"):
+        import rioxarray  # noqa: F401
+
+        stacked = result.stack(band=[d for d in result.dims if d not in ("y", "x")])
+        stacked = stacked.transpose("band", "y", "x").drop_vars("band")
+        if result.dtype == np.int16:
+            stacked = stacked.rio.write_nodata(INT16_NODATA)
+        elif np.issubdtype(result.dtype, np.floating):
+            stacked = stacked.rio.write_nodata(np.nan)
+        options = SAVE_RESULT_PRESETS["cog"]["options"]
+        # The COG driver is always tiled, with square blocks
+        stacked.rio.to_raster(
+            path,
+            driver="COG",
+            blocksize=options["BLOCKXSIZE"],
+            compress=options["COMPRESS"],
+            level=options["ZLEVEL"],
+            overviews=options["overviews"],
+        )
+    elif path.suffix in (".csv", ".parquet"):
+        table = result.rename("value").to_dataframe().reset_index()
+        if path.suffix == ".csv":
+            table.to_csv(path, index=False)
+        else:
+            table.to_parquet(path, index=False)
+    else:
+        path.write_text(json.dumps(result.to_dict(data="list"), default=str))
+
+
+def parse_chunks(text: str) -> Dict[str, int]:
+    return {
+        dimension: int(size)
+        for dimension, size in re.findall(r"(\w+)=(\d+)", text or "")
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("process_graph", type=Path, help="Scenario or UDP to execute")
+    parser.add_argument(
+        "--fixtures", type=Path, required=True, help="Folder with collection fixtures"
+    )
+    parser.add_argument("--output", type=Path, help="File to write the result to")
+    parser.add_argument("--chunks", help="Dask chunks, e.g. t=1,y=256,x=256")
+    args = parser.parse_args()
+
+    process_graph = json.loads(args.process_graph.read_text())
+    executor = LocalExecutor(args.fixtures, chunks=parse_chunks(args.chunks) or None)
+    start = time.perf_counter()
+    result = executor.execute(process_graph).compute()
+    elapsed = time.perf_counter() - start
+    if args.output:
+        save(result, args.output)
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"result: {dict(result.sizes)}")
+    print(f"wall time: {elapsed:.2f} s")
+    print(f"peak memory: {peak_memory:.0f} MiB")
@@ -0,0 +1,363 @@
+"""
+Sparse multi-output Gaussian process regression (MOGPR) of the time series of a data cube.
+
+The MOGPR UDF of FuseTS fits a coregionalized GPy model with its own hyperparameters for every pixel, and solves a
+dense system over all observations of all outputs. The runtime is cubic in the length of the time series, which makes
+multi-year S1-S2 fusion expensive. The sparse mode of this module approximates the exact regression with:
+
+- a fixed set of inducing time points, every `INDUCING_STEP` days over the time range of the block, so the cost is
+  linear in the number of observations;
+- a single set of hyperparameters for all pixels of a block, fitted on the variational (VFE) bound of a sample of
+  its pixels;
+- batched solves: with shared hyperparameters and inducing points, the covariances between the inducing points and
+  the dates of the block are the same for all pixels, and the posterior of a batch of pixels is computed with a few
+  batched matrix products and one batched Cholesky solve. The batches are sized so their temporaries stay within
+  `BATCH_BYTES`, whatever the size of the block.
+
+The model is an intrinsic coregionalization model with a Matern 3/2 kernel k and a coregionalization matrix
+B = wwᵀ + diag(κ), so the covariance between output i at time t and output j at time t' is B_ij k(t, t'), and every
+output has its own noise variance. Like FuseTS, the outputs are normalized per pixel, the first output is the master
+output that must have observations, and the result is predicted every `OUTPUT_STEP` days between the first and the
+last date.
+
+The module is also an openEO UDF: `apply_datacube` runs the sparse regression with context["mode"] set to "sparse",
+and the FuseTS regression otherwise. The UDF code is returned by `load_mogpr_udf()`, and is preceded by
+`utils/set_dependency_path.py` in the UDP so the FuseTS regression can set up its dependencies. `utils.mogpr_benchmark`
+compares the accuracy and runtime of the sparse mode with the exact regression.
+"""
+
+import warnings
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, NamedTuple, Tuple
+
+import numpy as np
+import xarray as xr
+from openeo.udf import XarrayDataCube
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+
+try:
+    from utils.set_dependency_path import setup_fusets_dependencies
+except ImportError:
+    # In the UDF, utils/set_dependency_path.py precedes this module
+    pass
+
+MODES = ["exact", "sparse"]
+DEFAULT_MODE = "exact"
+# Days between the output dates, like FuseTS
+OUTPUT_STEP = 5
+# Days between the inducing points of the sparse mode
+INDUCING_STEP = 15
+# Number of pixels of a block on which the hyperparameters are fitted
+FIT_PIXELS = 8
+# Jitter added to the diagonal of the inducing point correlation
+JITTER = 1e-6
+# Memory of the temporaries of a batch of pixels that is solved at once
+BATCH_BYTES = 64 * 1024**2
+
+
+class Hyperparameters(NamedTuple):
+    lengthscale: float
+    """Lengthscale of the Matern 3/2 kernel in days"""
+    coregionalization: np.ndarray
+    """Covariance B between the outputs, of shape (outputs, outputs)"""
+    noise: np.ndarray
+    """Noise variance of every output"""
+
+
+def matern32(a: np.ndarray, b: np.ndarray, lengthscale: float) -> np.ndarray:
+    """
+    Matern 3/2 correlation between two vectors of days.
+    """
+    r = np.sqrt(3) * np.abs(a[:, np.newaxis] - b[np.newaxis]) / lengthscale
+    return (1 + r) * np.exp(-r)
+
+
+def get_output_days(days: np.ndarray) -> np.ndarray:
+    """
+    Days at which the regression is predicted, every OUTPUT_STEP days from the first date, excluding the last date.
+    """
+    return np.arange(int(days.min()), int(days.max()), OUTPUT_STEP, dtype=np.float64)
+
+
+def get_inducing_days(days: np.ndarray) -> np.ndarray:
+    """
+    Inducing points every INDUCING_STEP days, spread evenly over the time range.
+    """
+    count = max(int(np.ceil((days.max() - days.min()) / INDUCING_STEP)), 1) + 1
+    return np.linspace(days.min(), days.max(), count)
+
+
+def normalize(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Normalize every output of every pixel to zero mean and unit variance over its observations, like FuseTS.
+    :param values: Array of shape (pixels, outputs, dates), NaN for missing values
+    :return: Normalized values with 0 for missing values, the mean and the standard deviation
+    """
+    # Outputs without observations result in NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(values, axis=2, keepdims=True)
+        std = np.nanstd(values, axis=2, keepdims=True)
+    std = np.where(std > 0, std, 1)
+    return np.nan_to_num((values - mean) / std), mean, std
+
+
+class _SparseModel:
+    """
+    Covariances of a block that are shared by all pixels, for given hyperparameters.
+
+    The covariance between the inducing points and the observations is B ⊗ Kzt, with Kzt the correlation between the
+    inducing days and the dates. Kuf W Kfu is therefore assembled from B and the per-output products Kzt Wj Kztᵀ, which
+    is cheaper by a factor of the number of outputs squared than a product with the full Kuf.
+    """
+
+    def __init__(
+        self,
+        hyperparameters: Hyperparameters,
+        days: np.ndarray,
+        inducing_days: np.ndarray,
+    ):
+        lengthscale, coregionalization, noise = hyperparameters
+        self.hyperparameters = hyperparameters
+        self.inducing_days = inducing_days
+        kzz = matern32(inducing_days, inducing_days, lengthscale)
+        kzz[np.diag_indices_from(kzz)] += JITTER
+        kzz_factor = cho_factor(kzz)
+        self.kuu = np.kron(coregionalization, kzz)
+        self.kuu_logdet = len(kzz) * np.linalg.slogdet(coregionalization)[1] + len(
+            coregionalization
+        ) * 2 * np.sum(np.log(np.diag(kzz_factor[0])))
+        self.kzt = matern32(inducing_days, days, lengthscale)
+        # Diagonal of Kff - Kfu Kuu⁻¹ Kuf = B ⊗ (Ktt - Kztᵀ Kzz⁻¹ Kzt), of shape (outputs, dates)
+        self.residual_variance = np.outer(
+            np.diag(coregionalization),
+            1 - np.sum(self.kzt * cho_solve(kzz_factor, self.kzt), axis=0),
+        )
+        self.noise = noise[:, np.newaxis]
+
+    def batches(self, pixels: int, outputs: int) -> Iterator[slice]:
+        """
+        Split the pixels into batches of which the temporaries of the posterior fit in BATCH_BYTES: per pixel, the
+        weighted correlations between the inducing points and the dates of every output, and the system and its
+        factorization over the inducing points of all outputs.
+        """
+        inducing, dates = self.kzt.shape
+        per_pixel = 8 * outputs * inducing * (dates + 2 * outputs * inducing)
+        size = max(BATCH_BYTES // per_pixel, 1)
+        for start in range(0, pixels, size):
+            yield slice(start, start + size)
+
+    def posterior(
+        self, values: np.ndarray, observed: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Posterior of the inducing points of a batch of pixels, see `batches`.
+        :param values: Normalized values of shape (pixels, outputs, dates), 0 for missing values
+        :param observed: Boolean array of the same shape
+        :return: The systems Kuu + Kuf W Kfu, the projected data Kuf W y and the weights W, with W the inverse noise
+            variance of the observations
+        """
+        coregionalization = self.hyperparameters.coregionalization
+        pixels, outputs, _ = values.shape
+        size = outputs * len(self.inducing_days)
+        weights = observed / self.noise
+        gram = np.matmul(self.kzt * weights[:, :, np.newaxis, :], self.kzt.T)
+        system = np.einsum(
+            "ij,kj,pjmn->pimkn", coregionalization, coregionalization, gram
+        ).reshape(pixels, size, size)
+        system += self.kuu
+        projected = np.einsum(
+            "ij,pjm->pim", coregionalization, (weights * values) @ self.kzt.T
+        ).reshape(pixels, size)
+        return system, projected, weights
+
+    def bound(self, values: np.ndarray, observed: np.ndarray) -> float:
+        """
+        Sum of the variational lower bound (Titsias, 2009) on the log marginal likelihood of the pixels.
+        """
+        bound = 0.0
+        for batch in self.batches(*values.shape[:2]):
+            system, projected, weights = self.posterior(values[batch], observed[batch])
+            factor = np.linalg.cholesky(system)
+            fit = np.sum(weights * values[batch] ** 2) - np.sum(
+                projected * np.linalg.solve(system, projected[..., np.newaxis])[..., 0]
+            )
+            logdet = (
+                2 * np.sum(np.log(np.diagonal(factor, axis1=1, axis2=2)))
+                - len(system) * self.kuu_logdet
+                + np.sum(observed[batch] * np.log(self.noise))
+            )
+            trace = np.sum(weights * self.residual_variance)
+            bound -= 0.5 * (
+                fit + logdet + np.sum(observed[batch]) * np.log(2 * np.pi) + trace
+            )
+        return bound
+
+    def predict(
+        self, values: np.ndarray, observed: np.ndarray, output_days: np.ndarray
+    ) -> np.ndarray:
+        """
+        Posterior mean of a batch of pixels at the output days.
+        :return: Array of shape (pixels, outputs, output days)
+        """
+        lengthscale, coregionalization, _ = self.hyperparameters
+        ksu = np.kron(
+            coregionalization, matern32(output_days, self.inducing_days, lengthscale)
+        )
+        pixels, outputs, _ = values.shape
+        result = np.empty((pixels, outputs, len(output_days)))
+        for batch in self.batches(pixels, outputs):
+            system, projected, _ = self.posterior(values[batch], observed[batch])
+            solution = np.linalg.solve(system, projected[..., np.newaxis])[..., 0]
+            result[batch] = (solution @ ksu.T).reshape(len(system), outputs, -1)
+        return result
+
+
+def _unpack(parameters: np.ndarray, outputs: int) -> Hyperparameters:
+    lengthscale = np.exp(parameters[0])
+    w = parameters[1 : outputs + 1]
+    kappa = np.exp(parameters[outputs + 1 : 2 * outputs + 1])
+    noise = np.exp(parameters[2 * outputs + 1 :])
+    return Hyperparameters(lengthscale, np.outer(w, w) + np.diag(kappa), noise)
+
+
+def fit_hyperparameters(
+    values: np.ndarray,
+    observed: np.ndarray,
+    days: np.ndarray,
+    inducing_days: np.ndarray,
+) -> Hyperparameters:
+    """
+    Hyperparameters that maximize the summed variational bound of a batch of pixels.
+    :param values: Normalized values of shape (pixels, outputs, dates), 0 for missing values
+    :param observed: Boolean array of the same shape
+    """
+    pixels, outputs, dates = values.shape
+    spacing = np.median(np.diff(np.unique(days))) if dates > 1 else 1
+    initial = np.concatenate(
+        [
+            [np.log(max(30, 2 * INDUCING_STEP, 3 * spacing))],
+            np.full(outputs, 0.8),
+            np.log(np.full(outputs, 0.3)),
+            np.log(np.full(outputs, 0.1)),
+        ]
+    )
+    bounds = (
+        [(np.log(INDUCING_STEP), np.log(365))]
+        + [(-3, 3)] * outputs
+        + [(np.log(1e-4), np.log(10))] * outputs
+        + [(np.log(1e-4), np.log(10))] * outputs
+    )
+    count = max(np.sum(observed), 1)
+
+    def objective(parameters):
+        model = _SparseModel(_unpack(parameters, outputs), days, inducing_days)
+        try:
+            return -model.bound(values, observed) / count
+        except np.linalg.LinAlgError:
+            return np.inf
+
+    result = minimize(
+        objective,
+        initial,
+        method="L-BFGS-B",
+        bounds=bounds,
+        options={"maxiter": 50},
+    )
+    return _unpack(result.x, outputs)
+
+
+def sparse_mogpr(
+    values: np.ndarray, days: np.ndarray, hyperparameters: Hyperparameters = None
+) -> Tuple[np.ndarray, np.ndarray, Hyperparameters]:
+    """
+    Sparse MOGPR of a batch of time series.
+    :param values: Array of shape (pixels, outputs, dates), NaN for missing values. The first output is the master
+        output, pixels without observations of it result in NaN.
+    :param days: Day of every date
+    :param hyperparameters: Hyperparameters shared by all pixels, fitted on a sample of the pixels by default
+    :return: Regression of shape (pixels, outputs, output days), the output days and the hyperparameters
+    """
+    pixels, outputs, dates = values.shape
+    days = np.asarray(days, dtype=np.float64)
+    output_days = get_output_days(days)
+    result = np.full((pixels, outputs, len(output_days)), np.nan)
+
+    observed = ~np.isnan(values)
+    valid = np.flatnonzero(np.any(observed[:, 0], axis=1))
+    if len(valid) == 0 or len(output_days) == 0:
+        return result, output_days, hyperparameters
+
+    normalized, mean, std = normalize(values[valid])
+    inducing_days = get_inducing_days(days)
+    if hyperparameters is None:
+        # Pixels spread evenly over the block
+        sample = np.unique(
+            np.linspace(0, len(valid) - 1, min(FIT_PIXELS, len(valid))).astype(int)
+        )
+        hyperparameters = fit_hyperparameters(
+            normalized[sample], observed[valid][sample], days, inducing_days
+        )
+
+    model = _SparseModel(hyperparameters, days, inducing_days)
+    predicted = model.predict(normalized, observed[valid], output_days)
+    result[valid] = predicted * std + mean
+    return result, output_days, hyperparameters
+
+
+def mogpr(
+    array: xr.DataArray, time_dimension: str = "t", bands_dimension: str = "bands"
+) -> xr.DataArray:
+    """
+    Sparse MOGPR of the bands of a data cube along its time dimension.
+    :return: Data cube with the regression every OUTPUT_STEP days
+    """
+    dims = array.dims
+    array = array.transpose(..., bands_dimension, time_dimension)
+    days = np.array(
+        [
+            date.toordinal()
+            for date in array[time_dimension].values.astype("datetime64[s]").tolist()
+        ],
+        dtype=np.float64,
+    )
+    result, output_days, _ = sparse_mogpr(
+        np.asarray(array.values, dtype=np.float64).reshape((-1, *array.shape[-2:])),
+        days,
+    )
+    dtype = array.dtype if np.issubdtype(array.dtype, np.floating) else np.float64
+    return xr.DataArray(
+        result.reshape((*array.shape[:-1], len(output_days))).astype(dtype),
+        dims=array.dims,
+        coords={
+            **{
+                name: coordinate
+                for name, coordinate in array.coords.items()
+                if time_dimension not in coordinate.dims
+            },
+            time_dimension: [datetime.fromordinal(int(day)) for day in output_days],
+        },
+    ).transpose(*dims)
+
+
+def apply_datacube(cube: XarrayDataCube, context: dict) -> XarrayDataCube:
+    """
+    Apply MOGPR along the t dimension, with the sparse regression of this module if context["mode"] is "sparse" and
+    the FuseTS regression otherwise. Only the FuseTS regression sets up the FuseTS dependencies.
+    """
+    if context.get("mode", DEFAULT_MODE) == "sparse":
+        return XarrayDataCube(mogpr(cube.get_array()))
+
+    setup_fusets_dependencies()
+    from fusets.openeo import mogpr_udf
+
+    return mogpr_udf.apply_datacube(cube, context)
+
+
+def load_mogpr_udf() -> str:
+    """
+    Loads an openEO UDF that applies MOGPR.
+    """
+    return Path(__file__).read_text()
@@ -0,0 +1,153 @@
+"""
+Compares the accuracy and runtime of the sparse MOGPR of `utils.mogpr` with the exact regression.
+
+The block is a synthetic NDVI and RVI time series with clouds and a shared seasonal signal. The exact regression is a
+dense Gaussian process with the hyperparameters fitted by the sparse mode, which isolates the error of the inducing
+points. FuseTS, which also fits the hyperparameters of every pixel, is compared as well when it and GPy are installed.
+
+Usage, from the root of the repository:
+
+    python -m utils.mogpr_benchmark [--size 16] [--years 1]
+
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from typing import Tuple
+
+import numpy as np
+import xarray as xr
+from scipy.linalg import cho_factor, cho_solve
+
+from utils.mogpr import (
+    Hyperparameters,
+    get_output_days,
+    matern32,
+    normalize,
+    sparse_mogpr,
+)
+
+
+def get_synthetic_block(
+    size: int, years: int, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Synthetic NDVI every 5 days and RVI every 6 days of a square block, with 40% of the NDVI clouded. The pixels share
+    a seasonal signal of which the phase varies.
+    :return: Values of shape (pixels, 2, dates), the day of every date and the noiseless NDVI at the output days
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2021, 1, 1).toordinal()
+    days = np.union1d(
+        np.arange(start, start + 365 * years, 5),
+        np.arange(start + 2, start + 365 * years, 6),
+    ).astype(np.float64)
+    pixels = size**2
+    phase = rng.normal(0, 10, pixels)[:, np.newaxis]
+    season = np.exp(-(((((days - start) % 365) - 180 - phase) / 50) ** 2))
+    ndvi = 0.2 + 0.6 * season + rng.normal(0, 0.03, (pixels, len(days)))
+    rvi = 0.3 + 0.4 * season + rng.normal(0, 0.05, (pixels, len(days)))
+    ndvi[:, ~np.isin(days - start, np.arange(0, 365 * years, 5))] = np.nan
+    ndvi[rng.random(ndvi.shape) < 0.4] = np.nan
+    rvi[:, ~np.isin(days - start, np.arange(2, 365 * years, 6))] = np.nan
+    truth = 0.2 + 0.6 * np.exp(
+        -(((((get_output_days(days) - start) % 365) - 180 - phase) / 50) ** 2)
+    )
+    return np.stack([ndvi, rvi], axis=1), days, truth
+
+
+def exact_mogpr(
+    values: np.ndarray, days: np.ndarray, hyperparameters: Hyperparameters
+) -> np.ndarray:
+    """
+    Exact MOGPR of every pixel with a dense Gaussian process over all observations of all outputs.
+    :param values: Array of shape (pixels, outputs, dates), NaN for missing values
+    :return: Regression of shape (pixels, outputs, output days)
+    """
+    pixels, outputs, dates = values.shape
+    output_days = get_output_days(days)
+    normalized, mean, std = normalize(values)
+    observed = ~np.isnan(values)
+    lengthscale, coregionalization, noise = hyperparameters
+    kff = np.kron(coregionalization, matern32(days, days, lengthscale))
+    ksf = np.kron(coregionalization, matern32(output_days, days, lengthscale))
+    result = np.full((pixels, outputs, len(output_days)), np.nan)
+    for pixel in range(pixels):
+        if not observed[pixel, 0].any():
+            continue
+        mask = observed[pixel].reshape(-1)
+        covariance = kff[np.ix_(mask, mask)] + np.diag(np.repeat(noise, dates)[mask])
+        solution = cho_solve(
+            cho_factor(covariance), normalized[pixel].reshape(-1)[mask]
+        )
+        regression = (ksf[:, mask] @ solution).reshape(outputs, -1)
+        result[pixel] = regression * std[pixel] + mean[pixel]
+    return result
+
+
+def rmse(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((a - b) ** 2)))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=16, help="Block size in pixels")
+    parser.add_argument("--years", type=int, default=1, help="Length of the series")
+    args = parser.parse_args(argv)
+
+    values, days, truth = get_synthetic_block(args.size, args.years)
+    pixels = args.size**2
+
+    begin = time.perf_counter()
+    sparse, output_days, hyperparameters = sparse_mogpr(values, days)
+    elapsed = time.perf_counter() - begin
+    print(f"sparse      {elapsed:8.2f} s {pixels / elapsed:10.1f} pixels/s")
+    begin = time.perf_counter()
+    sparse_mogpr(values, days, hyperparameters)
+    elapsed = time.perf_counter() - begin
+    print(f"  of which the regression without the hyperparameter fit {elapsed:.2f} s")
+
+    begin = time.perf_counter()
+    exact = exact_mogpr(values, days, hyperparameters)
+    elapsed = time.perf_counter() - begin
+    print(f"exact       {elapsed:8.2f} s {pixels / elapsed:10.1f} pixels/s")
+
+    print(
+        f"RMSE of the sparse NDVI to the exact NDVI {rmse(sparse[:, 0], exact[:, 0]):.4f}"
+    )
+    print(f"RMSE of the sparse NDVI to the truth      {rmse(sparse[:, 0], truth):.4f}")
+    print(f"RMSE of the exact NDVI to the truth       {rmse(exact[:, 0], truth):.4f}")
+
+    try:
+        from fusets.mogpr import mogpr as fusets_mogpr
+    except ImportError:
+        print("FuseTS is not installed, skipping the comparison with its regression")
+        return 0
+    cube = xr.DataArray(
+        values.reshape(args.size, args.size, 2, -1),
+        dims=("y", "x", "bands", "t"),
+        coords={
+            "bands": ["NDVI", "RVI"],
+            "t": [datetime.fromordinal(int(day)) for day in days],
+        },
+    )
+    begin = time.perf_counter()
+    try:
+        reference = fusets_mogpr(cube.to_dataset(dim="bands"))
+    except ImportError:
+        print("GPy is not installed, skipping the comparison with FuseTS")
+        return 0
+    elapsed = time.perf_counter() - begin
+    print(f"FuseTS      {elapsed:8.2f} s {pixels / elapsed:10.1f} pixels/s")
+    reference = reference["NDVI"].transpose("y", "x", "t").values.reshape(pixels, -1)
+    print(
+        f"RMSE of the sparse NDVI to FuseTS         {rmse(sparse[:, 0], reference):.4f}"
+    )
+    print(f"RMSE of FuseTS to the truth               {rmse(reference, truth):.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Offline openEO connection to build the process graphs of the catalog without network access.
+
+Building a UDP only needs the capabilities document of the backend and the metadata of the collections that are
+loaded and of the few processes the openEO client inspects. These documents are bundled in `utils/offline_backend/`
+and served through a `requests` adapter, so generation is instant, deterministic and works in air-gapped
+environments.
+
+Usage, from the root of the repository:
+
+    # refresh the bundled documents from a live backend
+    python -m utils.offline_connection --refresh https://openeofed.dataspace.copernicus.eu
+
+    # serve the bundled documents over HTTP, as a stand-in backend for tests
+    python -m utils.offline_connection --serve 8080
+
+    # also execute processing requests on local fixtures, as a mock backend for benchmarks
+    python -m utils.offline_connection --serve 8080 --fixtures fixtures/
+
+    # also run batch jobs, and let a fraction of them fail to test the retries of the batch runner
+    python -m utils.offline_connection --serve 8080 --fixtures fixtures/ --failure-rate 0.2
+
+"""
+
+import argparse
+import datetime
+import http.server
+import json
+import random
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import openeo
+import requests
+from requests.adapters import BaseAdapter
+
+OFFLINE_BACKEND_DIR = Path(__file__).parent / "offline_backend"
+
+
+def resolve_document(
+    path: str, documents_dir: Path = OFFLINE_BACKEND_DIR
+) -> Tuple[int, dict]:
+    """
+    Look up the openEO API document for a request path.
+    :param path: Path of the request, relative to the root of the backend
+    :param documents_dir: Folder containing the bundled documents
+    :return: HTTP status code and JSON document
+    """
+    parts = [part for part in path.split("/") if part]
+    collections_dir = documents_dir / "collections"
+    if not parts:
+        return 200, json.loads((documents_dir / "capabilities.json").read_text())
+    if parts == ["processes"]:
+        return 200, json.loads((documents_dir / "processes.json").read_text())
+    if parts == ["file_formats"]:
+        return 200, json.loads((documents_dir / "file_formats.json").read_text())
+    if parts == ["collections"]:
+        collections = [
+            json.loads(p.read_text()) for p in sorted(collections_dir.glob("*.json"))
+        ]
+        return 200, {"collections": collections, "links": []}
+    if len(parts) == 2 and parts[0] == "collections":
+        collection = collections_dir / f"{parts[1]}.json"
+        if collection.exists():
+            return 200, json.loads(collection.read_text())
+        return 404, {
+            "code": "CollectionNotFound",
+            "message": f"Collection '{parts[1]}' is not available offline.",
+        }
+    return 404, {
+        "code": "NotFound",
+        "message": f"'{path}' is not available offline.",
+    }
+
+
+class OfflineAdapter(BaseAdapter):
+    """
+    Transport adapter answering the requests of the openEO client with the bundled documents.
+    """
+
+    def __init__(self, documents_dir: Path = OFFLINE_BACKEND_DIR):
+        super().__init__()
+        self.documents_dir = documents_dir
+
+    def send(self, request, **kwargs) -> requests.Response:
+        status, document = resolve_document(
+            urlparse(request.url).path, self.documents_dir
+        )
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.HTTPStatus(status).phrase
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(document).encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def connect_offline(
+    url: str = "openeofed.dataspace.copernicus.eu",
+    documents_dir: Path = OFFLINE_BACKEND_DIR,
+) -> openeo.Connection:
+    """
+    Create an openEO connection that is served from the bundled documents instead of the network.
+    :param url: URL of the backend the process graphs are meant for
+    :param documents_dir: Folder containing the bundled documents
+    :return: openEO connection
+    """
+    session = requests.Session()
+    adapter = OfflineAdapter(documents_dir)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return openeo.connect(url, session=session, auto_validate=False)
+
+
+def refresh_documents(url: str, documents_dir: Path = OFFLINE_BACKEND_DIR):
+    """
+    Download the capabilities document, the file formats and the metadata of the bundled collections and processes
+    from a live backend.
+    """
+    connection = openeo.connect(url)
+    capabilities = connection.capabilities().capabilities
+    (documents_dir / "capabilities.json").write_text(
+        json.dumps(capabilities, indent=2) + "\n"
+    )
+    (documents_dir / "file_formats.json").write_text(
+        json.dumps(connection.list_file_formats(), indent=2) + "\n"
+    )
+    processes_path = documents_dir / "processes.json"
+    process_ids = {p["id"] for p in json.loads(processes_path.read_text())["processes"]}
+    processes = [p for p in connection.list_processes() if p["id"] in process_ids]
+    processes_path.write_text(
+        json.dumps({"processes": processes, "links": []}, indent=2) + "\n"
+    )
+    for path in sorted((documents_dir / "collections").glob("*.json")):
+        metadata = connection.describe_collection(path.stem)
+        path.write_text(json.dumps(metadata, indent=2) + "\n")
+        print(f"Refreshed collection '{path.stem}'")
+
+
+class OfflineRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler serving the bundled documents, as a local stand-in for an openEO backend. When a fixtures folder
+    is configured, processing requests are executed by the local executor and their result is returned as NetCDF:
+    synchronously (`POST /result`), or as batch jobs (`POST /jobs`, `POST /jobs/{id}/results`, `GET /jobs/{id}`,
+    `GET /jobs/{id}/results` and its asset, `GET /jobs/{id}/logs`) that run in a background thread.
+
+    With a `failure_rate`, that fraction of the processing requests and batch jobs fails, to exercise the retries of
+    clients such as `utils.batch_runner`.
+    """
+
+    documents_dir: Optional[Path] = OFFLINE_BACKEND_DIR
+    fixtures_dir: Optional[Path] = None
+    failure_rate: float = 0.0
+    # Batch jobs by id, shared by the handlers of all requests
+    jobs: Dict[str, dict] = {}
+    jobs_lock = threading.Lock()
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_document(self, status: int, document: dict, headers=None):
+        self.send_body(
+            status, json.dumps(document).encode("utf-8"), "application/json", headers
+        )
+
+    def send_not_found(self):
+        self.send_document(
+            404,
+            {"code": "NotFound", "message": f"'{self.path}' is not available offline."},
+        )
+
+    def execute(self, process: dict) -> bytes:
+        """
+        Execute a process graph on the fixtures.
+        :return: Result as NetCDF
+        """
+        from utils.local_executor import LocalExecutor, save
+
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Simulated failure of the mock backend")
+        result = LocalExecutor(self.fixtures_dir).execute(process)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "result.nc"
+            save(result.compute(), path)
+            return path.read_bytes()
+
+    def run_job(self, job: dict):
+        with self.jobs_lock:
+            job["status"] = "running"
+        try:
+            result, status, error = self.execute(job["process"]), "finished", None
+        except Exception as e:
+            result, status, error = None, "error", repr(e)
+        with self.jobs_lock:
+            job.update(result=result, status=status, error=error)
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts[:1] != ["jobs"] or len(parts) < 2:
+            status, document = resolve_document(
+                urlparse(self.path).path, self.documents_dir
+            )
+            self.send_document(status, document)
+            return
+
+        with self.jobs_lock:
+            job = self.jobs.get(parts[1])
+            job = dict(job) if job else None
+        if job is None:
+            self.send_document(
+                404,
+                {"code": "JobNotFound", "message": f"Job '{parts[1]}' does not exist."},
+            )
+        elif len(parts) == 2:
+            self.send_document(
+                200,
+                {
+                    key: job[key]
+                    for key in ("id", "title", "status", "created", "process")
+                },
+            )
+        elif parts[2:] == ["logs"]:
+            logs = (
+                [{"id": "0", "level": "error", "message": job["error"]}]
+                if job["error"]
+                else []
+            )
+            self.send_document(200, {"logs": logs, "links": []})
+        elif parts[2:] == ["results"] and job["status"] == "finished":
+            href = f"http://{self.headers['Host']}/jobs/{job['id']}/results/result.nc"
+            self.send_document(
+                200,
+                {
+                    "assets": {
+                        "result.nc": {"href": href, "type": "application/x-netcdf"}
+                    },
+                    "links": [],
+                },
+            )
+        elif parts[2:] == ["results", "result.nc"] and job["status"] == "finished":
+            self.send_body(200, job["result"], "application/x-netcdf")
+        elif parts[2:3] == ["results"]:
+            self.send_document(
+                400,
+                {
+                    "code": "JobNotFinished",
+                    "message": f"Job '{job['id']}' is {job['status']}.",
+                },
+            )
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if (
+            not self.fixtures_dir
+            or parts not in (["result"], ["jobs"])
+            and not (len(parts) == 3 and parts[0] == "jobs" and parts[2] == "results")
+        ):
+            self.send_not_found()
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or "{}")
+        if parts == ["result"]:
+            try:
+                body = self.execute(request["process"])
+            except Exception as e:
+                self.send_document(500, {"code": "Internal", "message": repr(e)})
+                return
+            self.send_body(200, body, "application/x-netcdf")
+        elif parts == ["jobs"]:
+            job_id = uuid.uuid4().hex[:12]
+            with self.jobs_lock:
+                self.jobs[job_id] = {
+                    "id": job_id,
+                    "title": request.get("title"),
+                    "status": "created",
+                    "created": datetime.datetime.now(datetime.timezone.utc).strftime(
+                        "%Y-%m-%dT%H:%M:%SZ"
+                    ),
+                    "process": request["process"],
+                    "result": None,
+                    "error": None,
+                }
+            self.send_body(
+                201,
+                b"",
+                "application/json",
+                {
+                    "Location": f"http://{self.headers['Host']}/jobs/{job_id}",
+                    "OpenEO-Identifier": job_id,
+                },
+            )
+        else:
+            with self.jobs_lock:
+                job = self.jobs.get(parts[1])
+                if job is not None and job["status"] not in ("queued", "running"):
+                    job["status"] = "queued"
+                    job.update(result=None, error=None)
+                    started = True
+                else:
+                    started = False
+            if job is None:
+                self.send_not_found()
+                return
+            if started:
+                threading.Thread(target=self.run_job, args=(job,), daemon=True).start()
+            self.send_body(202, b"", "application/json")
+
+
+def serve(
+    port: int,
+    documents_dir: Path = OFFLINE_BACKEND_DIR,
+    fixtures_dir: Optional[Path] = None,
+    failure_rate: float = 0.0,
+):
+    """
+    Serve the bundled documents on the given port until interrupted.
+    :param fixtures_dir: Folder with collection fixtures, enables synchronous processing requests and batch jobs
+    :param failure_rate: Fraction of the processing requests and batch jobs that fail
+    """
+    OfflineRequestHandler.documents_dir = documents_dir
+    OfflineRequestHandler.fixtures_dir = fixtures_dir
+    OfflineRequestHandler.failure_rate = failure_rate
+    server = http.server.ThreadingHTTPServer(("localhost", port), OfflineRequestHandler)
+    print(f"Serving offline openEO backend on http://localhost:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--refresh", metavar="URL", help="Backend to refresh from")
+    group.add_argument("--serve", metavar="PORT", type=int, help="Port to serve on")
+    parser.add_argument(
+        "--fixtures", type=Path, help="Execute processing requests on these fixtures"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the processing requests and batch jobs that fail",
+    )
+    args = parser.parse_args()
+
+    if args.refresh:
+        refresh_documents(args.refresh)
+    else:
+        serve(args.serve, fixtures_dir=args.fixtures, failure_rate=args.failure_rate)
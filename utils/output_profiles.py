@@ -0,0 +1,101 @@
+"""
+Output profiles and `save_result` presets for the UDPs of the catalog.
+
+The UDPs return float cubes by default. With the `int16` output profile, a UDP scales its result to int16 in-graph
+with `linear_scale_range`: the values are multiplied by a scale factor and clipped to [-INT16_MAX, INT16_MAX]. The
+output range of integers makes the backend write the result as int16. The graph does not set a no-data value: no-data
+pixels stay no-data, which the int16 data type of the backends encodes as its minimum, INT16_NODATA. Clipping to
+-INT16_MAX keeps that value free for no-data. This halves the size of the result compared to float32, and compresses
+better.
+
+The `save_result` presets are the format and options to use for the results:
+
+* `gtiff`: plain GeoTIFF;
+* `cog`: GeoTIFF in tiles of 512 by 512 pixels with DEFLATE compression at the highest level and internal overviews, a
+  cloud-optimized GeoTIFF that can be read partially and zoomed out without downloading it first;
+* `netcdf`: a single NetCDF file with the full time series, zlib-compressed in chunks of a single date and 512 by 512
+  pixels, so a date or a small area can be read without decompressing the whole file;
+* `parquet` and `csv`: a table, for the time series of geometries (see `utils.time_series`).
+
+    from utils.output_profiles import SAVE_RESULT_PRESETS
+
+    cube.save_result(**SAVE_RESULT_PRESETS["cog"])
+"""
+
+from typing import Union
+
+from openeo.api.process import Parameter
+from openeo.processes import ProcessBuilder, eq, if_
+from openeo.rest.datacube import DataCube
+
+OUTPUT_PROFILES = ["float32", "int16"]
+DEFAULT_OUTPUT_PROFILE = "float32"
+INT16_NODATA = -32768
+# Values of the scaled profile are divided by the scale factor to get the original values
+DEFAULT_SCALE = 10000
+INT16_MAX = 32767
+
+SAVE_RESULT_PRESETS = {
+    "gtiff": {"format": "GTiff", "options": {}},
+    "cog": {
+        "format": "GTiff",
+        "options": {
+            "overviews": "AUTO",
+            "TILED": "YES",
+            "BLOCKXSIZE": 512,
+            "BLOCKYSIZE": 512,
+            "COMPRESS": "DEFLATE",
+            "ZLEVEL": 9,
+        },
+    },
+    "netcdf": {
+        "format": "NetCDF",
+        "options": {
+            "zlib": True,
+            "complevel": 4,
+            "chunksizes": {"t": 1, "y": 512, "x": 512},
+        },
+    },
+    "parquet": {"format": "Parquet", "options": {}},
+    "csv": {"format": "CSV", "options": {}},
+}
+
+
+def get_output_profile_parameter(scale: float = DEFAULT_SCALE) -> Parameter:
+    """
+    UDP parameter to select the output profile.
+    :param scale: Scale factor of the int16 profile
+    """
+    return Parameter.string(
+        name="output_profile",
+        description=f"Encoding of the result. `float32` returns the values as floating point numbers. `int16` returns the values multiplied by {scale:g} and clipped to ±{INT16_MAX} as 16-bit integers, which makes the result at least two times smaller. No-data pixels stay no-data, which is {INT16_NODATA} in 16-bit integer results.",
+        default=DEFAULT_OUTPUT_PROFILE,
+        values=OUTPUT_PROFILES,
+    )
+
+
+def scale_to_int16(cube: DataCube, scale: float = DEFAULT_SCALE) -> DataCube:
+    """
+    Scale a cube to the int16 range. Values outside of [-INT16_MAX / scale, INT16_MAX / scale] are clipped.
+    """
+    limit = INT16_MAX / scale
+    return cube.linear_scale_range(-limit, limit, -INT16_MAX, INT16_MAX)
+
+
+def apply_output_profile(
+    cube: DataCube,
+    output_profile: Union[str, Parameter] = DEFAULT_OUTPUT_PROFILE,
+    scale: float = DEFAULT_SCALE,
+) -> Union[DataCube, ProcessBuilder]:
+    """
+    Encode the result of a UDP according to its output profile.
+    :param output_profile: One of OUTPUT_PROFILES, or a UDP parameter to select it at runtime
+    :param scale: Scale factor of the int16 profile
+    """
+    if isinstance(output_profile, Parameter):
+        return if_(eq(output_profile, "int16"), scale_to_int16(cube, scale), cube)
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(
+            f"Unknown output profile '{output_profile}', expected one of {OUTPUT_PROFILES}"
+        )
+    return scale_to_int16(cube, scale) if output_profile == "int16" else cube
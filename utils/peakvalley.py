@@ -0,0 +1,196 @@
+"""
+Peak-valley detection on a block of time series.
+
+The peak-valley UDF of FuseTS runs its detection for every pixel, while an event needs a drop of more than
+`drop_thr` followed by a recovery of more than `drop_thr * rec_r`, which most pixels never have. This module first
+computes the drop (maximum before minus value) and recovery (maximum after minus value) at every date for all pixels of
+a block at once with NaN-aware accumulations, and only runs the detection on the pixels where both thresholds are
+exceeded at the same date. The detection itself is the FuseTS algorithm, so the events are identical. It is not
+vectorized: merging the fluctuations of a drop and walking back over the slope before it or forward to the lowest
+value before the recovery depend on the previous step, so it still loops over the candidate pixels in Python.
+
+The events are returned as a uint8 cube instead of a float cube with NaN, using the PEAK, BETWEEN, VALLEY and
+NO_EVENT flags.
+
+The module is also an openEO UDF: `apply_datacube` detects the events along the `t` dimension with the `drop_thr`,
+`rec_r` and `slope_thr` from the context. The UDF code is returned by `load_peakvalley_udf()`.
+"""
+
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import xarray as xr
+from openeo.udf import XarrayDataCube
+from scipy.signal import find_peaks
+
+NO_EVENT = 0
+PEAK = 1
+BETWEEN = 2
+VALLEY = 3
+
+NANOSECONDS_PER_DAY = 86400 * 10**9
+
+
+def get_candidates(values: np.ndarray, drop_thr: float, rec_thr: float) -> np.ndarray:
+    """
+    Pixels with a value that is more than `drop_thr` below an earlier value and more than `rec_thr` below a later
+    value, the only pixels that can have an event.
+    :param values: Array of shape (dates, pixels), NaN for missing values
+    """
+    with np.errstate(invalid="ignore"):
+        drop = np.fmax.accumulate(values, axis=0) - values
+        recovery = np.fmax.accumulate(values[::-1], axis=0)[::-1] - values
+        return np.any((drop > drop_thr) & (recovery > rec_thr), axis=0)
+
+
+def _days(times: np.ndarray, end: int, start: int) -> int:
+    # Whole days between two dates, like timedelta.days
+    return (times[end] - times[start]) // NANOSECONDS_PER_DAY
+
+
+def _detect(
+    times: np.ndarray, y: np.ndarray, drop_thr: float, rec_thr: float, slope_thr: float
+) -> List[List[int]]:
+    """
+    Start and end date of the events of a single time series, as in FuseTS.
+    """
+    observed = np.flatnonzero(~np.isnan(y))
+    feature = y[observed]
+
+    pk_ids = find_peaks(feature)[0]
+    vl_ids = find_peaks(-feature)[0]
+    if len(pk_ids) == 0 or len(vl_ids) == 0:
+        return []
+
+    # if first valley before peak, add initial peak
+    if vl_ids[0] < pk_ids[0]:
+        pk_ids = np.insert(pk_ids, 0, 0)
+    # if last valley before last peak, add final valley
+    if vl_ids[-1] < pk_ids[-1]:
+        vl_ids = np.insert(vl_ids, len(pk_ids) - 1, len(feature) - 1)
+    pairs = np.transpose([pk_ids, vl_ids])
+
+    # merge fluctuations when dropping
+    merged = [pairs[0]]
+    for pk2, vl2 in pairs[1:]:
+        pk1, vl1 = merged[-1]
+        y11, y12, y21, y22 = feature[[pk1, vl1, pk2, vl2]]
+        if (y21 - y12 < rec_thr) & (y22 < y12) & (y21 < y11):
+            merged[-1][1] = vl2
+        else:
+            merged.append([pk2, vl2])
+    pairs = np.array(merged)
+    pairs = pairs[feature[pairs[:, 0]] - feature[pairs[:, 1]] > drop_thr]
+
+    events = []
+    for p_id, (pk, vl) in enumerate(pairs):
+        # move the start back over the slope before the drop
+        start, assigned_peak, skip_next = None, False, False
+        for idx in range(vl - 1, pk - 1, -1):
+            if skip_next:
+                skip_next = False
+                continue
+            if feature[idx] - feature[vl] > drop_thr and not assigned_peak:
+                start = idx
+                assigned_peak = True
+                continue
+            if assigned_peak:
+                # Like FuseTS, the slopes use the positions in the series with missing values
+                slope1 = (y[idx + 1] - y[idx]) / _days(times, idx + 1, idx)
+                slope2 = (y[idx + 1] - y[idx - 1]) / _days(times, idx + 1, idx - 1)
+                if slope1 < slope_thr:
+                    start = idx
+                elif idx - 1 >= pk and slope2 < slope_thr:
+                    start = idx - 1
+                    skip_next = True
+                else:
+                    break
+
+        # move the end to the lowest value before the recovery
+        next_pk = pairs[p_id + 1][0] + 1 if p_id + 1 < len(pairs) else len(feature)
+        for idx in range(vl, next_pk):
+            if feature[idx] - feature[vl] > rec_thr:
+                events.append([observed[start], observed[vl]])
+                break
+            if feature[idx] < feature[vl]:
+                vl = idx
+    return events
+
+
+def detect_peakvalley(
+    values: np.ndarray,
+    times: np.ndarray,
+    drop_thr: float = 0.15,
+    rec_r: float = 1.0,
+    slope_thr: float = -0.007,
+) -> np.ndarray:
+    """
+    Detect peak-valley events in a batch of time series.
+    :param values: Array of shape (dates, pixels), NaN for missing values
+    :param times: Date of every value
+    :param drop_thr: Threshold value for the amplitude of the drop in the input feature
+    :param rec_r: Threshold value for the amplitude of the recovery, relative to `drop_thr`
+    :param slope_thr: Threshold value for the slope where the peak should start
+    :return: uint8 array of shape (dates, pixels) with the PEAK, BETWEEN, VALLEY and NO_EVENT flags
+    """
+    rec_thr = drop_thr * rec_r
+    result = np.full(values.shape, NO_EVENT, dtype=np.uint8)
+    times = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for pixel in np.flatnonzero(get_candidates(values, drop_thr, rec_thr)):
+            for start, end in _detect(
+                times, values[:, pixel], drop_thr, rec_thr, slope_thr
+            ):
+                result[start + 1 : end, pixel] = BETWEEN
+                result[start, pixel] = PEAK
+                result[end, pixel] = VALLEY
+    return result
+
+
+def peakvalley(
+    array: xr.DataArray,
+    drop_thr: float = 0.15,
+    rec_r: float = 1.0,
+    slope_thr: float = -0.007,
+    time_dimension: str = "t",
+) -> xr.DataArray:
+    """
+    Detect peak-valley events along the time dimension of a data cube.
+    :return: uint8 data cube with the PEAK, BETWEEN, VALLEY and NO_EVENT flags
+    """
+    dims = array.dims
+    array = array.transpose(time_dimension, ...)
+    result = detect_peakvalley(
+        np.asarray(array.values, dtype=np.float64).reshape(array.shape[0], -1),
+        array[time_dimension].values,
+        drop_thr,
+        rec_r,
+        slope_thr,
+    )
+    return (
+        array.copy(data=result.reshape(array.shape))
+        .rename("peak_valley_mask")
+        .transpose(*dims)
+    )
+
+
+def apply_datacube(cube: XarrayDataCube, context: dict) -> XarrayDataCube:
+    """
+    Detect peak-valley events with context["drop_thr"], context["rec_r"] and context["slope_thr"] along t.
+    """
+    return XarrayDataCube(
+        peakvalley(
+            cube.get_array(),
+            drop_thr=context.get("drop_thr", 0.15),
+            rec_r=context.get("rec_r", 1.0),
+            slope_thr=context.get("slope_thr", -0.007),
+        )
+    )
+
+
+def load_peakvalley_udf() -> str:
+    """
+    Loads an openEO UDF that detects peak-valley events.
+    """
+    return Path(__file__).read_text()
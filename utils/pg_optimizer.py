@@ -0,0 +1,177 @@
+"""
+Optimization pass for the process graphs of the catalog.
+
+The openEO client only merges nodes that originate from the same Python object, so building the same sub-graph
+twice results in duplicate nodes. This pass rewrites a flat process graph, as created by `build_process_dict`:
+
+* common-subexpression elimination: structurally identical nodes (same process, namespace and arguments, after
+  merging their dependencies) are replaced by a single node;
+* dead-node pruning: nodes from which the result node can not be reached are removed.
+
+Both steps are also applied to the process graphs of callbacks, e.g. the reducer of `reduce_dimension`. The ids of
+the remaining nodes are kept, so the optimized graph is a subset of the original one.
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+ProcessGraph = Dict[str, dict]
+
+
+def _find_references(value) -> List[str]:
+    """
+    Find the nodes referenced by an argument value, ignoring the process graphs of callbacks.
+    """
+    if isinstance(value, dict):
+        if set(value) == {"from_node"}:
+            return [value["from_node"]]
+        if "process_graph" in value:
+            return []
+        return [ref for v in value.values() for ref in _find_references(v)]
+    if isinstance(value, list):
+        return [ref for v in value for ref in _find_references(v)]
+    return []
+
+
+def _rewrite_arguments(value, mapping: Dict[str, str]):
+    """
+    Replace the node references of an argument value and optimize the process graphs of callbacks.
+    """
+    if isinstance(value, dict):
+        if set(value) == {"from_node"}:
+            return {"from_node": mapping[value["from_node"]]}
+        if "process_graph" in value:
+            return {**value, "process_graph": optimize_graph(value["process_graph"])}
+        return {k: _rewrite_arguments(v, mapping) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewrite_arguments(v, mapping) for v in value]
+    return value
+
+
+def _get_result_node(process_graph: ProcessGraph) -> str:
+    results = [
+        node_id for node_id, node in process_graph.items() if node.get("result", False)
+    ]
+    if len(results) != 1:
+        raise ValueError(f"Expected a single result node, found {len(results)}")
+    return results[0]
+
+
+def _topological_order(process_graph: ProcessGraph) -> List[str]:
+    """
+    Order the nodes so that every node comes after the nodes it references, keeping the original order otherwise.
+    """
+    order = []
+    state = {}
+    for root in process_graph:
+        stack = [(root, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if expanded:
+                state[node_id] = "done"
+                order.append(node_id)
+                continue
+            if state.get(node_id) == "done":
+                continue
+            if state.get(node_id) == "visiting":
+                raise ValueError(f"Cycle in process graph at node '{node_id}'")
+            state[node_id] = "visiting"
+            stack.append((node_id, True))
+            references = _find_references(process_graph[node_id].get("arguments", {}))
+            for reference in reversed(references):
+                if reference not in process_graph:
+                    raise ValueError(
+                        f"Node '{node_id}' references unknown node '{reference}'"
+                    )
+                if state.get(reference) != "done":
+                    stack.append((reference, False))
+    return order
+
+
+def eliminate_common_subexpressions(process_graph: ProcessGraph) -> ProcessGraph:
+    """
+    Merge the structurally identical nodes of a process graph. Of every group of identical nodes, the first one is
+    kept and the references to the others are redirected to it.
+    """
+    result_node = _get_result_node(process_graph)
+    mapping = {}
+    canonical = {}
+    optimized = {}
+    for node_id in _topological_order(process_graph):
+        node = process_graph[node_id]
+        arguments = _rewrite_arguments(node.get("arguments", {}), mapping)
+        key = json.dumps(
+            [node["process_id"], node.get("namespace"), arguments], sort_keys=True
+        )
+        if key in canonical:
+            mapping[node_id] = canonical[key]
+            continue
+        canonical[key] = mapping[node_id] = node_id
+        optimized[node_id] = {
+            **{k: v for k, v in node.items() if k != "result"},
+            "arguments": arguments,
+        }
+
+    optimized[mapping[result_node]]["result"] = True
+    return {
+        node_id: optimized[node_id] for node_id in process_graph if node_id in optimized
+    }
+
+
+def prune_unreachable_nodes(process_graph: ProcessGraph) -> ProcessGraph:
+    """
+    Remove the nodes that do not contribute to the result node.
+    """
+    reachable = set()
+    stack = [_get_result_node(process_graph)]
+    while stack:
+        node_id = stack.pop()
+        if node_id in reachable:
+            continue
+        reachable.add(node_id)
+        stack.extend(_find_references(process_graph[node_id].get("arguments", {})))
+    return {
+        node_id: node for node_id, node in process_graph.items() if node_id in reachable
+    }
+
+
+def optimize_graph(process_graph: ProcessGraph) -> ProcessGraph:
+    """
+    Optimize a flat process graph and the process graphs of its callbacks.
+    """
+    return prune_unreachable_nodes(eliminate_common_subexpressions(process_graph))
+
+
+def count_nodes(process_graph: ProcessGraph) -> int:
+    """
+    Count the nodes of a process graph, including the nodes of its callbacks.
+    """
+
+    def count_callbacks(value) -> int:
+        if isinstance(value, dict):
+            if "process_graph" in value:
+                return count_nodes(value["process_graph"])
+            return sum(count_callbacks(v) for v in value.values())
+        if isinstance(value, list):
+            return sum(count_callbacks(v) for v in value)
+        return 0
+
+    return sum(
+        1 + count_callbacks(node.get("arguments", {}))
+        for node in process_graph.values()
+    )
+
+
+def optimize_process(process: dict) -> Tuple[dict, int, int]:
+    """
+    Optimize the process graph of a process definition, as created by `build_process_dict`.
+    :param process: Process definition containing a `process_graph`
+    :return: The optimized process definition and the number of nodes before and after optimization
+    """
+    process_graph = process["process_graph"]
+    optimized = optimize_graph(process_graph)
+    return (
+        {**process, "process_graph": optimized},
+        count_nodes(process_graph),
+        count_nodes(optimized),
+    )
@@ -0,0 +1,248 @@
+"""
+Vectorized phenology metrics.
+
+The phenology UDF of FuseTS computes the Phenolopy phenometrics with a chain of xarray operations that each create
+labeled copies of the full block. This module computes the same metrics with the same defaults (peak of season as
+peak metric, base as base metric, "first_of_slope" start and end of season) with NumPy operations on a
+(time, pixels) array: masked reductions for the peak, valley and base, gradients for the slopes and index lookups
+for the start and end of season, so a block is processed without any loop over its pixels.
+
+The module is also an openEO UDF: `apply_datacube` returns the metrics as bands of a single time step, like the
+FuseTS UDF. The UDF code is returned by `load_phenology_udf()`. Run the module to compare its throughput with FuseTS:
+
+    python -m utils.phenology [--size 256] [--dates 73]
+"""
+
+import warnings
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import xarray as xr
+from openeo.udf import XarrayDataCube
+
+PHENOLOGY_BANDS = [
+    "pos_values",
+    "pos_times",
+    "mos_values",
+    "vos_values",
+    "vos_times",
+    "bse_values",
+    "aos_values",
+    "sos_values",
+    "sos_times",
+    "eos_values",
+    "eos_times",
+    "los_values",
+    "roi_values",
+    "rod_values",
+    "lios_values",
+    "sios_values",
+    "liot_values",
+    "siot_values",
+]
+
+
+def _take(values: np.ndarray, index: np.ndarray) -> np.ndarray:
+    return np.take_along_axis(values, index[np.newaxis], axis=0)[0]
+
+
+def _first_of_slope(
+    slope: np.ndarray, selected: np.ndarray, day_of_year: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Value and day of year of the lowest value of a slope where `selected` holds. Like Phenolopy, the value is NaN and
+    the day of year 0 if there is none. Phenolopy takes the lowest distance to the median of the selected values,
+    which is the lowest selected value, so the median is not computed.
+    """
+    selected &= ~np.isnan(slope)
+    index = np.argmin(np.where(selected, slope, np.inf), axis=0)
+    empty = ~np.any(selected, axis=0)
+    values = np.where(empty, np.nan, _take(slope, index))
+    return values, np.where(empty, 0, day_of_year[index])
+
+
+def _nanmean(values: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    return np.sum(np.where(selected, values, 0), axis=0) / np.sum(selected, axis=0)
+
+
+def _integral(values: np.ndarray) -> np.ndarray:
+    # Trapezoidal rule with a spacing of 1
+    return np.sum(values[1:] + values[:-1], axis=0) / 2
+
+
+def phenology_metrics(
+    values: np.ndarray, day_of_year: np.ndarray, days: np.ndarray = None
+) -> Dict[str, np.ndarray]:
+    """
+    Phenology metrics of a batch of time series.
+    :param values: Array of shape (dates, pixels), NaN for missing values
+    :param day_of_year: Day of year of every date
+    :param days: Position of every date on the time axis, used for the slopes, by default the day of year
+    :return: Metric name (PHENOLOGY_BANDS) to array of shape (pixels), NaN for pixels without values
+    """
+    values = np.asarray(values, dtype=np.float32)
+    day_of_year = np.asarray(day_of_year)
+    if days is None:
+        days = day_of_year
+    dates = values.shape[0]
+    no_data = np.all(np.isnan(values), axis=0)
+    values = np.where(no_data, np.float32(0), values)
+    doy = day_of_year[:, np.newaxis]
+
+    # All-NaN slopes and zero-length slopes are expected and result in NaN
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        # NaN is ignored by filling it with the value that is never selected
+        missing = np.isnan(values)
+        pos_index = np.argmax(np.where(missing, -np.inf, values), axis=0)
+        pos_values = _take(values, pos_index)
+        pos_times = day_of_year[pos_index]
+        vos_index = np.argmin(np.where(missing, np.inf, values), axis=0)
+        vos_values = _take(values, vos_index)
+        vos_times = day_of_year[vos_index]
+
+        slope_l = np.where(doy <= pos_times, values, np.nan)
+        slope_r = np.where(doy >= pos_times, values, np.nan)
+        upper_l = slope_l >= np.fmax.reduce(slope_l, axis=0) * np.float32(0.8)
+        upper_r = slope_r >= np.fmax.reduce(slope_r, axis=0) * np.float32(0.8)
+        mos_values = (_nanmean(slope_l, upper_l) + _nanmean(slope_r, upper_r)) / 2
+        bse_values = (
+            np.fmin.reduce(slope_l, axis=0) + np.fmin.reduce(slope_r, axis=0)
+        ) / 2
+        aos_values = pos_values - bse_values
+
+        if dates > 1:
+            gradient_l = np.gradient(slope_l, days, axis=0)
+            gradient_r = np.gradient(slope_r, days, axis=0)
+        else:
+            gradient_l = gradient_r = np.full_like(slope_l, np.nan)
+        sos_values, sos_times = _first_of_slope(slope_l, gradient_l > 0, day_of_year)
+        eos_values, eos_times = _first_of_slope(slope_r, gradient_r < 0, day_of_year)
+
+        los_values = eos_times - sos_times
+        los_values = np.where(los_values >= 0, los_values, day_of_year[-1] + los_values)
+        roi_values = (pos_values - sos_values) / (pos_times - sos_times)
+        rod_values = np.abs((eos_values - pos_values) / (eos_times - pos_times))
+
+        season = (doy >= sos_times) & (doy <= eos_times)
+        base = np.where(np.isnan(bse_values), values, bse_values)
+        lios_values = _integral(np.where(season, values, 0))
+        sios_values = lios_values - _integral(np.where(season, base, 0))
+        liot_values = _integral(values)
+        siot_values = liot_values - _integral(base)
+
+    metrics = {
+        "pos_values": pos_values,
+        "pos_times": pos_times,
+        "mos_values": mos_values,
+        "vos_values": vos_values,
+        "vos_times": vos_times,
+        "bse_values": bse_values,
+        "aos_values": aos_values,
+        "sos_values": sos_values,
+        "sos_times": sos_times,
+        "eos_values": eos_values,
+        "eos_times": eos_times,
+        "los_values": los_values,
+        "roi_values": roi_values,
+        "rod_values": rod_values,
+        "lios_values": lios_values,
+        "sios_values": sios_values,
+        "liot_values": liot_values,
+        "siot_values": siot_values,
+    }
+    return {
+        name: np.where(no_data, np.nan, metric.astype(np.float32))
+        for name, metric in metrics.items()
+    }
+
+
+def phenology(array: xr.DataArray, time_dimension: str = "t") -> xr.DataArray:
+    """
+    Phenology metrics of a data cube.
+    :return: Data cube with a `bands` dimension with the metrics instead of the time dimension
+    """
+    array = array.transpose(time_dimension, ...)
+    times = array[time_dimension].values.astype("datetime64[ns]")
+    days = (times - times[0]) / np.timedelta64(1, "D")
+    metrics = phenology_metrics(
+        array.values.reshape(array.shape[0], -1),
+        array[time_dimension].dt.dayofyear.values,
+        days,
+    )
+    return xr.DataArray(
+        np.stack([metrics[name] for name in PHENOLOGY_BANDS]).reshape(
+            (len(PHENOLOGY_BANDS), *array.shape[1:])
+        ),
+        dims=("bands", *array.dims[1:]),
+        coords={
+            **{
+                name: coordinate
+                for name, coordinate in array.coords.items()
+                if time_dimension not in coordinate.dims
+            },
+            "bands": PHENOLOGY_BANDS,
+        },
+    )
+
+
+def apply_datacube(cube: XarrayDataCube, context: dict) -> XarrayDataCube:
+    """
+    Compute the phenology metrics of the first band, as bands of the first time step.
+    """
+    array = cube.get_array()
+    if "bands" in array.dims:
+        array = array.isel(bands=0, drop=True)
+    result = phenology(array)
+    return XarrayDataCube(result.expand_dims(t=[array.t.values[0]]))
+
+
+def load_phenology_udf() -> str:
+    """
+    Loads an openEO UDF that computes phenology metrics.
+    """
+    return Path(__file__).read_text()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput of the phenology metrics with FuseTS"
+    )
+    parser.add_argument("--size", type=int, default=256, help="Block size in pixels")
+    parser.add_argument("--dates", type=int, default=73, help="Number of dates")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    t = np.arange(args.dates) * 365 / args.dates
+    season = 0.2 + 0.6 * np.exp(-(((t - 180) / 50) ** 2))
+    block = season[:, np.newaxis, np.newaxis] + rng.normal(
+        0, 0.03, (args.dates, args.size, args.size)
+    )
+    block[rng.random(block.shape) < 0.2] = np.nan
+    cube = xr.DataArray(
+        block.astype(np.float32),
+        dims=("t", "y", "x"),
+        coords={
+            "t": np.datetime64("2021-01-01") + (t * 86400).astype("timedelta64[s]")
+        },
+    )
+    pixels = args.size**2
+
+    start = time.perf_counter()
+    phenology(cube)
+    elapsed = time.perf_counter() - start
+    print(f"vectorized  {elapsed:8.2f} s {pixels / elapsed:12.0f} pixels/s")
+
+    try:
+        from fusets.analytics import phenology as fusets_phenology
+    except ImportError:
+        print("FuseTS is not installed, skipping the comparison")
+    else:
+        start = time.perf_counter()
+        fusets_phenology(cube.rename(t="time"))
+        elapsed = time.perf_counter() - start
+        print(f"FuseTS      {elapsed:8.2f} s {pixels / elapsed:12.0f} pixels/s")
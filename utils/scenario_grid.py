@@ -0,0 +1,366 @@
+"""
+Generates scaled benchmark scenarios for the UDPs of the catalog, with matching synthetic fixtures.
+
+For every UDP a scenario is written per cell of a grid of area of interest sizes (1 ha to 100 km²) and time spans
+(1 day to 3 years), and per combination of the values of its enumerated parameters, e.g. the S1 and S2 collections
+of mogpr_s1s2. Every cell gets synthetic Sentinel-1 and Sentinel-2 fixtures of the matching size, with one NetCDF
+file per acquisition date: a 10 m grid with a seasonal vegetation signal, noise and clouds flagged in the SCL band.
+
+The output folder contains a folder per cell, laid out so the benchmark runner can use it directly:
+
+    <output>/grid.json                                         size of every cell
+    <output>/<cell>/fixtures/<collection id>/<YYYY-MM-DD>.nc   synthetic fixtures
+    <output>/<cell>/<algorithm>/benchmark_scenario/<scenario>.json
+
+Usage, from the root of the repository:
+
+    python -m utils.scenario_grid OUTPUT [--algorithms ...] [--aoi 1ha 1km2 ...] [--span 1d 1m ...] [--no-fixtures]
+
+    # benchmark a cell
+    python -m utils.benchmark --scenarios-dir OUTPUT/1km2_1y --fixtures OUTPUT/1km2_1y/fixtures
+
+    # throughput of the benchmarked cells, in pixel acquisitions per second
+    python -m utils.scenario_grid OUTPUT --throughput benchmark_history.csv
+
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import math
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import xarray as xr
+
+from utils.output_profiles import SAVE_RESULT_PRESETS
+
+REPOSITORY_ROOT = Path(__file__).parent.parent
+NAMESPACE = "https://raw.githubusercontent.com/VITObelgium/openeo_algorithm_catalog/refs/heads/main/{algorithm}/openeo_udp/{algorithm}.json"
+
+# Area of interest sizes in m², centred on the fields of the existing scenarios
+AOI_SIZES = {"1ha": 1e4, "1km2": 1e6, "10km2": 1e7, "100km2": 1e8}
+AOI_CENTRE = (5.18, 51.25)
+# Time spans in days, starting at START_DATE
+TIME_SPANS = {"1d": 1, "1m": 30, "1y": 365, "3y": 1095}
+START_DATE = datetime.date(2021, 1, 1)
+PIXEL_SIZE = 10
+# Enumerated parameters that have no effect in the scenarios, e.g. the reducer of the time series of geometries
+UNUSED_PARAMETERS = {"reducer"}
+# Revisit time in days of the synthetic collections
+REVISIT = {"SENTINEL2_L2A": 5, "SENTINEL1_GRD": 6}
+
+
+def get_extent(aoi_size: float, centre=AOI_CENTRE) -> dict:
+    """
+    Square GeoJSON polygon of the given area in m², around the centre.
+    """
+    half_side = math.sqrt(aoi_size) / 2
+    lon, lat = centre
+    dx = half_side / (111320 * math.cos(math.radians(lat)))
+    dy = half_side / 110540
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [lon - dx, lat - dy],
+                [lon + dx, lat - dy],
+                [lon + dx, lat + dy],
+                [lon - dx, lat + dy],
+                [lon - dx, lat - dy],
+            ]
+        ],
+    }
+
+
+def get_temporal_extent(days: int) -> List[str]:
+    if days == 1:
+        return [START_DATE.isoformat(), START_DATE.isoformat()]
+    return [
+        START_DATE.isoformat(),
+        (START_DATE + datetime.timedelta(days=days)).isoformat(),
+    ]
+
+
+def get_dates(collection_id: str, days: int) -> List[datetime.date]:
+    return [
+        START_DATE + datetime.timedelta(days=offset)
+        for offset in range(0, days, REVISIT[collection_id])
+    ]
+
+
+def load_udps(algorithms: Optional[Iterable[str]] = None) -> Dict[str, dict]:
+    udps = {
+        path.stem: json.loads(path.read_text())
+        for path in sorted(REPOSITORY_ROOT.glob("*/openeo_udp/*.json"))
+        if path.stem == path.parent.parent.name
+    }
+    if algorithms:
+        unknown = set(algorithms) - set(udps)
+        if unknown:
+            raise ValueError(f"Unknown algorithm(s): {', '.join(sorted(unknown))}")
+        udps = {name: udps[name] for name in algorithms}
+    return udps
+
+
+def find_collections(process_graph: dict) -> Dict[str, set]:
+    """
+    Find the collections loaded by a process graph, including its callbacks.
+    :return: Mapping of collection id to the bands that are loaded
+    """
+    collections = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            if value.get("process_id") == "load_collection":
+                bands = value["arguments"].get("bands") or []
+                collections.setdefault(value["arguments"]["id"], set()).update(bands)
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+
+    walk(process_graph)
+    return collections
+
+
+def get_variants(udp: dict) -> List[dict]:
+    """
+    Arguments for every combination of the values of the enumerated parameters of a UDP.
+    """
+    enums = {
+        p["name"]: p["schema"]["enum"]
+        for p in udp.get("parameters", [])
+        if isinstance(p.get("schema"), dict)
+        and "enum" in p["schema"]
+        and p["name"] not in UNUSED_PARAMETERS
+    }
+    return [dict(zip(enums, values)) for values in itertools.product(*enums.values())]
+
+
+def build_scenario(algorithm: str, arguments: dict) -> dict:
+    node_id = f"{algorithm.replace('_', '')}1"
+    return {
+        "process_graph": {
+            node_id: {
+                "arguments": arguments,
+                "namespace": NAMESPACE.format(algorithm=algorithm),
+                "process_id": algorithm,
+            },
+            "saveresult1": {
+                "arguments": {
+                    "data": {"from_node": node_id},
+                    **SAVE_RESULT_PRESETS["cog"],
+                },
+                "process_id": "save_result",
+                "result": True,
+            },
+        }
+    }
+
+
+def write_fixture(
+    collection_id: str,
+    extent: dict,
+    days: int,
+    path: Path,
+    bands: Optional[Iterable[str]] = None,
+    seed: int = 42,
+):
+    """
+    Write synthetic fixtures of a collection, one NetCDF file per acquisition date. Every pixel follows a seasonal
+    vegetation curve with its own peak and width; Sentinel-2 dates contain clouds, which are flagged in the SCL band.
+    """
+    (west, south), _, (east, north) = extent["coordinates"][0][:3]
+    lat = (south + north) / 2
+    width = max(
+        round((east - west) * 111320 * math.cos(math.radians(lat)) / PIXEL_SIZE), 1
+    )
+    height = max(round((north - south) * 110540 / PIXEL_SIZE), 1)
+    x = np.linspace(west, east, width, endpoint=False) + (east - west) / width / 2
+    y = np.linspace(north, south, height, endpoint=False) - (north - south) / height / 2
+
+    rng = np.random.default_rng(seed)
+    peak = rng.normal(190, 15, (height, width)).astype(np.float32)
+    season_width = rng.normal(40, 10, (height, width)).clip(15).astype(np.float32)
+    yy, xx = np.mgrid[:height, :width]
+
+    path.mkdir(parents=True, exist_ok=True)
+    for date in get_dates(collection_id, days):
+        doy = date.timetuple().tm_yday
+        vegetation = np.exp(-(((doy - peak) / season_width) ** 2))
+        if collection_id == "SENTINEL1_GRD":
+            speckle = rng.gamma(4, 1 / 4, (2, height, width)).astype(np.float32)
+            values = {
+                "VV": (0.05 + 0.05 * vegetation) * speckle[0],
+                "VH": (0.01 + 0.03 * vegetation) * speckle[1],
+            }
+        else:
+            noise = rng.normal(0, 0.02, (height, width)).astype(np.float32)
+            red = 0.08 - 0.05 * vegetation + noise
+            nir = 0.2 + 0.3 * vegetation + noise
+            swir = 0.25 - 0.1 * vegetation + noise
+            reflectance = {
+                "B02": red * 0.8,
+                "B03": red * 1.1,
+                "B04": red,
+                "B05": (red + nir) / 2,
+                "B06": nir * 0.9,
+                "B07": nir * 0.95,
+                "B08": nir,
+                "B8A": nir * 1.02,
+                "B11": swir,
+                "B12": swir * 0.7,
+            }
+            scl = np.where(vegetation > 0.3, 4, 5).astype(np.uint8)
+            if rng.random() < 0.3:
+                cx, cy = rng.integers(0, width), rng.integers(0, height)
+                radius = rng.uniform(0.05, 0.3) * max(width, height)
+                cloud = (xx - cx) ** 2 + (yy - cy) ** 2 < radius**2
+                shadow = (xx - cx + radius / 2) ** 2 + (yy - cy - radius) ** 2 < (
+                    radius / 2
+                ) ** 2
+                scl[shadow & ~cloud] = 3
+                scl[cloud] = 9
+                for band_values in reflectance.values():
+                    band_values[cloud] = 0.6
+            values = {
+                band: (v * 10000).clip(1, 65535).astype(np.uint16)
+                for band, v in reflectance.items()
+            }
+            values["SCL"] = scl
+
+        dataset = xr.Dataset(
+            {
+                band: (("t", "y", "x"), v[np.newaxis])
+                for band, v in values.items()
+                if bands is None or band in bands
+            },
+            coords={"t": [np.datetime64(date, "ns")], "y": y, "x": x},
+        )
+        dataset.to_netcdf(path / f"{date.isoformat()}.nc")
+    return width, height
+
+
+def generate_grid(
+    output_dir: Path,
+    algorithms: Optional[Iterable[str]] = None,
+    aoi_sizes: Optional[Iterable[str]] = None,
+    time_spans: Optional[Iterable[str]] = None,
+    fixtures: bool = True,
+) -> dict:
+    """
+    Write the scenarios and fixtures of the grid.
+    :param output_dir: Folder to write the grid to
+    :param algorithms: Algorithms to generate scenarios for, all algorithms when not given
+    :param aoi_sizes: Names of the AOI sizes (AOI_SIZES), all sizes when not given
+    :param time_spans: Names of the time spans (TIME_SPANS), all spans when not given
+    :param fixtures: Also write the synthetic fixtures
+    :return: Description of the cells of the grid
+    """
+    udps = load_udps(algorithms)
+    collections = {}
+    for udp in udps.values():
+        for collection_id, bands in find_collections(udp["process_graph"]).items():
+            collections.setdefault(collection_id, set()).update(bands)
+    unsupported = set(collections) - set(REVISIT)
+    if unsupported:
+        raise ValueError(f"No synthetic data for {', '.join(sorted(unsupported))}")
+
+    grid = {}
+    for aoi_name, span_name in itertools.product(
+        aoi_sizes or AOI_SIZES, time_spans or TIME_SPANS
+    ):
+        cell = f"{aoi_name}_{span_name}"
+        cell_dir = output_dir / cell
+        extent = get_extent(AOI_SIZES[aoi_name])
+        days = TIME_SPANS[span_name]
+        for algorithm, udp in udps.items():
+            scenario_dir = cell_dir / algorithm / "benchmark_scenario"
+            scenario_dir.mkdir(parents=True, exist_ok=True)
+            for variant in get_variants(udp):
+                name = "_".join([algorithm, cell, *variant.values()]).lower()
+                scenario = build_scenario(
+                    algorithm,
+                    {
+                        "spatial_extent": extent,
+                        "temporal_extent": get_temporal_extent(days),
+                        **variant,
+                    },
+                )
+                (scenario_dir / f"{name}.json").write_text(
+                    json.dumps(scenario, indent=4) + "\n"
+                )
+
+        grid[cell] = {"aoi_m2": AOI_SIZES[aoi_name], "days": days}
+        for collection_id, bands in collections.items():
+            if fixtures:
+                width, height = write_fixture(
+                    collection_id,
+                    extent,
+                    days,
+                    cell_dir / "fixtures" / collection_id,
+                    bands=bands | {"SCL"} if bands else None,
+                )
+                grid[cell].update(width=width, height=height)
+            grid[cell][f"{collection_id}_dates"] = len(get_dates(collection_id, days))
+        print(f"Generated cell '{cell}'")
+
+    (output_dir / "grid.json").write_text(json.dumps(grid, indent=2) + "\n")
+    return grid
+
+
+def print_throughput(output_dir: Path, history_path: Path):
+    """
+    Print the throughput of the benchmarked scenarios of the grid, in Sentinel-2 pixel acquisitions per second.
+    """
+    from utils.benchmark import load_history
+
+    grid = json.loads((output_dir / "grid.json").read_text())
+    print(f"{'scenario':<50}{'pixels':>14}{'wall time':>12}{'pixels/s':>14}")
+    for record in load_history(history_path):
+        algorithm, name = record["scenario"].split("/")
+        cell = "_".join(name[len(algorithm) + 1 :].split("_")[:2])
+        if cell not in grid or record["status"] != "ok" or "width" not in grid[cell]:
+            continue
+        pixels = (
+            grid[cell]["width"]
+            * grid[cell]["height"]
+            * grid[cell]["SENTINEL2_L2A_dates"]
+        )
+        wall_time = float(record["wall_time"])
+        print(f"{name:<50}{pixels:>14}{wall_time:>10.2f} s{pixels / wall_time:>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output", type=Path, help="Folder to write the grid to")
+    parser.add_argument("--algorithms", nargs="*", help="Algorithms (default: all)")
+    parser.add_argument("--aoi", nargs="*", choices=list(AOI_SIZES), help="AOI sizes")
+    parser.add_argument(
+        "--span", nargs="*", choices=list(TIME_SPANS), help="Time spans"
+    )
+    parser.add_argument(
+        "--no-fixtures", action="store_true", help="Only write the scenarios"
+    )
+    parser.add_argument(
+        "--throughput",
+        type=Path,
+        metavar="HISTORY",
+        help="Print the throughput of the grid from a benchmark history instead",
+    )
+    args = parser.parse_args()
+
+    if args.throughput:
+        print_throughput(args.output, args.throughput)
+    else:
+        generate_grid(
+            args.output,
+            algorithms=args.algorithms,
+            aoi_sizes=args.aoi,
+            time_spans=args.span,
+            fixtures=not args.no_fixtures,
+        )
@@ -0,0 +1,42 @@
+"""
+Shared Sentinel-2 loading for the UDPs of the catalog.
+
+The spectral bands and the SCL band are loaded with a single `load_collection`, so a job only looks up and reads
+the SENTINEL2_L2A tiles once. The SCL band is then split off in-graph to build the dilated cloud mask.
+"""
+
+from typing import List, Sequence, Union
+
+from openeo.api.process import Parameter
+from openeo.rest.connection import Connection
+from openeo.rest.datacube import DataCube
+
+SCL_BAND = "SCL"
+# Distance in metres over which `to_scl_dilation_mask` spreads a cloud by default: the radius of its largest kernel
+# (201 pixels of 10 m), plus a pixel
+SCL_DILATION_RADIUS = (201 // 2 + 1) * 10
+
+
+def load_masked_s2(
+    connection: Connection,
+    spatial_extent: Union[Parameter, dict, None],
+    temporal_extent: Union[Parameter, Sequence[str], None],
+    bands: List[str],
+) -> DataCube:
+    """
+    Create a cloud masked Sentinel-2 L2A datacube.
+    :param connection: openEO connection
+    :param spatial_extent: Area of interest
+    :param temporal_extent: Time of interest
+    :param bands: Spectral bands to load, in the order of the resulting bands dimension
+    :return: Datacube with the requested bands, masked with the dilated SCL mask
+    """
+    s2 = connection.load_collection(
+        "SENTINEL2_L2A",
+        temporal_extent=temporal_extent,
+        spatial_extent=spatial_extent,
+        bands=[*bands, SCL_BAND],
+    )
+    scl = s2.filter_bands([SCL_BAND])
+    mask = scl.process("to_scl_dilation_mask", data=scl)
+    return s2.filter_bands(bands).mask(mask=mask)
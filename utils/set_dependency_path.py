@@ -6,30 +6,140 @@ Relevant for the algorithms offered by AI4Food as part of [FuseTS](https://open-
 - phenology/
 - whittaker/
 
-This module provides utility functions to download a zip file from a given URL,
-extract its contents to a temporary directory, move the top-level folder to a specified
-destination, and add that folder to the Python sys.path for module imports.
+This module provides utility functions to stream a zip file from a given URL,
+extract its contents into a persistent on-disk cache and add the cached folder to the
+Python sys.path for module imports.
+
+Cache entries are content-addressed by a hash of the URL and its ETag, published with an
+atomic rename and guarded by a cross-process file lock, so that executors sharing a host
+only download and extract the dependencies once. The cache size is bounded by evicting
+the least recently used entries that are not in use by another process.
+
+A UDF that needs the FuseTS dependencies is preceded by this module and calls `setup_fusets_dependencies()` before
+it imports FuseTS, or only in the code paths that use it, like the exact mode of `utils/mogpr.py`.
+
+With `mode="zipimport"` the zip file is not extracted. Instead it is mounted on sys.path so
+the pure-Python modules are imported through zipimport, while native extension modules are
+extracted one at a time on first import by a meta path finder.
 
 """
 
 import os
 import sys
+import time
+import fcntl
+import hashlib
 import zipfile
 import requests
 import tempfile
 import shutil
 import functools
+import contextlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
 
 from openeo.udf import inspect
 
+# Location and size limit of the dependency cache, can be overridden through the environment
+CACHE_DIR = os.environ.get(
+    "OPENEO_UDF_DEPENDENCY_CACHE",
+    os.path.join(tempfile.gettempdir(), "openeo_udf_dependencies"),
+)
+CACHE_MAX_BYTES = int(
+    os.environ.get("OPENEO_UDF_DEPENDENCY_CACHE_MAX_BYTES", 4 * 1024**3)
+)
+# Streaming download settings
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_RETRIES = 5
+# Period during which a cached URL is trusted without asking the server for its ETag
+CACHE_REVALIDATE_SECONDS = 3600
+
+# Name of the zip file inside the cache entries of the zipimport mode
+ZIP_ENTRY_NAME = "dependencies.zip"
+# Folder inside the cache entries of the zipimport mode to which the extension modules are extracted
+EXTENSION_DIR_NAME = "ext"
+
+# Lock files of the cache entries used by this process, kept open so they are never evicted
+_pinned_entries = {}
+
 
-def download_file(url, path):
+def download_file(url, path, expected_sha256=None):
     """
-    Downloads a file from the given URL to the specified path.
+    Streams the file at the given URL to the specified path in fixed-size chunks, so memory use does not depend
+    on the file size. Interrupted downloads are resumed with an HTTP Range request and retried with an
+    exponential backoff. The SHA-256 of the file is verified against the expected digest, or against the
+    checksum advertised by the server (Artifactory) when no digest is given.
     """
-    response = requests.get(url, stream=True)
+    digest = hashlib.sha256()
+    offset = 0
+    attempt = 0
     with open(path, "wb") as file:
-        file.write(response.content)
+        while True:
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with requests.get(
+                    url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT
+                ) as response:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # The server ignored the range request, start over from scratch
+                        file.seek(0)
+                        file.truncate()
+                        digest = hashlib.sha256()
+                        offset = 0
+                    expected_sha256 = expected_sha256 or response.headers.get(
+                        "X-Checksum-Sha256"
+                    )
+                    expected_size = _get_total_size(response, offset)
+
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+
+                if expected_size is not None and offset < expected_size:
+                    raise requests.ConnectionError(
+                        f"Connection closed after {offset} of {expected_size} bytes"
+                    )
+                break
+            except requests.RequestException as e:
+                attempt += 1
+                if attempt > DOWNLOAD_RETRIES or not _is_retryable(e):
+                    raise
+                inspect(
+                    message=f"Download of {url} interrupted at {offset} bytes, retrying: {e}"
+                )
+                time.sleep(min(2**attempt, 60))
+
+    if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+        raise ValueError(
+            f"Checksum mismatch for {url}: expected {expected_sha256}, got {digest.hexdigest()}"
+        )
+    return digest.hexdigest()
+
+
+def _get_total_size(response, offset):
+    """
+    Returns the total size of the file being downloaded, based on the Content-Range or Content-Length header.
+    """
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    if "Content-Length" in response.headers:
+        return offset + int(response.headers["Content-Length"])
+    return None
+
+
+def _is_retryable(error):
+    """
+    Client errors are permanent, all other failures (connection errors, timeouts, server errors) are retried.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return True
+    return response.status_code >= 500 or response.status_code == 429
 
 
 def extract_zip_to_temp(zip_path, temp_dir):
@@ -41,64 +151,293 @@ def extract_zip_to_temp(zip_path, temp_dir):
     return temp_dir
 
 
-def move_top_level_folder_to_destination(temp_dir, destination_dir):
+def add_to_sys_path(folder_path):
     """
-    Moves each top-level folder from the temporary directory to the destination directory.
-    Throws an error if the folder already exists at the destination.
+    Adds the folder path to sys.path.
     """
-    # Find the top-level folders inside the extracted zip
-    for item in os.listdir(temp_dir):
-        item_path = os.path.join(temp_dir, item)
+    if folder_path not in sys.path:
+        sys.path.append(folder_path)
 
-        if os.path.isdir(item_path):
-            # Check if the folder already exists at destination
-            dest_path = os.path.join(destination_dir, item)
 
-            if os.path.exists(dest_path):
-                # Throw an error if the folder already exists
-                raise FileExistsError(
-                    f"Error: The folder '{item}' already exists in the destination directory: {dest_path}"
-                )
+@contextlib.contextmanager
+def cache_lock(lock_path, shared=False):
+    """
+    Holds a cross-process lock on the given lock file for the duration of the context.
+    """
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-            # Move the folder out of temp and into the destination directory
-            shutil.move(item_path, dest_path)
 
+def _url_hash(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
 
-def add_to_sys_path(folder_path):
+
+def resolve_cache_key(url, cache_dir):
     """
-    Adds the folder path to sys.path.
+    Returns the cache key of the given URL, derived from the URL and the ETag reported by the server.
+    The key is remembered in a reference file, so the server is only asked again once the reference is stale
+    or when the server cannot be reached.
     """
-    if folder_path not in sys.path:
-        sys.path.append(folder_path)
+    ref_path = os.path.join(cache_dir, _url_hash(url) + ".ref")
+    if os.path.exists(ref_path):
+        if time.time() - os.path.getmtime(ref_path) < CACHE_REVALIDATE_SECONDS:
+            with open(ref_path) as ref_file:
+                return ref_file.read().strip()
+
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=30)
+        response.raise_for_status()
+        version = response.headers.get("ETag") or response.headers.get(
+            "Last-Modified", ""
+        )
+    except requests.RequestException:
+        # Fall back to the last known version of the URL when the server is unreachable
+        if os.path.exists(ref_path):
+            with open(ref_path) as ref_file:
+                return ref_file.read().strip()
+        raise
+
+    key = hashlib.sha256(f"{url}\n{version}".encode("utf-8")).hexdigest()
+    temp_ref_path = f"{ref_path}.{os.getpid()}.tmp"
+    with open(temp_ref_path, "w") as ref_file:
+        ref_file.write(key)
+    os.replace(temp_ref_path, ref_path)
+    return key
+
+
+def populate_cache_entry(url, entry_dir, cache_dir, expected_sha256=None, extract=True):
+    """
+    Downloads and extracts the zip file into a private folder of the cache and atomically renames it to the
+    entry folder, so that other processes never observe a partially extracted entry. Without extraction, the
+    entry folder contains the zip file itself.
+    """
+    temp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    try:
+        if extract:
+            zip_path = os.path.join(temp_dir, "temp.zip")
+            download_file(url, zip_path, expected_sha256)
+
+            inspect(message="Extract dependencies to cache")
+            populated_dir = extract_zip_to_temp(
+                zip_path, os.path.join(temp_dir, "entry")
+            )
+        else:
+            populated_dir = os.path.join(temp_dir, "entry")
+            os.mkdir(populated_dir)
+            download_file(
+                url, os.path.join(populated_dir, ZIP_ENTRY_NAME), expected_sha256
+            )
+        with open(entry_dir + ".size", "w") as size_file:
+            size_file.write(str(get_folder_size(populated_dir)))
+        os.rename(populated_dir, entry_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def get_folder_size(folder_path):
+    """
+    Returns the total size in bytes of the files in the given folder.
+    """
+    total = 0
+    for root, _, files in os.walk(folder_path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def pin_cache_entry(entry_dir):
+    """
+    Marks the cache entry as in use by this process for as long as the process lives and refreshes its
+    access time for the least recently used eviction.
+    """
+    if entry_dir not in _pinned_entries:
+        lock_file = open(entry_dir + ".lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        _pinned_entries[entry_dir] = lock_file
+    os.utime(entry_dir)
+
+
+def evict_cache_entries(cache_dir, max_bytes):
+    """
+    Removes the least recently used cache entries until the cache fits within the given size. Entries that are
+    pinned by a running process are never removed. Must be called while holding the cache lock.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".tmp-"):
+            # Leftovers of a process that died while populating the cache
+            if time.time() - os.path.getmtime(path) > 24 * 3600:
+                shutil.rmtree(path, ignore_errors=True)
+        elif os.path.isdir(path):
+            try:
+                with open(path + ".size") as size_file:
+                    size = int(size_file.read())
+            except (OSError, ValueError):
+                size = get_folder_size(path)
+            else:
+                # The extension modules of zipimport entries are extracted after the size was recorded
+                size += get_folder_size(os.path.join(path, EXTENSION_DIR_NAME))
+            entries.append((os.path.getmtime(path), path, size))
+
+    total = sum(size for _, _, size in entries)
+    for _, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        with open(path + ".lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            for suffix in (".size", ".lock"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path + suffix)
+            total -= size
+
+
+class LazyExtensionFinder(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder for the native extension modules of a zip file mounted on sys.path. zipimport cannot load
+    extension modules, so each one is extracted from the zip file on its first import. The shared libraries
+    bundled by auditwheel (`<package>.libs/`) are extracted along with the first extension module, so that the
+    relative rpaths of the extension modules keep working.
+    """
+
+    def __init__(self, zip_path, extract_dir):
+        self.zip_path = zip_path
+        self.extract_dir = extract_dir
+        self.libraries_extracted = False
+
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            members = zip_ref.namelist()
+        self.extensions = {}
+        for member in members:
+            for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+                if member.endswith(suffix):
+                    module_name = member[: -len(suffix)].replace("/", ".")
+                    self.extensions.setdefault(module_name, member)
+                    break
+        self.libraries = [
+            member
+            for member in members
+            if member.split("/", 1)[0].endswith(".libs") and not member.endswith("/")
+        ]
+
+    def find_spec(self, fullname, path=None, target=None):
+        member = self.extensions.get(fullname)
+        if member is None:
+            return None
+
+        if not self.libraries_extracted:
+            for library in self.libraries:
+                self.extract_member(library)
+            self.libraries_extracted = True
+        extension_path = self.extract_member(member)
+
+        loader = importlib.machinery.ExtensionFileLoader(fullname, extension_path)
+        return importlib.util.spec_from_file_location(
+            fullname, extension_path, loader=loader
+        )
+
+    def extract_member(self, member):
+        """
+        Extracts a single member of the zip file, unless an earlier import (possibly by another process)
+        already did so. The member is renamed into place atomically.
+        """
+        target_path = os.path.join(self.extract_dir, *member.split("/"))
+        if os.path.exists(target_path):
+            return target_path
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f"{target_path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(self.zip_path, "r") as zip_ref:
+            with zip_ref.open(member) as source, open(temp_path, "wb") as target:
+                shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+            mode = zip_ref.getinfo(member).external_attr >> 16
+        if mode:
+            os.chmod(temp_path, mode & 0o777)
+        os.replace(temp_path, target_path)
+        return target_path
+
+
+def mount_zip(zip_path, extract_dir):
+    """
+    Adds the zip file to sys.path and registers a finder that lazily extracts its extension modules.
+    """
+    if not any(
+        isinstance(finder, LazyExtensionFinder) and finder.zip_path == zip_path
+        for finder in sys.meta_path
+    ):
+        # Extension modules take precedence over Python sources, as with regular imports
+        sys.meta_path.insert(0, LazyExtensionFinder(zip_path, extract_dir))
+    add_to_sys_path(zip_path)
 
 
 @functools.lru_cache(maxsize=5)
-def setup_dependencies(dependencies_url):
+def setup_dependencies(dependencies_url, sha256=None, mode="extract"):
     """
-    Main function to download, unzip, move the top-level folder, and add it to sys.path.
+    Main function to make the zipped dependencies available in the on-disk cache and add them to sys.path.
+    When the SHA-256 of the zip file is known, it is used as cache key and verified after the download.
+
+    The mode is either "extract", which extracts the whole zip file once, or "zipimport", which imports
+    directly from the zip file and only extracts the native extension modules that are actually imported.
+
+    Nothing is downloaded when the OPENEO_UDF_DEPENDENCIES_PROVIDED environment variable is set, e.g. when the UDF
+    runs locally in an environment in which the dependencies are installed.
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Step 1: Download the zip file
-        zip_path = os.path.join(temp_dir, "temp.zip")
-        download_file(dependencies_url, zip_path)
+    if mode not in ("extract", "zipimport"):
+        raise ValueError(f"Unsupported dependency mode: {mode}")
+    extract = mode == "extract"
+    if os.environ.get("OPENEO_UDF_DEPENDENCIES_PROVIDED"):
+        inspect(message="Dependencies provided by the environment")
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_path = os.path.join(CACHE_DIR, ".lock")
+    cache_key = sha256.lower() if sha256 else None
+    entry_dir = os.path.join(
+        CACHE_DIR,
+        (cache_key or resolve_cache_key(dependencies_url, CACHE_DIR))
+        + ("" if extract else "-zip"),
+    )
 
-        inspect(message="Extract dependencies to temp")
-        # Step 2: Extract the zip file to the temporary directory
-        extracted_dir = extract_zip_to_temp(zip_path, temp_dir)
+    with cache_lock(lock_path, shared=True):
+        cached = os.path.isdir(entry_dir)
+        if cached:
+            inspect(message="Dependencies found in cache")
+            pin_cache_entry(entry_dir)
+
+    if not cached:
+        with cache_lock(lock_path):
+            # Another process may have populated the entry while we were waiting for the lock
+            if not os.path.isdir(entry_dir):
+                inspect(message="Download dependencies to cache")
+                populate_cache_entry(
+                    dependencies_url, entry_dir, CACHE_DIR, sha256, extract
+                )
+            pin_cache_entry(entry_dir)
+            evict_cache_entries(CACHE_DIR, CACHE_MAX_BYTES)
 
-        # Step 3: Move the first top-level folder (dynamically) to the destination
-        destination_dir = os.getcwd()  # Current working directory
-        inspect(message="Move top-level folder to destination")
-        moved_folder = move_top_level_folder_to_destination(
-            extracted_dir, destination_dir
+    if extract:
+        add_to_sys_path(entry_dir)
+    else:
+        mount_zip(
+            os.path.join(entry_dir, ZIP_ENTRY_NAME),
+            os.path.join(entry_dir, EXTENSION_DIR_NAME),
         )
+    inspect(message="Added to the sys path")
 
-        # Step 4: Add the folder to sys.path
-        add_to_sys_path(moved_folder)
-        inspect(message="Added to the sys path")
 
+FUSETS_DEPENDENCIES_URL = "https://artifactory.vgt.vito.be:443/artifactory/auxdata-public/ai4food/fusets_venv.zip"
 
-# call the setup_dependencies function with the specific URL
-setup_dependencies(
-    "https://artifactory.vgt.vito.be:443/artifactory/auxdata-public/ai4food/fusets_venv.zip"
-)
+
+def setup_fusets_dependencies():
+    """
+    Make the FuseTS dependencies available, see `setup_dependencies`.
+    """
+    setup_dependencies(FUSETS_DEPENDENCIES_URL)
@@ -0,0 +1,182 @@
+"""
+Fused computation of the spectral indices of the catalog.
+
+The band math of the index UDPs creates a full-size temporary per operator when it is evaluated with NumPy. This
+module computes any set of indices in a single pass over a shared band stack instead: the pixels are processed in
+chunks that fit in the CPU cache, every band of a chunk is converted to float32 once into a preallocated buffer, and
+all requested indices are evaluated on that chunk before moving on. When `numexpr` is installed it evaluates the
+formulas, otherwise NumPy does. The formulas are identical to those of the index UDPs.
+
+`build_index()` translates the formula of an index to openEO processes, so the UDPs compute the indices natively on
+the backend. The module is also an openEO UDF for local processing: `apply_datacube` computes the indices listed in
+the `indices` context entry from a cube with a bands dimension. The UDF code is returned by
+`load_spectral_indices_udf()`.
+"""
+
+import ast
+import operator
+from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+from openeo.udf import XarrayDataCube
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Number of pixels per chunk, small enough to keep the buffers of a chunk in the CPU cache
+CHUNK_SIZE = 2**16
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+class SpectralIndex(NamedTuple):
+    bands: Tuple[str, ...]
+    formula: str
+
+
+INDICES: Dict[str, SpectralIndex] = {
+    "NDVI": SpectralIndex(("B04", "B08"), "(B08 - B04) / (B08 + B04)"),
+    "EVI": SpectralIndex(
+        ("B02", "B04", "B08"), "2.5 * ((B08 - B04) / (B08 + 6.0 * B04 - 7.5 * B02 + 1))"
+    ),
+    "MSI": SpectralIndex(("B08", "B11"), "B11 / B08"),
+    "NBR": SpectralIndex(("B08", "B12"), "(B08 - B12) / (B08 + B12)"),
+    "NDII": SpectralIndex(("B8A", "B11"), "(B8A - B11) / (B8A + B11)"),
+    "NDWI": SpectralIndex(("B08", "B12"), "(B08 - B12) / (B08 + B12)"),
+    "SAVI": SpectralIndex(
+        ("B04", "B08"), "(B08 - B04) / (B08 + B04 + 0.5) * (1.0 + 0.5)"
+    ),
+}
+
+
+def get_required_bands(indices: Sequence[str]) -> List[str]:
+    """
+    Union of the bands needed to compute the indices, in the order of the band names.
+    """
+    return sorted({band for index in indices for band in _get_index(index).bands})
+
+
+def _get_index(index: str) -> SpectralIndex:
+    if index.upper() not in INDICES:
+        raise ValueError(
+            f"Unsupported index '{index}', expected one of {', '.join(INDICES)}"
+        )
+    return INDICES[index.upper()]
+
+
+def build_index(data, index: str):
+    """
+    Build the formula of an index from openEO processes, e.g. in the callback of `apply_dimension` over the bands.
+    :param data: Array of the bands, of which the labels are the band names
+    :return: Process builder of the index
+    """
+
+    def build(node: ast.AST):
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            return OPERATORS[type(node.op)](build(node.left), build(node.right))
+        if isinstance(node, ast.Name):
+            return data.array_element(label=node.id)
+        if isinstance(node, ast.Constant):
+            return node.value
+        raise ValueError(f"Unsupported expression in the formula of {index}")
+
+    return build(ast.parse(_get_index(index).formula, mode="eval").body)
+
+
+def compute_indices(
+    bands: Mapping[str, np.ndarray],
+    indices: Sequence[str],
+    out: Optional[np.ndarray] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> np.ndarray:
+    """
+    Compute spectral indices in a single chunked pass over the bands.
+    :param bands: Band name to array, all of the same shape
+    :param indices: Names of the indices to compute (INDICES)
+    :param out: Preallocated float32 output array of shape (len(indices), *band shape)
+    :param chunk_size: Number of pixels per chunk
+    :return: Float32 array with the indices along the first axis
+    """
+    formulas = [_get_index(index) for index in indices]
+    names = get_required_bands(indices)
+    missing = set(names) - set(bands)
+    if missing:
+        raise ValueError(f"Missing band(s): {', '.join(sorted(missing))}")
+
+    shape = np.shape(bands[names[0]])
+    if out is None:
+        out = np.empty((len(indices), *shape), dtype=np.float32)
+    flat_bands = {name: np.reshape(bands[name], -1) for name in names}
+    flat_out = out.reshape(len(indices), -1)
+    size = flat_out.shape[1]
+    buffers = {
+        name: np.empty(min(chunk_size, size), dtype=np.float32) for name in names
+    }
+    compiled = [compile(index.formula, "<index>", "eval") for index in formulas]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            chunk = {name: buffers[name][: stop - start] for name in names}
+            for name in names:
+                chunk[name][...] = flat_bands[name][start:stop]
+            for i, index in enumerate(formulas):
+                if numexpr is not None:
+                    numexpr.evaluate(
+                        index.formula,
+                        local_dict=chunk,
+                        out=flat_out[i, start:stop],
+                        casting="same_kind",
+                    )
+                else:
+                    flat_out[i, start:stop] = eval(
+                        compiled[i], {"__builtins__": {}}, chunk
+                    )
+    return out
+
+
+def compute_indices_xarray(
+    cube: xr.DataArray, indices: Sequence[str], dimension: str = "bands"
+) -> xr.DataArray:
+    """
+    Compute spectral indices from a data cube with a bands dimension.
+    :return: Data cube with a band per index, in the order of `indices`
+    """
+    labels = list(cube[dimension].values)
+    cube = cube.transpose(dimension, ...)
+    bands = {
+        name: cube.data[labels.index(name)] for name in get_required_bands(indices)
+    }
+    result = compute_indices(bands, indices)
+    return xr.DataArray(
+        result,
+        dims=cube.dims,
+        coords={
+            **{k: v for k, v in cube.coords.items() if dimension not in v.dims},
+            dimension: [index.upper() for index in indices],
+        },
+    )
+
+
+def apply_datacube(cube: XarrayDataCube, context: dict) -> XarrayDataCube:
+    """
+    Compute the spectral indices listed in context["indices"].
+    """
+    array = cube.get_array()
+    result = compute_indices_xarray(array, context["indices"])
+    return XarrayDataCube(result.transpose(*array.dims))
+
+
+def load_spectral_indices_udf() -> str:
+    """
+    Loads an openEO UDF that computes spectral indices in a single pass.
+    """
+    return Path(__file__).read_text()
@@ -0,0 +1,298 @@
+"""
+Temporal chunking of the whittaker, phenology and peakvalley UDPs.
+
+These UDPs apply their UDF along the full `t` dimension, so a worker holds the complete time series of its chunk. For
+long archives, the temporal extent is split into windows of `window_days`, extended by `overlap_days` on each side so
+the UDF has context at the edges of a window. Every window is an independent job that only loads its own dates, so the
+memory per worker is bounded by the window, and the windows run in parallel. The results are stitched per UDP:
+
+* `blend` (whittaker): the time series of overlapping windows are blended with weights that ramp linearly over the
+  dates shared by two windows, so the result is continuous across windows;
+* `cut` (peakvalley): every date is taken from the window of which it is in the core, as the event flags cannot be
+  averaged. An event ends at the recovery after its valley, so the overlap needs to cover half a season;
+* `stack` (phenology): the metrics of every window, e.g. of every season with windows of a year, are stacked along
+  the `phenology` dimension of the result, labeled by the start of the core of the window.
+
+Usage, from the root of the repository, with a JSON file with the arguments of the UDP:
+
+    python -m utils.temporal_chunking whittaker arguments.json --backend URL --output result.nc [--window 365]
+        [--overlap DAYS] [--output-dir windows/] [--max-running 10]
+
+    from utils.temporal_chunking import apply_in_windows
+    from utils.whittaker import whittaker
+
+    smoothed = apply_in_windows(
+        cube, lambda window: whittaker(window)[0], window_days=365, overlap_days=60, method="blend"
+    )
+
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import xarray as xr
+
+DEFAULT_WINDOW_DAYS = 365
+DEFAULT_OVERLAP_DAYS = 60
+STITCH_METHODS = ["blend", "cut", "stack"]
+# Stitching method of the UDPs that support temporal chunking
+UDP_STITCH_METHODS = {"whittaker": "blend", "peakvalley": "cut", "phenology": "stack"}
+# Time dimension of the results of the UDPs, phenology reduces `t` to a `phenology` dimension of metrics
+UDP_TIME_DIMENSIONS = {"whittaker": "t", "peakvalley": "t", "phenology": "phenology"}
+# Default overlap of the UDPs: an event of peakvalley only ends at the recovery of the next season, and the metrics of
+# phenology are computed per season, without the dates of the neighbouring seasons
+UDP_OVERLAP_DAYS = {
+    "whittaker": DEFAULT_OVERLAP_DAYS,
+    "peakvalley": 180,
+    "phenology": 0,
+}
+
+
+class Window(NamedTuple):
+    """
+    Temporal window, as left-closed intervals of dates. The core of the windows tile the temporal extent, the extent
+    of a window is its core with the overlap on each side.
+    """
+
+    start: datetime.date
+    end: datetime.date
+    core_start: datetime.date
+    core_end: datetime.date
+
+    @property
+    def temporal_extent(self) -> List[str]:
+        return [self.start.isoformat(), self.end.isoformat()]
+
+
+def get_windows(
+    temporal_extent: Sequence[str],
+    window_days: int = DEFAULT_WINDOW_DAYS,
+    overlap_days: int = DEFAULT_OVERLAP_DAYS,
+) -> List[Window]:
+    """
+    Split a temporal extent into overlapping windows.
+    :param window_days: Length of the core of a window
+    :param overlap_days: Overlap added on each side of the core, within the temporal extent
+    """
+    if window_days <= 0 or overlap_days < 0:
+        raise ValueError("The window must be positive and the overlap not negative")
+    start, end = (datetime.date.fromisoformat(d[:10]) for d in temporal_extent)
+    window, overlap = datetime.timedelta(window_days), datetime.timedelta(overlap_days)
+    windows = []
+    core_start = start
+    while core_start < end:
+        core_end = min(core_start + window, end)
+        windows.append(
+            Window(
+                max(core_start - overlap, start),
+                min(core_end + overlap, end),
+                core_start,
+                core_end,
+            )
+        )
+        core_start = core_end
+    return windows
+
+
+def _days(dates) -> np.ndarray:
+    # Days since the epoch
+    return np.asarray(dates, dtype="datetime64[D]").astype(float)
+
+
+def get_weights(times: np.ndarray, window: Window, method: str = "blend") -> np.ndarray:
+    """
+    Weight of every date in the result of a window.
+    :param method: `blend` for weights that ramp linearly over the dates shared with the previous and next window,
+        `cut` for 1 in the core and 0 elsewhere
+    """
+    days = _days(times)
+    start, end, core_start, core_end = _days(window)
+    if method == "cut":
+        return ((days >= core_start) & (days < core_end)).astype(float)
+    weights = np.ones(days.shape)
+    if start < core_start:
+        ramp = (days - start) / (2 * (core_start - start))
+        weights = np.minimum(weights, np.clip(ramp, 0, 1))
+    if end > core_end:
+        ramp = (end - days) / (2 * (end - core_end))
+        weights = np.minimum(weights, np.clip(ramp, 0, 1))
+    return weights
+
+
+def stitch(
+    results: Sequence[xr.DataArray],
+    windows: Sequence[Window],
+    method: str = "blend",
+    time_dimension: str = "t",
+) -> xr.DataArray:
+    """
+    Stitch the results of the windows into a single cube. The weights of the windows are normalized at every date.
+    :param results: Result of every window, with a time dimension
+    :param method: One of STITCH_METHODS
+    """
+    if method not in STITCH_METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {STITCH_METHODS}")
+    if method == "stack":
+        stacked = []
+        for result, window in zip(results, windows):
+            if time_dimension in result.dims:
+                result = result.isel({time_dimension: 0}, drop=True)
+            label = [np.datetime64(window.core_start, "ns")]
+            stacked.append(result.expand_dims({time_dimension: label}))
+        stacked = xr.concat(stacked, dim=time_dimension)
+        if time_dimension in results[0].dims:
+            stacked = stacked.transpose(*results[0].dims)
+        return stacked
+
+    weighted, totals = [], []
+    for result, window in zip(results, windows):
+        weights = xr.DataArray(
+            get_weights(result[time_dimension].values, window, method),
+            dims=time_dimension,
+            coords={time_dimension: result[time_dimension]},
+        )
+        # Missing values do not count, so the other windows fill them in
+        weights = weights.where(result.notnull(), 0)
+        weighted.append(result.fillna(0) * weights)
+        totals.append(weights)
+    total = sum(xr.align(*totals, join="outer", fill_value=0))
+    stitched = sum(xr.align(*weighted, join="outer", fill_value=0)) / total
+    stitched = stitched.where(total > 0).transpose(*results[0].dims)
+    if method == "cut" or np.issubdtype(results[0].dtype, np.floating):
+        stitched = stitched.astype(results[0].dtype)
+    return stitched.rename(results[0].name)
+
+
+def apply_in_windows(
+    array: xr.DataArray,
+    function: Callable[[xr.DataArray], xr.DataArray],
+    window_days: int = DEFAULT_WINDOW_DAYS,
+    overlap_days: int = DEFAULT_OVERLAP_DAYS,
+    method: str = "blend",
+    time_dimension: str = "t",
+) -> xr.DataArray:
+    """
+    Apply a function along the time dimension of a cube window by window, e.g. to bound the memory of a UDF.
+    """
+    times = array[time_dimension].values.astype("datetime64[D]")
+    end = (times.max() + np.timedelta64(1, "D")).astype(str)
+    windows, results = [], []
+    for window in get_windows([str(times.min()), end], window_days, overlap_days):
+        selected = (times >= np.datetime64(window.start)) & (
+            times < np.datetime64(window.end)
+        )
+        if selected.any():
+            windows.append(window)
+            results.append(function(array.isel({time_dimension: selected})))
+    return stitch(results, windows, method, time_dimension)
+
+
+def run_in_windows(
+    connection,
+    udp_id: str,
+    arguments: dict,
+    output_dir: Path,
+    window_days: int = DEFAULT_WINDOW_DAYS,
+    overlap_days: Optional[int] = None,
+    max_running: int = 10,
+) -> xr.DataArray:
+    """
+    Run a UDP as a batch job per window with `utils.async_jobs`, and stitch the results.
+    :param arguments: Arguments of the UDP, including its full `temporal_extent`
+    :param output_dir: Folder for the results of the windows
+    :param overlap_days: Overlap of the windows, by default UDP_OVERLAP_DAYS of the UDP
+    :param max_running: Maximum number of windows that run, and are downloaded, at the same time
+    """
+    import asyncio
+
+    from utils.async_jobs import get_udp_job, run_jobs
+
+    if overlap_days is None:
+        overlap_days = UDP_OVERLAP_DAYS[udp_id]
+    windows = get_windows(arguments["temporal_extent"], window_days, overlap_days)
+    jobs = [
+        get_udp_job(
+            f"{udp_id}_{window.core_start.isoformat()}",
+            udp_id,
+            {**arguments, "temporal_extent": window.temporal_extent},
+        )
+        for window in windows
+    ]
+    records = asyncio.run(
+        run_jobs(connection, jobs, output_dir, max_running, max_downloads=max_running)
+    )
+    failed = [job.name for job, r in zip(jobs, records) if r["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"The jobs of windows {failed} failed")
+
+    results = []
+    for job in jobs:
+        path = next((Path(output_dir) / job.name).glob("*.nc"))
+        with xr.open_dataset(path) as dataset:
+            array = dataset["data"] if "data" in dataset else dataset.to_array("bands")
+            results.append(array.load())
+    return stitch(
+        results, windows, UDP_STITCH_METHODS[udp_id], UDP_TIME_DIMENSIONS[udp_id]
+    )
+
+
+def main(argv=None) -> int:
+    import openeo
+
+    from utils.async_jobs import create_session
+    from utils.local_executor import save
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("udp", choices=sorted(UDP_STITCH_METHODS))
+    parser.add_argument("arguments", type=Path, help="JSON file with the arguments")
+    parser.add_argument(
+        "--backend", default="openeofed.dataspace.copernicus.eu", help="Backend URL"
+    )
+    parser.add_argument(
+        "--no-auth",
+        action="store_true",
+        help="Do not authenticate, e.g. for the mock backend",
+    )
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument(
+        "--output-dir", type=Path, help="Keep the results of the windows here"
+    )
+    parser.add_argument(
+        "--window", type=int, default=DEFAULT_WINDOW_DAYS, help="Window in days"
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        help="Overlap in days on each side of a window (default: depends on the UDP)",
+    )
+    parser.add_argument("--max-running", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    connection = openeo.connect(
+        args.backend, session=create_session(2 * args.max_running), auto_validate=False
+    )
+    if not args.no_auth:
+        connection.authenticate_oidc()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result = run_in_windows(
+            connection,
+            args.udp,
+            json.loads(args.arguments.read_text()),
+            args.output_dir or Path(temp_dir),
+            args.window,
+            args.overlap,
+            args.max_running,
+        )
+    save(result, args.output)
+    print(f"Stitched the windows of {args.udp} into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Chunk sizing for the `apply_neighborhood` UDPs of the catalog.
+
+The MOGPR UDPs run their UDF once per square chunk of `chunk_size` pixels. Every invocation has a fixed cost (starting
+the UDF, setting up its dependencies, importing the libraries), so chunks should be as large as the memory of a worker
+allows, but no larger than the area of interest itself. `suggest_chunking` derives the `chunk_size` and
+`chunk_overlap` arguments of a UDP from the area of interest, the length of the time series, the regression mode and
+a memory budget.
+
+The memory of a chunk is modelled per mode of `utils.mogpr`:
+
+* `exact`: FuseTS fits the pixels one by one, so besides the chunk itself the UDF holds a few dense covariance
+  matrices of a single pixel, quadratic in the number of observations of all bands, independent of the chunk size;
+* `sparse`: the pixels of the chunk are solved in batches of which the temporaries are bounded by
+  `utils.mogpr.BATCH_BYTES`, independent of the chunk size.
+
+    from utils.tiling import suggest_chunking
+
+    cube = connection.datacube_from_process(
+        "mogpr_s2",
+        namespace=...,
+        spatial_extent=aoi,
+        temporal_extent=date,
+        **suggest_chunking(aoi, date, bands=1, mode="exact"),
+    )
+
+"""
+
+import datetime
+import math
+from typing import Dict, Sequence, Tuple
+
+from utils.mogpr import BATCH_BYTES, DEFAULT_MODE, MODES
+
+DEFAULT_CHUNK_SIZE = 32
+MIN_CHUNK_SIZE = 16
+MAX_CHUNK_SIZE = 512
+# Chunk sizes are rounded down to a multiple of this number of pixels
+CHUNK_SIZE_STEP = 16
+PIXEL_SIZE = 10
+REVISIT_DAYS = 5
+# Bytes per pixel per observation per band held by the UDF, including its float64 working copies
+BYTES_PER_VALUE = 8 * 4
+# Number of float64 covariance matrices of a single pixel that the exact regression holds at the same time
+EXACT_MATRICES = 6
+
+
+def get_area(spatial_extent: dict) -> float:
+    """
+    Approximate area in m² of a GeoJSON geometry or a bounding box in longitude/latitude.
+    """
+    if {"west", "south", "east", "north"} <= set(spatial_extent):
+        w, s, e, n = (spatial_extent[k] for k in ("west", "south", "east", "north"))
+        rings = [[[w, s], [e, s], [e, n], [w, n], [w, s]]]
+    elif spatial_extent["type"] == "Polygon":
+        rings = spatial_extent["coordinates"][:1]
+    elif spatial_extent["type"] == "MultiPolygon":
+        rings = [polygon[0] for polygon in spatial_extent["coordinates"]]
+    elif spatial_extent["type"] == "Feature":
+        return get_area(spatial_extent["geometry"])
+    elif spatial_extent["type"] == "FeatureCollection":
+        return sum(get_area(f["geometry"]) for f in spatial_extent["features"])
+    else:
+        raise ValueError(f"Unsupported geometry type '{spatial_extent['type']}'")
+
+    area = 0.0
+    for ring in rings:
+        latitude = math.radians(sum(point[1] for point in ring) / len(ring))
+        points = [
+            (lon * 111320 * math.cos(latitude), lat * 110540) for lon, lat in ring
+        ]
+        area += abs(
+            sum(
+                x1 * y2 - x2 * y1
+                for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1])
+            )
+            / 2
+        )
+    return area
+
+
+def get_observations(temporal_extent: Sequence[str], revisit_days=REVISIT_DAYS) -> int:
+    """
+    Expected number of observations in the time series of a pixel.
+    """
+    start, end = (datetime.date.fromisoformat(d[:10]) for d in temporal_extent)
+    return max((end - start).days // revisit_days, 0) + 1
+
+
+def get_memory_model(mode: str, observations: int, bands: int) -> Tuple[float, float]:
+    """
+    Memory held by a MOGPR UDF invocation.
+    :param mode: One of the modes of `utils.mogpr`
+    :param observations: Number of observations in the time series of a pixel
+    :param bands: Number of bands of the cube that is passed to the UDF
+    :return: Bytes per pixel of the chunk, and bytes that do not depend on the chunk size
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {MODES}")
+    bytes_per_pixel = observations * bands * BYTES_PER_VALUE
+    if mode == "exact":
+        return bytes_per_pixel, EXACT_MATRICES * 8 * (observations * bands) ** 2
+    return bytes_per_pixel, BATCH_BYTES
+
+
+def suggest_chunking(
+    spatial_extent: dict,
+    temporal_extent: Sequence[str],
+    bands: int = 1,
+    mode: str = DEFAULT_MODE,
+    memory_budget_mb: float = 512,
+    overlap: int = 0,
+    pixel_size: float = PIXEL_SIZE,
+    revisit_days: int = REVISIT_DAYS,
+) -> Dict[str, int]:
+    """
+    Suggest the chunk size of an `apply_neighborhood` UDP: the largest chunk that fits the memory budget, limited to
+    the size of the area of interest, so large areas use few, full chunks and small areas are not over-partitioned.
+    :param spatial_extent: Area of interest, GeoJSON or bounding box in longitude/latitude
+    :param temporal_extent: Start and end date
+    :param bands: Number of bands of the cube that is passed to the UDF
+    :param mode: `mode` argument of the UDP, one of the modes of `utils.mogpr`
+    :param memory_budget_mb: Memory available to a UDF invocation
+    :param overlap: Overlap in pixels on each side of a chunk
+    :param pixel_size: Resolution in m
+    :param revisit_days: Average number of days between observations
+    :return: `chunk_size` and `chunk_overlap` arguments
+    """
+    observations = get_observations(temporal_extent, revisit_days)
+    bytes_per_pixel, fixed_bytes = get_memory_model(mode, observations, bands)
+    available = max(memory_budget_mb * 1024**2 - fixed_bytes, 0)
+    memory_limit = math.isqrt(int(available / bytes_per_pixel))
+    aoi_side = math.ceil(math.sqrt(get_area(spatial_extent)) / pixel_size)
+
+    # The chunk including its overlap has to fit the budget, the chunk itself needs to cover no more than the AOI
+    chunk_size = min(memory_limit - 2 * overlap, aoi_side, MAX_CHUNK_SIZE)
+    if chunk_size < aoi_side:
+        chunk_size -= chunk_size % CHUNK_SIZE_STEP
+    else:
+        chunk_size = math.ceil(chunk_size / CHUNK_SIZE_STEP) * CHUNK_SIZE_STEP
+    return {
+        "chunk_size": max(chunk_size, MIN_CHUNK_SIZE),
+        "chunk_overlap": overlap,
+    }
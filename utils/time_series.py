@@ -0,0 +1,90 @@
+"""
+Time series extraction for the UDPs of the catalog.
+
+The index UDPs return a raster cube by default. When their `geometries` parameter is set, they aggregate the index
+over every geometry with `aggregate_spatial` instead, and return a vector cube with a time series per geometry. The
+vector cube is saved as a table, e.g. with the `parquet` or `csv` presets of `utils.output_profiles`, so a single job
+extracts the time series of a whole set of parcels without writing any imagery.
+
+The reducer is selected at runtime with the `reducer` parameter, by nesting the supported reducers in `if` processes
+within the reducer of `aggregate_spatial`.
+"""
+
+from typing import Union
+
+from openeo.api.process import Parameter
+from openeo.processes import ProcessBuilder, eq, if_, is_valid
+from openeo.rest.datacube import DataCube
+
+REDUCERS = ["mean", "median", "min", "max", "sd"]
+DEFAULT_REDUCER = "mean"
+
+
+def get_geometries_parameter() -> Parameter:
+    """
+    Optional UDP parameter with the geometries of which to extract the time series.
+    """
+    return Parameter(
+        name="geometries",
+        description="Geometries, e.g. parcels, of which to extract the time series instead of returning a raster. The index is aggregated over the pixels of every geometry with the `reducer`, and the result is a vector cube with a time series per geometry that can be saved as Parquet or CSV. The `spatial_extent` must cover the geometries.",
+        schema=[{"type": "object", "subtype": "geojson"}, {"type": "null"}],
+        default=None,
+    )
+
+
+def get_reducer_parameter() -> Parameter:
+    """
+    UDP parameter to select the reducer of the time series extraction.
+    """
+    return Parameter.string(
+        name="reducer",
+        description="Reducer that aggregates the pixels of a geometry when `geometries` is set.",
+        default=DEFAULT_REDUCER,
+        values=REDUCERS,
+    )
+
+
+def _reduce(data: ProcessBuilder, reducer: Union[str, Parameter]) -> ProcessBuilder:
+    if not isinstance(reducer, Parameter):
+        return getattr(data, reducer)()
+    # The last reducer is the fallback of the nested if processes
+    result = getattr(data, REDUCERS[-1])()
+    for name in reversed(REDUCERS[:-1]):
+        result = if_(eq(reducer, name), getattr(data, name)(), result)
+    return result
+
+
+def aggregate_time_series(
+    cube: DataCube,
+    geometries: Union[dict, Parameter],
+    reducer: Union[str, Parameter] = DEFAULT_REDUCER,
+):
+    """
+    Aggregate a cube over geometries.
+    :param reducer: One of REDUCERS, or a UDP parameter to select it at runtime
+    :return: Vector cube with a time series per geometry
+    """
+    if isinstance(reducer, str) and reducer not in REDUCERS:
+        raise ValueError(f"Unknown reducer '{reducer}', expected one of {REDUCERS}")
+    return cube.aggregate_spatial(
+        geometries, reducer=lambda data: _reduce(data, reducer)
+    )
+
+
+def raster_or_time_series(
+    raster: Union[DataCube, ProcessBuilder],
+    cube: DataCube,
+    geometries: Parameter,
+    reducer: Union[str, Parameter] = DEFAULT_REDUCER,
+) -> ProcessBuilder:
+    """
+    Result of a UDP with an optional `geometries` parameter: the time series of the geometries when it is set, the
+    raster otherwise.
+    :param raster: Raster result of the UDP, e.g. with its output profile applied
+    :param cube: Cube of which to aggregate the time series
+    """
+    return if_(
+        is_valid(geometries),
+        aggregate_time_series(cube, geometries, reducer),
+        raster,
+    )
@@ -0,0 +1,211 @@
+"""
+Batched Whittaker smoothing of the time series of a data cube.
+
+The Whittaker smoother of FuseTS solves the system (W + λDᵀD) z = Wy for every pixel separately, on a daily grid
+between the first and the last date of the cube, with D the second order difference matrix and W the diagonal matrix
+with a weight of 1 for the observed days. The system only depends on the days with a valid observation and on λ, and
+pixels with the same cloud pattern are common within a field. This module therefore groups the pixels by their
+observation mask, computes the banded Cholesky factorization of the pentadiagonal system once per group and solves
+it for all pixels of the group at once. The result is the smoothed value at the dates of the cube, like FuseTS.
+
+Instead of a fixed lambda, the lambda of every pixel can be selected by generalized cross-validation over a grid of
+candidates. The candidates are evaluated for all pixels of a group in the same pass, with one factorization per
+candidate.
+
+The module is also an openEO UDF: `apply_datacube` smooths the cube along its `t` dimension with the `smoothing_lambda`
+from the context, a number or "auto", and adds the lambda of every pixel as a band. The UDF code is returned by
+`load_whittaker_udf()`.
+"""
+
+from pathlib import Path
+from typing import Iterator, Sequence, Tuple, Union
+
+import numpy as np
+import xarray as xr
+from openeo.udf import XarrayDataCube
+from scipy.linalg import cho_solve_banded, cholesky_banded
+
+DEFAULT_LAMBDA = 10000
+# Candidate lambdas of the automatic selection, from 1 to 10⁶ in steps of √10
+LAMBDAS = tuple(10 ** np.arange(0, 6.5, 0.5))
+# Minimum number of observed days of a pixel for the automatic selection, pixels with fewer get DEFAULT_LAMBDA
+MIN_SELECTION_DAYS = 3
+
+
+def get_days(dates: np.ndarray) -> np.ndarray:
+    """
+    Day of every date, counted from the first date.
+    """
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    return ((dates - dates[0]) // np.timedelta64(1, "D")).astype(int)
+
+
+def get_banded_system(weights: np.ndarray, smoothing_lambda: float) -> np.ndarray:
+    """
+    Upper banded form of W + λDᵀD, as expected by `scipy.linalg.cholesky_banded`.
+    :param weights: Weight of every day
+    """
+    size = len(weights)
+    system = np.zeros((3, size))
+    system[2] = weights
+    if size >= 3:
+        system[2, :-2] += smoothing_lambda
+        system[2, 1:-1] += 4 * smoothing_lambda
+        system[2, 2:] += smoothing_lambda
+        system[1, 1:-1] -= 2 * smoothing_lambda
+        system[1, 2:] -= 2 * smoothing_lambda
+        system[0, 2:] = smoothing_lambda
+    return system
+
+
+def _group_by_mask(observed: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Group the pixels on their observation mask.
+    :param observed: Boolean array of shape (pixels, dates)
+    :return: Observation mask and pixel indices of every group
+    """
+    # The masks are packed to bytes to compare them as a single value
+    packed = np.ascontiguousarray(np.packbits(observed, axis=1))
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).reshape(-1)
+    _, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    order = np.argsort(groups, kind="stable")
+    bounds = np.searchsorted(groups[order], np.arange(len(first) + 1))
+    for group, pixel in enumerate(first):
+        yield observed[pixel], order[bounds[group] : bounds[group + 1]]
+
+
+def smooth(
+    values: np.ndarray,
+    days: np.ndarray,
+    smoothing_lambda: Union[float, str] = DEFAULT_LAMBDA,
+    lambdas: Sequence[float] = LAMBDAS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Whittaker smoothing of a batch of time series with missing values.
+
+    With `smoothing_lambda="auto"`, every pixel gets the lambda of `lambdas` that minimizes its generalized
+    cross-validation score GCV = n RSS / (n - tr(H))², with H the hat matrix of the observations. The factorization of
+    a mask and lambda is reused to solve the time series of all pixels and the unit vectors of the observed days, of
+    which the latter give the diagonal of H. A pixel with fewer than MIN_SELECTION_DAYS observed days is smoothed
+    with DEFAULT_LAMBDA instead: the second order penalty does not affect a straight line, so its fit interpolates
+    the observations for every lambda, and the score is undefined as tr(H) = n.
+    :param values: Array of shape (pixels, dates), NaN for missing observations
+    :param days: Day of every date, counted from the first date
+    :param smoothing_lambda: Smoothing parameter, higher values result in smoother time series, or "auto"
+    :param lambdas: Candidate lambdas of the automatic selection
+    :return: Smoothed values at the dates and the lambda of every pixel, NaN for pixels without observations
+    """
+    pixels, dates = values.shape
+    result = np.full((pixels, dates), np.nan)
+    selected = np.full(pixels, np.nan)
+    if pixels == 0 or dates == 0:
+        return result, selected
+
+    auto = smoothing_lambda == "auto"
+    fixed_lambda = DEFAULT_LAMBDA if auto else float(smoothing_lambda)
+    size = int(days.max()) + 1
+
+    for mask, members in _group_by_mask(~np.isnan(values)):
+        observed_days, counts = np.unique(days[mask], return_counts=True)
+        if len(observed_days) == 0:
+            continue
+        select = auto and len(observed_days) >= MIN_SELECTION_DAYS
+        candidates = list(lambdas) if select else [fixed_lambda]
+        if len(observed_days) == 1:
+            # The second order penalty leaves a constant undetermined
+            result[members] = np.nanmean(values[members], axis=1, keepdims=True)
+            selected[members] = fixed_lambda
+            continue
+
+        observations = values[members][:, mask]
+        weights = np.zeros(size)
+        weights[observed_days] = counts
+        right_hand_side = np.zeros((size, len(members)))
+        np.add.at(right_hand_side, days[mask], observations.T)
+        if select:
+            # Unit vectors of the observed days, to get the diagonal of the inverse from the same solve
+            unit_vectors = np.zeros((size, len(observed_days)))
+            unit_vectors[observed_days, np.arange(len(observed_days))] = 1
+            right_hand_side = np.hstack([right_hand_side, unit_vectors])
+
+        best_score = np.full(len(members), np.inf)
+        for candidate in candidates:
+            factor = cholesky_banded(
+                get_banded_system(weights, candidate), check_finite=False
+            )
+            solution = cho_solve_banded(
+                (factor, False), right_hand_side, check_finite=False
+            )
+            smoothed = solution[days, : len(members)].T
+            if not select:
+                result[members] = smoothed
+                selected[members] = candidate
+                continue
+
+            inverse_diagonal = solution[observed_days, len(members) :].diagonal()
+            trace = np.sum(counts * inverse_diagonal)
+            n = mask.sum()
+            residuals = np.sum((observations - smoothed[:, mask]) ** 2, axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                score = n * residuals / (n - trace) ** 2
+            better = score < best_score
+            best_score[better] = score[better]
+            result[members[better]] = smoothed[better]
+            selected[members[better]] = candidate
+    return result, selected
+
+
+def whittaker(
+    array: xr.DataArray,
+    smoothing_lambda: Union[float, str, None] = DEFAULT_LAMBDA,
+    time_dimension: str = "t",
+) -> Tuple[xr.DataArray, xr.DataArray]:
+    """
+    Whittaker smoothing of a data cube along its time dimension.
+    :return: Smoothed data cube and the lambda of every pixel
+    """
+    if smoothing_lambda is None:
+        smoothing_lambda = DEFAULT_LAMBDA
+    dims = array.dims
+    array = array.transpose(..., time_dimension)
+    values = np.asarray(array.values, dtype=np.float64).reshape(
+        -1, array.sizes[time_dimension]
+    )
+    result, selected = smooth(
+        values, get_days(array[time_dimension].values), smoothing_lambda
+    )
+    dtype = array.dtype if np.issubdtype(array.dtype, np.floating) else np.float64
+    smoothed = array.copy(data=result.reshape(array.shape).astype(dtype))
+    lambdas = array.isel({time_dimension: 0}, drop=True).copy(
+        data=selected.reshape(array.shape[:-1]).astype(dtype)
+    )
+    return smoothed.transpose(*dims), lambdas
+
+
+def apply_datacube(cube: XarrayDataCube, context: dict) -> XarrayDataCube:
+    """
+    Apply Whittaker smoothing with context["smoothing_lambda"] along the t dimension. The result has the smoothed
+    time series in the first band and, when the lambda is selected automatically, the lambda of every pixel in a
+    `lambda` band.
+    """
+    array = cube.get_array()
+    if "bands" in array.dims:
+        array = array.isel(bands=0)
+    smoothing_lambda = context.get("smoothing_lambda", DEFAULT_LAMBDA)
+    smoothed, lambdas = whittaker(array, smoothing_lambda)
+    if smoothing_lambda == "auto":
+        result = xr.concat(
+            [smoothed, lambdas.broadcast_like(smoothed)],
+            dim=xr.DataArray(["smoothed", "lambda"], dims="bands"),
+        )
+    else:
+        result = smoothed.expand_dims(bands=["smoothed"])
+    return XarrayDataCube(result.transpose("t", "bands", ...))
+
+
+def load_whittaker_udf() -> str:
+    """
+    Loads an openEO UDF that applies batched Whittaker smoothing.
+    """
+    return Path(__file__).read_text()
@@ -1,22 +1,26 @@
 """ "
 This script generates the OpenEO UDP for the Whittaker algorithm.
-Implemented by https://open-eo.github.io/FuseTS/
+Based on the implementation of https://open-eo.github.io/FuseTS/
 Contact: marketplace@terrascope.be
 """
 
 from pathlib import Path
 import json
+import sys
 
-import openeo
-from fusets.openeo import load_whittakker_udf
 from openeo.api.process import Parameter
-from openeo.processes import apply_dimension
+from openeo.processes import apply_dimension, eq, if_
 from openeo.rest.udp import build_process_dict
 
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from utils.offline_connection import connect_offline  # noqa: E402
+from utils.sentinel2 import load_masked_s2  # noqa: E402
+from utils.whittaker import load_whittaker_udf  # noqa: E402
+
 
 def generate() -> dict:
     print("Generating UDP for Whittaker...")
-    connection = openeo.connect("openeo.dataspace.copernicus.eu")
+    connection = connect_offline("openeo.dataspace.copernicus.eu")
     print("Defining parameters...")
     spatial_extent = Parameter.spatial_extent(
         name="spatial_extent",
@@ -26,48 +30,45 @@ def generate() -> dict:
         name="temporal_extent",
         description="Temporal extent specified as two-element array with start and end date/date-time.",
     )
-    smoothing_lambda = Parameter.integer(
+    smoothing_lambda = Parameter(
         name="smoothing_lambda",
-        description="Smoothing parameter for the Whittaker smoother. Higher values result in a smoother time series. Typical values are between 10 and 100000.",
+        description="Smoothing parameter for the Whittaker smoother. Higher values result in a smoother time series. Typical values are between 10 and 100000. Use 'auto' to select the lambda of every pixel by generalized cross-validation.",
+        schema=[
+            {"type": "number", "exclusiveMinimum": 0},
+            {"type": "string", "enum": ["auto"]},
+        ],
         default=10000,
     )
     print("Loading data...")
-    cube = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
+    cube = load_masked_s2(
+        connection,
         spatial_extent=spatial_extent,
+        temporal_extent=temporal_extent,
         bands=[
             "B04",
             "B08",
         ],
     )
-    scl = connection.load_collection(
-        "SENTINEL2_L2A",
-        temporal_extent=temporal_extent,
-        spatial_extent=spatial_extent,
-        bands=["SCL"],
-    )
-    print("Applying cloud masking and calculating NDVI...")
-    # Apply cloud masking
-    mask = scl.process("to_scl_dilation_mask", data=scl)
-    cube = cube.mask(mask=mask)
     print("Calculating NDVI...")
     base_ndvi = cube.ndvi(red="B04", nir="B08")
+    base_ndvi = base_ndvi.add_dimension("bands", "NDVI", "bands")
 
     whittaker_cube = apply_dimension(
         base_ndvi,
         process=lambda x: x.run_udf(
-            udf=(
-                Path(__file__).parent.parent.parent / "utils" / "set_dependency_path.py"
-            ).read_text()
-            + "\n"
-            + load_whittakker_udf(),
+            udf=load_whittaker_udf(),
             runtime="Python",
             version="3.8",
             context={"smoothing_lambda": smoothing_lambda},
         ),
         dimension="t",
     )
+    # With smoothing_lambda="auto", the UDF adds the selected lambda of every pixel as a band
+    whittaker_cube = if_(
+        eq(smoothing_lambda, "auto"),
+        whittaker_cube.rename_labels(dimension="bands", target=["NDVI", "lambda"]),
+        whittaker_cube.rename_labels(dimension="bands", target=["NDVI"]),
+    )
     print("Applying Whittaker smoothing...")
 
     # Calculate the average time series value for the given area of interest
@@ -81,6 +82,7 @@ def generate() -> dict:
         parameters=[
             spatial_extent,
             temporal_extent,
+            smoothing_lambda,
         ],
     )
 